@@ -0,0 +1,586 @@
+# Benchmarks for the data cleaning functions
+import argparse
+import contextlib
+import datetime as dt
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ChinaCarOwnersNationWide_Juliett_functions import *
+from ChinaCarOwnersNationWide_Juliett_functions import _peak_memory_mb
+
+
+# Per-row email validation as it was implemented before the vectorized engine, kept as the baseline
+def legacy_validate_email_dataframe(df, email_column, null_if_match=None):
+  """Validates emails row by row with Series.apply, rebuilding the regex pattern on every call."""
+
+  def validate_email(email):
+    if email is None or pd.isnull(email):
+      return None
+    email = str(email).lower()
+    if null_if_match and null_if_match in str(email):
+      return None
+    pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
+    if re.fullmatch(pattern, email):
+      return email
+    return None
+
+  df[email_column] = df[email_column].apply(validate_email)
+  return df
+
+
+# Row-wise column combining as it was implemented before the vectorized version, kept as the baseline
+def legacy_combine_columns(df, columns_to_combine, new_column_name, separator=" "):
+  """Combines columns with a per-row apply, creating a Series object for every row."""
+  df[new_column_name] = df[columns_to_combine].apply(lambda row: separator.join(row.dropna().astype(str)), axis=1)
+  return df.drop(columns=columns_to_combine)
+
+
+# Build a chunk of email values with a mix of valid addresses, placeholders, malformed values and nulls
+def make_email_chunk(rows=250000, seed=42):
+  """Creates a DataFrame with a single email column for benchmarking.
+
+  Args:
+    rows: The number of rows to generate.
+    seed: The random seed, so runs are repeatable.
+
+  Returns:
+    A pandas DataFrame with an 'email' column.
+  """
+  rng = np.random.default_rng(seed)
+  choice = rng.integers(0, 10, size=rows)
+  ids = np.arange(rows).astype(str)
+  emails = np.where(choice < 6, np.char.add(np.char.add('Owner.', ids), '@Example.COM'), '')
+  emails = np.where(choice == 6, 'noemail', emails)
+  emails = np.where(choice == 7, np.char.add('broken@@', ids), emails)
+  emails = emails.astype(object)
+  emails[choice >= 8] = None
+  return pd.DataFrame({'email': emails})
+
+
+# Time a cleaning function on a fresh copy of the input and report rows/sec
+def time_rows_per_second(func, df, *args, repeat=3, **kwargs):
+  """Runs func on copies of df and returns the best rows/sec over repeat runs."""
+  best = None
+  for _ in range(repeat):
+    data = df.copy()
+    start = time.perf_counter()
+    func(data, *args, **kwargs)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return len(df) / best
+
+
+def bench_email_validation(rows=250000):
+  """Compares the per-row and vectorized email validators on a 250k-row chunk."""
+  df = make_email_chunk(rows)
+  before = time_rows_per_second(legacy_validate_email_dataframe, df, 'email', 'noemail')
+  after = time_rows_per_second(validate_email_dataframe, df, 'email', 'noemail')
+  print(f"validate_email_dataframe on {rows} rows: before {before:,.0f} rows/sec, after {after:,.0f} rows/sec ({after / before:.1f}x)")
+  return {'rows': rows, 'before_rows_per_sec': before, 'after_rows_per_sec': after}
+
+
+# Build a chunk of address columns with missing values in every column
+def make_address_chunk(rows=250000, seed=42):
+  """Creates a DataFrame with address, province, city and postal_code columns for benchmarking."""
+  rng = np.random.default_rng(seed)
+  provinces = np.array(['北京', '广东', '浙江', '四川', '江苏'], dtype=object)
+  cities = np.array(['北京市', '广州市', '杭州市', '成都市', '南京市'], dtype=object)
+  df = pd.DataFrame({
+      'address': np.char.add('街道', np.arange(rows).astype(str)).astype(object),
+      'province': provinces[rng.integers(0, len(provinces), size=rows)],
+      'city': cities[rng.integers(0, len(cities), size=rows)],
+      'postal_code': rng.integers(100000, 999999, size=rows).astype(float),
+  })
+  for column in df.columns:
+    df.loc[rng.random(rows) < 0.1, column] = np.nan
+  return df
+
+
+def bench_combine_columns(rows=250000):
+  """Compares the row-wise and vectorized combine_columns on a 250k-row chunk."""
+  df = make_address_chunk(rows)
+  columns = ['address', 'province', 'city', 'postal_code']
+
+  before = time_rows_per_second(legacy_combine_columns, df, columns, 'full_address', repeat=1)
+  after = time_rows_per_second(combine_columns, df, columns, 'full_address')
+  print(f"combine_columns on {rows} rows: before {before:,.0f} rows/sec, after {after:,.0f} rows/sec ({after / before:.1f}x)")
+  return {'rows': rows, 'before_rows_per_sec': before, 'after_rows_per_sec': after}
+
+
+# Build a chunk of birth dates in the two formats seen in the source, with a few invalid ones
+def make_date_chunk(rows=250000, seed=42):
+  """Creates a DataFrame with a date_of_birth column for benchmarking."""
+  rng = np.random.default_rng(seed)
+  birth_dates = pd.to_datetime(rng.integers(0, 20000, size=rows), unit='D', origin='1950-01-01')
+  date_of_birth = np.where(rng.random(rows) < 0.8, birth_dates.strftime('%Y-%m-%d'), birth_dates.strftime('%Y/%m/%d')).astype(object)
+  date_of_birth[rng.random(rows) < 0.002] = '1985-02-30'
+  date_of_birth[rng.random(rows) < 0.05] = None
+  return pd.DataFrame({'date_of_birth': pd.array(date_of_birth, dtype=COMPACT_STRING_DTYPE)})
+
+
+def bench_date_normalization(rows=250000):
+  """Compares the inference-based remove_time_from_date with validate_date_columns.
+
+  Checks that they agree wherever remove_time_from_date parsed a date. It infers one format
+  from the first value, so it turns dates in the other format into NaT; the number of such
+  dates is reported.
+  """
+  df = make_date_chunk(rows)
+  expected = remove_time_from_date(df.copy(), ['date_of_birth'])['date_of_birth']
+  actual, _ = validate_date_columns(df.copy(), ['date_of_birth'])
+  expected = expected[actual.index]
+  parsed_before = expected.notna()
+  if not expected[parsed_before].map(lambda value: value.isoformat()).astype(object).equals(actual['date_of_birth'][parsed_before].astype(object)):
+    raise AssertionError("validate_date_columns output differs from remove_time_from_date on the dates both parse.")
+  lost = int((actual['date_of_birth'].notna() & ~parsed_before).sum())
+
+  before = time_rows_per_second(remove_time_from_date, df, ['date_of_birth'], repeat=1)
+  after = time_rows_per_second(validate_date_columns, df, ['date_of_birth'])
+  print(f"date normalization on {rows} rows: before {before:,.0f} rows/sec, after {after:,.0f} rows/sec ({after / before:.1f}x); "
+        f"{lost} valid dates were lost by remove_time_from_date")
+  return {'rows': rows, 'before_rows_per_sec': before, 'after_rows_per_sec': after, 'dates_lost_before': lost}
+
+
+def bench_value_caches(rows=250000, chunks=4):
+  """Times validate_date_columns over consecutive chunks, clearing the value caches before each
+  chunk and keeping them across chunks as one pipeline run does."""
+  frames = [make_date_chunk(rows, seed) for seed in range(chunks)]
+
+  def run(keep_caches):
+    VALUE_CACHES.clear()
+    start = time.perf_counter()
+    for df in frames:
+      if not keep_caches:
+        VALUE_CACHES.clear()
+      validate_date_columns(df.copy(), ['date_of_birth'])
+    return rows * chunks / (time.perf_counter() - start)
+
+  before = run(False)
+  after = run(True)
+  stats = {name: cache.stats() for name, cache in VALUE_CACHES.items()}
+  hit_rate = max((cache['hit_rate'] for cache in stats.values()), default=0.0)
+  print(f"validate_date_columns over {chunks} chunks of {rows} rows: caches cleared per chunk {before:,.0f} rows/sec, "
+        f"kept {after:,.0f} rows/sec ({after / before:.1f}x), hit rate {hit_rate:.0%}")
+  return {'rows': rows, 'chunks': chunks, 'before_rows_per_sec': before, 'after_rows_per_sec': after, 'value_caches': stats}
+
+
+# Build a chunk shaped like the car owner schema, as it looks after the unneeded columns are dropped
+def make_car_owner_chunk(rows=250000, seed=42):
+  """Creates a DataFrame with the ten car owner schema columns for benchmarking."""
+  rng = np.random.default_rng(seed)
+  ids = np.arange(rows).astype(str)
+  provinces = np.array(['北京', '广东', '浙江', '四川', '江苏', '山东', '河南', '湖北'], dtype=object)
+  cities = np.array([f"城市{i}" for i in range(300)], dtype=object)
+  df = pd.DataFrame({
+      'vehicle_identification_number': np.char.add('LSVAG2180E2', np.char.zfill(ids, 6)),
+      'name': np.char.add('姓名', ids),
+      'id_card_number': np.char.add('11010119900101', np.char.zfill(ids, 4))[:rows],
+      'mobile_phone': np.char.add('138', np.char.zfill(ids, 8)),
+      'email': np.char.add(np.char.add('owner', ids), '@example.com'),
+      'province': provinces[rng.integers(0, len(provinces), size=rows)],
+      'city': cities[rng.integers(0, len(cities), size=rows)],
+      'address': np.char.add('街道', ids),
+      'postal_code': rng.integers(100000, 999999, size=rows).astype(str),
+      'date_of_birth': pd.to_datetime(rng.integers(0, 15000, size=rows), unit='D', origin='1960-01-01').strftime('%Y-%m-%d'),
+  })
+  df.loc[rng.random(rows) < 0.05, 'postal_code'] = None
+  return df
+
+
+def bench_schema_memory(rows=250000):
+  """Reports the in-memory size of one chunk loaded with default dtypes and with the car owner schema profile."""
+  with tempfile.TemporaryDirectory() as temp_dir:
+    path = os.path.join(temp_dir, 'chunk.csv')
+    make_car_owner_chunk(rows).to_csv(path, index=False, encoding='utf-8-sig')
+    before = pd.read_csv(path, low_memory=True, encoding='utf-8').memory_usage(deep=True).sum()
+    after = pd.read_csv(path, low_memory=True, encoding='utf-8', **car_owner_read_options()).memory_usage(deep=True).sum()
+  print(f"Memory per {rows}-row chunk: default dtypes {before / 2**20:,.1f} MiB, schema profile {after / 2**20:,.1f} MiB ({before / after:.1f}x smaller)")
+  return {'rows': rows, 'before_bytes': int(before), 'after_bytes': int(after)}
+
+
+# Columns of the raw car-owners-china-v2.csv extract. The raw header ends with a trailing comma, which pandas reads as 'Unnamed: 21'.
+SOURCE_COLUMNS = ['vehicle_identification_number', 'name', 'id_card_number', 'gender', 'mobile_phone', 'email', 'province', 'city',
+                  'address', 'postal_code', 'date_of_birth', 'industry', 'monthly_salary', 'marital_status', 'education', 'brand',
+                  'car_series', 'car_model', 'configuration', 'color', 'engine_number', '']
+
+COLUMNS_TO_DROP = ['gender', 'industry', 'monthly_salary', 'marital_status', 'education', 'brand', 'car_series', 'car_model',
+                   'configuration', 'color', 'engine_number', 'Unnamed: 21']
+DUPLICATE_COLUMNS = ['vehicle_identification_number', 'name', 'id_card_number']
+
+PROVINCE_CITIES = {
+    '北京': ['北京市'], '上海': ['上海市'], '广东': ['广州市', '深圳市', '东莞市', '佛山市'], '浙江': ['杭州市', '宁波市', '温州市'],
+    '江苏': ['南京市', '苏州市', '无锡市'], '四川': ['成都市', '绵阳市'], '山东': ['济南市', '青岛市', '烟台市'], '河南': ['郑州市', '洛阳市'],
+    '湖北': ['武汉市', '宜昌市'], '湖南': ['长沙市', '株洲市'], '福建': ['福州市', '厦门市'], '辽宁': ['沈阳市', '大连市'],
+}
+VIN_CHARACTERS = np.array(list('ABCDEFGHJKLMNPRSTUVWXYZ0123456789'))
+
+
+def _random_strings(rng, alphabet, rows, length):
+  """Returns an array of random fixed-length strings drawn from alphabet."""
+  picks = alphabet[rng.integers(0, len(alphabet), size=(rows, length))]
+  return picks.view(f'<U{length}').ravel()
+
+
+def _id_card_numbers(rng, birth_dates):
+  """Returns 18-digit resident ID numbers with a valid region code, the given birth dates and the GB 11643 check character."""
+  rows = len(birth_dates)
+  region = ID_CARD_REGION_PREFIXES[rng.integers(0, len(ID_CARD_REGION_PREFIXES), size=rows)] * 10000 + rng.integers(0, 10000, size=rows)
+  bodies = np.char.add(np.char.add(region.astype(str), birth_dates.strftime('%Y%m%d').to_numpy(dtype=str)),
+                       np.char.zfill(rng.integers(0, 1000, size=rows).astype(str), 3)).astype('<U17')
+  digits = bodies.view(np.uint32).reshape(rows, 17).astype(np.int64) - ord('0')
+  check_characters = ID_CARD_CHECK_CHARACTERS[(digits @ ID_CARD_WEIGHTS) % 11].astype(np.uint32).view('<U1')
+  return np.char.add(bodies, check_characters)
+
+
+def _vins(rng, rows):
+  """Returns random VINs with the ISO 3779 check digit in position 9."""
+  codes = _random_strings(rng, VIN_CHARACTERS, rows, 17).view(np.uint32).reshape(rows, 17).copy()
+  codes[:, 8] = VIN_CHECK_CHARACTERS[(VIN_CHARACTER_VALUES[codes].astype(np.int64) @ VIN_WEIGHTS) % 11]
+  return codes.view('<U17').ravel()
+
+
+def _generate_block(rng, start_row, rows, rates):
+  """Generates one block of raw source rows as a DataFrame plus the positions of rows to make ragged."""
+  ids = np.arange(start_row, start_row + rows).astype(str)
+  provinces = np.array(list(PROVINCE_CITIES), dtype=object)
+  province = provinces[rng.integers(0, len(provinces), size=rows)]
+  city = np.array([cities[i % len(cities)] for cities, i in zip((PROVINCE_CITIES[p] for p in province), rng.integers(0, 4, size=rows))], dtype=object)
+
+  birth_dates = pd.to_datetime(rng.integers(0, 20000, size=rows), unit='D', origin='1950-01-01')
+  id_card_number = _id_card_numbers(rng, birth_dates).astype(object)
+  vin = _vins(rng, rows).astype(object)
+  email = np.char.add(np.char.add('owner', ids), '@example.com').astype(object)
+
+  roll = rng.random(rows)
+  email[roll < rates['noemail']] = 'noemail'
+  malformed = (roll >= rates['noemail']) & (roll < rates['noemail'] + rates['malformed_email'])
+  email[malformed] = np.char.add('owner@@', ids[malformed])
+  bad_vin = rng.random(rows) < rates['bad_vin']
+  vin[bad_vin] = np.char.add('LSV-', ids[bad_vin])
+  bad_id = rng.random(rows) < rates['bad_id']
+  id_card_number[bad_id] = np.char.add('ID#', ids[bad_id])
+
+  postal_code = rng.integers(100000, 860000, size=rows).astype(str).astype(object)
+  postal_code[rng.random(rows) < 0.05] = None
+  date_formats = np.where(rng.random(rows) < 0.8, '%Y-%m-%d', '%Y/%m/%d')
+  date_of_birth = np.where(date_formats == '%Y-%m-%d', birth_dates.strftime('%Y-%m-%d').to_numpy(dtype=str), birth_dates.strftime('%Y/%m/%d').to_numpy(dtype=str))
+
+  df = pd.DataFrame({
+      'vehicle_identification_number': vin,
+      'name': np.char.add('车主', np.char.zfill((rng.integers(0, max(rows, 1), size=rows) + start_row).astype(str), 7)),
+      'id_card_number': id_card_number,
+      'gender': np.where(rng.random(rows) < 0.5, 'M', 'F'),
+      'mobile_phone': np.char.add('1', rng.integers(3000000000, 9999999999, size=rows).astype(str)),
+      'email': email,
+      'province': province,
+      'city': city,
+      'address': np.char.add(np.char.add('幸福路', rng.integers(1, 999, size=rows).astype(str)), '号'),
+      'postal_code': postal_code,
+      'date_of_birth': date_of_birth,
+      'industry': '制造业', 'monthly_salary': rng.integers(3000, 50000, size=rows), 'marital_status': '已婚', 'education': '本科',
+      'brand': '大众', 'car_series': '朗逸', 'car_model': '1.6L', 'configuration': '舒适版', 'color': '白色',
+      'engine_number': _random_strings(rng, VIN_CHARACTERS, rows, 8),
+      '': '',
+  })
+
+  # Copy whole earlier rows from this block to create duplicate keys
+  duplicate_positions = np.flatnonzero(rng.random(rows) < rates['duplicate'])
+  duplicate_positions = duplicate_positions[duplicate_positions > 0]
+  if len(duplicate_positions):
+    sources = (rng.random(len(duplicate_positions)) * duplicate_positions).astype(int)
+    df.iloc[duplicate_positions] = df.iloc[sources].to_numpy()
+
+  ragged_positions = np.flatnonzero(rng.random(rows) < rates['ragged'])
+
+  # Impossible calendar dates and dates in the future, drawn last so the other columns do not change with the rate
+  bad_date = np.flatnonzero(rng.random(rows) < rates['bad_date'])
+  df.loc[df.index[bad_date], 'date_of_birth'] = np.where(bad_date % 2, '1985-02-30', '2999-01-01')
+
+  # Wrong check characters, drawn after the dates for the same reason: the check character is replaced by the next one in '0123456789X'
+  check_alphabet = '0123456789X'
+  for column, position in (('id_card_number', 17), ('vehicle_identification_number', 8)):
+    bad_check = np.flatnonzero(rng.random(rows) < rates['bad_check_digit'])
+    values = df[column].to_numpy(dtype=object)[bad_check]
+    df.loc[df.index[bad_check], column] = [value[:position] + check_alphabet[(check_alphabet.find(value[position]) + 1) % 11] + value[position + 1:]
+                                           if len(value) > position else value for value in values]
+  return df, ragged_positions
+
+
+# Write a deterministic synthetic extract shaped like car-owners-china-v2.csv
+def generate_car_owners_csv(output_csv, rows, seed=42, duplicate_rate=0.03, noemail_rate=0.2, malformed_email_rate=0.03,
+                            bad_vin_rate=0.005, bad_id_rate=0.005, bad_date_rate=0.002, bad_check_digit_rate=0.002, ragged_rate=0.0, block_rows=200000):
+  """Writes a synthetic car owner CSV with the same columns as car-owners-china-v2.csv.
+
+  The same seed and arguments always produce the same file. Rows are generated in
+  blocks, so files of any size can be written with bounded memory.
+
+  Args:
+    output_csv: The path to the output CSV file. It is compressed if it ends in .gz or .zst.
+    rows: The number of data rows to write.
+    seed: The random seed.
+    duplicate_rate: Share of rows that repeat an earlier row (same dedup key).
+    noemail_rate: Share of rows with the 'noemail' placeholder.
+    malformed_email_rate: Share of rows with a malformed email address.
+    bad_vin_rate: Share of rows with a non-alphanumeric VIN.
+    bad_id_rate: Share of rows with a non-alphanumeric ID card number.
+    bad_date_rate: Share of rows with an impossible or future date of birth.
+    bad_check_digit_rate: Share of rows with a wrong ID card number check character, and separately
+      of rows with a wrong VIN check digit. Other VINs and ID card numbers have valid check characters.
+    ragged_rate: Share of rows written with a missing or extra field.
+    block_rows: The number of rows generated and written at a time.
+  """
+  rates = {'duplicate': duplicate_rate, 'noemail': noemail_rate, 'malformed_email': malformed_email_rate,
+           'bad_vin': bad_vin_rate, 'bad_id': bad_id_rate, 'bad_date': bad_date_rate, 'bad_check_digit': bad_check_digit_rate,
+           'ragged': ragged_rate}
+  print(f"Generating {rows} synthetic rows in {output_csv} (seed {seed}).")
+  logging.info(f"Generating {rows} synthetic rows in {output_csv} (seed {seed}).")
+
+  with open_compressed(output_csv, 'w', newline='', encoding='utf-8') as handle:
+    handle.write(','.join(SOURCE_COLUMNS) + '\n')
+    for block_index, start_row in enumerate(range(0, rows, block_rows)):
+      rng = np.random.default_rng([seed, block_index])
+      df, ragged_positions = _generate_block(rng, start_row, min(block_rows, rows - start_row), rates)
+      lines = df.to_csv(index=False, header=False, lineterminator='\n').split('\n')[:-1]
+      for position in ragged_positions:
+        lines[position] = lines[position] + ',extra' if position % 2 else lines[position].rsplit(',', 2)[0]
+      handle.write('\n'.join(lines) + '\n')
+
+
+# Share of ragged rows in the suite's generated source, about one row in a thousand as in real extracts
+SUITE_RAGGED_RATE = 0.001
+
+# Benchmark cases, run in the same work directory. Cases that read files other cases write list them in CASE_INPUTS.
+# File cases time the whole function; frame cases load the deduplicated data first and time only the function call.
+# The source has ragged rows, so the cases that read it with pd.read_csv read the quarantine step's well-formed copy instead.
+def _load_valid_frame():
+  return pd.read_csv('car-owners-china_valid.csv', low_memory=True, encoding='utf-8', **car_owner_read_options())
+
+BENCHMARK_CASES = {
+    'quarantine_malformed_rows': lambda: quarantine_malformed_rows('car-owners-china-v2.csv', 'car-owners-china_wellformed.csv', 'car-owners-china_malformed.csv'),
+    'quarantine_malformed_rows_parallel': lambda: quarantine_malformed_rows('car-owners-china-v2.csv', 'car-owners-china_wellformed.csv', 'car-owners-china_malformed.csv',
+                                                                           workers=os.cpu_count()),
+    'process_drop_cols_csv': lambda: process_drop_cols_csv('car-owners-china_wellformed.csv', 'car-owners-china-v3.csv', COLUMNS_TO_DROP),
+    'process_duplicates_csv': lambda: process_duplicates_csv('car-owners-china-v3.csv', 'car-owners-china_valid.csv', 'car-owners-china_duplicate_data.csv', DUPLICATE_COLUMNS),
+    'process_duplicates_csv_chunked': lambda: process_duplicates_csv('car-owners-china-v3.csv', 'car-owners-china_valid_chunked.csv', 'car-owners-china_duplicate_data_chunked.csv', DUPLICATE_COLUMNS, chunksize=250000),
+    'split_csv_into_chunks': lambda: split_csv_into_chunks('car-owners-china_valid.csv', 250000, 'chunks'),
+    'split_csv_by_byte_ranges': lambda: split_csv_by_byte_ranges('car-owners-china_valid.csv', 'byte_chunks'),
+    'split_csv_by_byte_ranges_gzip': lambda: split_csv_by_byte_ranges('car-owners-china_valid.csv', 'gzip_chunks', compression='gzip'),
+    'process_csv_byte_ranges': lambda: process_csv_byte_ranges('car-owners-china_valid.csv', 'cleaned_byte_chunks', 'error_byte_chunks'),
+    'process_chunked_csvs_output_folders': lambda: process_chunked_csvs_output_folders('chunks', 'cleaned_chunks', 'error_chunks'),
+    'process_chunked_csvs_output_folders_pipelined': lambda: process_chunked_csvs_output_folders('chunks', 'cleaned_chunks_pipelined', 'error_chunks_pipelined', pipelined=True),
+    'process_chunked_csvs_output_folders_gzip': lambda: process_chunked_csvs_output_folders('gzip_chunks', 'cleaned_chunks_gzip', 'error_chunks_gzip', compression='gzip'),
+    'process_chunked_csvs': lambda: process_chunked_csvs('chunks', 'final_valid_data.csv', 'final_error_data.csv'),
+    'process_chunked_csvs_pipelined': lambda: process_chunked_csvs('chunks', 'final_valid_data_pipelined.csv', 'final_error_data_pipelined.csv', pipelined=True),
+    'process_chunked_csvs_partitioned': lambda: process_chunked_csvs('chunks', 'final_valid_data_partitioned', 'final_error_data_partitioned', partition_by=['province', 'city']),
+    'combine_csv_chunks': lambda: combine_csv_chunks('cleaned_chunks', 'combined_cleaned_data.csv'),
+    'remove_duplicate_records': ('frame', lambda df: remove_duplicate_records(df, DUPLICATE_COLUMNS)),
+    'validate_email_dataframe': ('frame', lambda df: validate_email_dataframe(df, 'email', 'noemail')),
+    'validate_and_remove_invalid_emails': ('frame', lambda df: validate_and_remove_invalid_emails(df, 'email')),
+    'combine_columns': ('frame', lambda df: combine_columns(df, ['address', 'province', 'city', 'postal_code'], 'full_address')),
+    'validate_alphanumeric_columns': ('frame', lambda df: validate_alphanumeric_columns(df, ['vehicle_identification_number', 'id_card_number'])),
+    'validate_identifier_columns': ('frame', lambda df: validate_identifier_columns(df)),
+    'remove_time_from_date': ('frame', lambda df: remove_time_from_date(df, ['date_of_birth'])),
+    'validate_date_columns': ('frame', lambda df: validate_date_columns(df, ['date_of_birth'])),
+    'clean_chunk_dataframe': ('frame', lambda df: clean_chunk_dataframe(df)),
+    'estimate_data_quality': lambda: estimate_data_quality('car-owners-china-v2.csv', COLUMNS_TO_DROP, DUPLICATE_COLUMNS),
+    'main_pipeline': lambda: process_car_owners_pipeline('car-owners-china_wellformed.csv', 'pipeline_valid_data.csv', 'pipeline_error_data.csv',
+                                                         'pipeline_duplicate_data.csv', COLUMNS_TO_DROP, DUPLICATE_COLUMNS),
+    'main_pipeline_quarantine': lambda: process_car_owners_pipeline('car-owners-china-v2.csv', 'pipeline_valid_data.csv', 'pipeline_error_data.csv',
+                                                                    'pipeline_duplicate_data.csv', COLUMNS_TO_DROP, DUPLICATE_COLUMNS,
+                                                                    quarantine_csv='pipeline_malformed_data.csv', workers=os.cpu_count()),
+}
+
+# The files and folders each case reads besides the source CSV, and the case that writes each of them.
+# Frame cases all read the deduplicated data.
+SOURCE_CSV = 'car-owners-china-v2.csv'
+WELLFORMED_CSV = 'car-owners-china_wellformed.csv'
+VALID_CSV = 'car-owners-china_valid.csv'
+CASE_INPUTS = {
+    'process_drop_cols_csv': [WELLFORMED_CSV],
+    'process_duplicates_csv': ['car-owners-china-v3.csv'],
+    'process_duplicates_csv_chunked': ['car-owners-china-v3.csv'],
+    'split_csv_into_chunks': [VALID_CSV],
+    'split_csv_by_byte_ranges': [VALID_CSV],
+    'split_csv_by_byte_ranges_gzip': [VALID_CSV],
+    'process_csv_byte_ranges': [VALID_CSV],
+    'process_chunked_csvs_output_folders': ['chunks'],
+    'process_chunked_csvs_output_folders_pipelined': ['chunks'],
+    'process_chunked_csvs_output_folders_gzip': ['gzip_chunks'],
+    'process_chunked_csvs': ['chunks'],
+    'process_chunked_csvs_pipelined': ['chunks'],
+    'process_chunked_csvs_partitioned': ['chunks'],
+    'combine_csv_chunks': ['cleaned_chunks'],
+    'main_pipeline': [WELLFORMED_CSV],
+}
+INPUT_WRITERS = {
+    WELLFORMED_CSV: 'quarantine_malformed_rows',
+    'car-owners-china-v3.csv': 'process_drop_cols_csv',
+    VALID_CSV: 'process_duplicates_csv',
+    'chunks': 'split_csv_into_chunks',
+    'gzip_chunks': 'split_csv_by_byte_ranges_gzip',
+    'cleaned_chunks': 'process_chunked_csvs_output_folders',
+}
+
+
+def case_inputs(name):
+  """Returns the files and folders a benchmark case reads, source CSV included."""
+  if isinstance(BENCHMARK_CASES[name], tuple):
+    return [SOURCE_CSV, VALID_CSV]
+  return [SOURCE_CSV] + CASE_INPUTS.get(name, [])
+
+
+def _run_case_process(name, rows, work_dir):
+  """Runs one benchmark case in a fresh interpreter in work_dir and returns the completed process."""
+  return subprocess.run([sys.executable, os.path.abspath(__file__), '--case', name, '--rows', str(rows)],
+                        cwd=work_dir, capture_output=True, text=True)
+
+
+def prepare_case_inputs(name, rows, work_dir, seed=42, ragged_rate=SUITE_RAGGED_RATE):
+  """Writes any input of a case that is missing from work_dir, by generating the source or running the case that writes it.
+
+  The writing cases run in their own interpreters, like timed cases, and are not timed.
+  """
+  for path in case_inputs(name):
+    if os.path.exists(os.path.join(work_dir, path)):
+      continue
+    if path == SOURCE_CSV:
+      generate_car_owners_csv(os.path.join(work_dir, path), rows, seed=seed, ragged_rate=ragged_rate)
+      continue
+    writer = INPUT_WRITERS[path]
+    prepare_case_inputs(writer, rows, work_dir, seed, ragged_rate)
+    print(f"Preparing {path} for {name} with the {writer} case.")
+    completed = _run_case_process(writer, rows, work_dir)
+    if completed.returncode != 0:
+      raise RuntimeError(f"Could not prepare {path} for {name}: {completed.stderr.strip()}")
+
+
+def run_benchmark_case(name, rows):
+  """Runs one benchmark case in the current directory and returns its timing and peak memory.
+
+  Raises:
+    FileNotFoundError: If an input of the case is missing. prepare_case_inputs writes them.
+  """
+  case = BENCHMARK_CASES[name]
+  missing = [path for path in case_inputs(name) if not os.path.exists(path)]
+  if missing:
+    raise FileNotFoundError(f"Benchmark case {name} needs {missing} in {os.getcwd()}. Run it through --suite, which writes them first.")
+  with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    if isinstance(case, tuple):
+      df = _load_valid_frame()
+      start_wall, start_cpu = time.perf_counter(), time.process_time()
+      case[1](df)
+    else:
+      start_wall, start_cpu = time.perf_counter(), time.process_time()
+      case()
+    seconds = time.perf_counter() - start_wall
+    cpu_seconds = time.process_time() - start_cpu
+  return {'case': name, 'rows': rows, 'seconds': seconds, 'cpu_seconds': cpu_seconds,
+          'rows_per_sec': rows / seconds if seconds else None, 'peak_rss_mb': _peak_memory_mb()}
+
+
+# Run every case at every size, each case in a fresh interpreter so peak RSS is measured per case
+def run_benchmark_suite(sizes=(100000, 1000000, 10000000), output_json='benchmark_results.json', work_dir='benchmark_data', seed=42, cases=None,
+                        ragged_rate=SUITE_RAGGED_RATE):
+  """Generates synthetic inputs, times every case at every size and writes the results as JSON.
+
+  Args:
+    sizes: The row counts to benchmark.
+    output_json: The path to the JSON results file.
+    work_dir: The directory for generated inputs and outputs. Generated inputs are reused between runs.
+    seed: The random seed for the generated inputs.
+    cases: Optional list of case names to run. Defaults to all cases. Inputs that the listed cases read
+      from other cases are written first when they are missing.
+    ragged_rate: The share of rows of the generated source written with a missing or extra field.
+
+  Returns:
+    The results dict that was written to output_json.
+  """
+  results = []
+  for rows in sizes:
+    size_dir = os.path.abspath(os.path.join(work_dir, f"{rows}_rows"))
+    os.makedirs(size_dir, exist_ok=True)
+
+    for name in cases or BENCHMARK_CASES:
+      try:
+        prepare_case_inputs(name, rows, size_dir, seed, ragged_rate)
+      except Exception as e:
+        print(f"Benchmark case {name} at {rows} rows failed: {e}")
+        results.append({'case': name, 'rows': rows, 'error': str(e)})
+        continue
+      completed = _run_case_process(name, rows, size_dir)
+      if completed.returncode != 0:
+        print(f"Benchmark case {name} at {rows} rows failed: {completed.stderr.strip()}")
+        results.append({'case': name, 'rows': rows, 'error': completed.stderr.strip()})
+        continue
+      result = json.loads(completed.stdout.strip().splitlines()[-1])
+      print(f"{name} at {rows} rows: {result['seconds']:.2f}s, {result['rows_per_sec']:,.0f} rows/sec, peak RSS {result['peak_rss_mb']:,.0f} MiB")
+      results.append(result)
+
+  report = {'timestamp': dt.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'pandas': pd.__version__, 'numpy': np.__version__, 'seed': seed, 'ragged_rate': ragged_rate, 'results': results}
+  with open(output_json, 'w', encoding='utf-8') as f:
+    json.dump(report, f, indent=2)
+  print(f"Benchmark results saved to {output_json}.")
+  return report
+
+
+# Compare two benchmark result files and list the cases that got slower or used more memory
+def compare_benchmark_results(baseline_json, current_json, threshold=0.1):
+  """Prints and returns the cases whose rows/sec dropped or peak RSS grew by more than threshold."""
+  with open(baseline_json, encoding='utf-8') as f:
+    baseline = {(r['case'], r['rows']): r for r in json.load(f)['results'] if 'error' not in r}
+  with open(current_json, encoding='utf-8') as f:
+    current = {(r['case'], r['rows']): r for r in json.load(f)['results'] if 'error' not in r}
+
+  regressions = []
+  for key in sorted(baseline.keys() & current.keys()):
+    before, after = baseline[key], current[key]
+    speed_change = after['rows_per_sec'] / before['rows_per_sec'] - 1
+    memory_change = after['peak_rss_mb'] / before['peak_rss_mb'] - 1
+    print(f"{key[0]} at {key[1]} rows: rows/sec {speed_change:+.1%}, peak RSS {memory_change:+.1%}")
+    if speed_change < -threshold or memory_change > threshold:
+      regressions.append({'case': key[0], 'rows': key[1], 'rows_per_sec_change': speed_change, 'peak_rss_change': memory_change})
+  print(f"{len(regressions)} regressions beyond {threshold:.0%}.")
+  return regressions
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmarks for the China car owners cleaning functions.')
+  parser.add_argument('--suite', action='store_true', help='Run the full benchmark suite on generated data.')
+  parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000, 10000000], help='Row counts for the suite.')
+  parser.add_argument('--output', default='benchmark_results.json', help='JSON file for the suite results.')
+  parser.add_argument('--work-dir', default='benchmark_data', help='Directory for generated inputs and outputs.')
+  parser.add_argument('--seed', type=int, default=42, help='Random seed for generated data.')
+  parser.add_argument('--ragged-rate', type=float, default=SUITE_RAGGED_RATE, help='Share of generated rows with a missing or extra field.')
+  parser.add_argument('--cases', nargs='+', help='Only run these suite cases.')
+  parser.add_argument('--generate', metavar='CSV', help='Only write a synthetic CSV of --rows rows to this path.')
+  parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two suite result files.')
+  parser.add_argument('--case', help=argparse.SUPPRESS)
+  parser.add_argument('--rows', type=int, default=100000, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.case:
+    print(json.dumps(run_benchmark_case(args.case, args.rows)))
+  elif args.generate:
+    generate_car_owners_csv(args.generate, args.rows, seed=args.seed, ragged_rate=args.ragged_rate)
+  elif args.compare:
+    compare_benchmark_results(*args.compare)
+  elif args.suite:
+    run_benchmark_suite(args.sizes, args.output, args.work_dir, args.seed, args.cases, args.ragged_rate)
+  else:
+    logging.disable(logging.INFO)
+    bench_email_validation()
+    bench_combine_columns()
+    bench_date_normalization()
+    bench_value_caches()
+    bench_schema_memory()
@@ -1,36 +1,579 @@
 # Import Necessary Libraries
 import csv
+import numpy as np
 import pandas as pd
 import re
+import sqlite3
 import unicodedata
 import os
 import logging
 import datetime as dt
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import multiprocessing
+import cProfile
+import time
+import tracemalloc
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # All Functions
 # Setup logging
 logging.basicConfig(filename='processing_log.txt', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Regex pattern for valid email addresses, compiled once and shared by the email validators
+EMAIL_PATTERN = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
+EMAIL_REGEX = re.compile(EMAIL_PATTERN)
+
+# Arrow-backed strings take much less memory than Python string objects; fall back to pandas' own string dtype without pyarrow
+try:
+  import pyarrow
+  import pyarrow.compute
+  COMPACT_STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+  COMPACT_STRING_DTYPE = 'string'
+
+# Column dtypes for the car owner schema. province and city have very few distinct values, so they load as categories.
+# postal_code and mobile_phone load as text so they keep leading zeros and are not turned into floats when a value is missing.
+CAR_OWNER_DTYPES = {
+    'vehicle_identification_number': COMPACT_STRING_DTYPE,
+    'name': COMPACT_STRING_DTYPE,
+    'id_card_number': COMPACT_STRING_DTYPE,
+    'mobile_phone': COMPACT_STRING_DTYPE,
+    'email': COMPACT_STRING_DTYPE,
+    'province': 'category',
+    'city': 'category',
+    'address': COMPACT_STRING_DTYPE,
+    'postal_code': COMPACT_STRING_DTYPE,
+    'date_of_birth': COMPACT_STRING_DTYPE,
+}
+
+# Date formats tried when detecting the formats of a date column, most common in the source extracts first
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y%m%d', '%Y.%m.%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%d/%m/%Y', '%m/%d/%Y')
+
+# Format pairs that read the same string as two different dates, such as 03/04/1985 day-first and month-first
+AMBIGUOUS_DATE_FORMATS = (('%d/%m/%Y', '%m/%d/%Y'),)
+
+# Date columns normalized by the chunk cleaning steps
+DEFAULT_DATE_COLUMNS = ('date_of_birth',)
+
+# Number of leading rows of a chunk sampled to detect its date formats
+DATE_DETECTION_ROWS = 20000
+
+# Identifier columns given structural checks by the chunk cleaning steps
+ID_CARD_COLUMNS = ('id_card_number',)
+VIN_COLUMNS = ('vehicle_identification_number',)
+
+# GB 11643-1999 resident ID numbers: weights of the first 17 digits, and the check character for each remainder mod 11
+ID_CARD_WEIGHTS = np.array([7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2])
+ID_CARD_CHECK_CHARACTERS = np.array([ord(character) for character in '10X98765432'])
+
+# Province-level region codes, the first two digits of a resident ID number (83 is used on Taiwan residence permits)
+ID_CARD_REGION_PREFIXES = np.array([11, 12, 13, 14, 15, 21, 22, 23, 31, 32, 33, 34, 35, 36, 37, 41, 42, 43, 44, 45, 46,
+                                    50, 51, 52, 53, 54, 61, 62, 63, 64, 65, 71, 81, 82, 83])
+KNOWN_ID_CARD_REGIONS = np.zeros(100, dtype=bool)
+KNOWN_ID_CARD_REGIONS[ID_CARD_REGION_PREFIXES] = True
+
+# ISO 3779 VINs: the weight of each position, the check character for each remainder mod 11, and the value of each
+# character code, upper or lower case (-1 for characters not allowed, including I, O and Q)
+VIN_WEIGHTS = np.array([8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2])
+VIN_CHECK_CHARACTERS = np.array([ord(character) for character in '0123456789X'])
+VIN_CHARACTER_VALUES = np.full(256, -1, dtype=np.int8)
+VIN_CHARACTER_VALUES[[ord(character) for character in '0123456789']] = np.arange(10)
+for letters in ('ABCDEFGHJKLMNPRSTUVWXYZ', 'abcdefghjklmnprstuvwxyz'):
+  VIN_CHARACTER_VALUES[[ord(character) for character in letters]] = [1, 2, 3, 4, 5, 6, 7, 8, 1, 2, 3, 4, 5, 7, 9, 2, 3, 4, 5, 6, 7, 8, 9]
+
+def car_owner_read_options(columns_to_drop=None, string_columns=()):
+  """Returns pd.read_csv keyword arguments that load the car owner schema compactly.
+
+  Args:
+    columns_to_drop: An optional list of column names that should never be parsed.
+    string_columns: Extra column names to load as text, for columns outside the schema.
+
+  Returns:
+    A dict with 'dtype' and, when columns_to_drop is given, 'usecols'.
+  """
+  dtypes = dict(CAR_OWNER_DTYPES)
+  for column in string_columns:
+    dtypes.setdefault(column, COMPACT_STRING_DTYPE)
+  options = {'dtype': dtypes}
+  if columns_to_drop:
+    dropped = set(columns_to_drop)
+    options['usecols'] = lambda column: column not in dropped
+  return options
+
+# Console verbosity. Per-chunk and per-stage messages are only printed while PRINT_DETAIL is True; errors and run-level messages are always printed.
+PRINT_DETAIL = True
+
+def set_verbosity(verbose=True, log_level=None):
+  """Turns per-chunk/per-stage console messages on or off and optionally sets the log file level.
+
+  Args:
+    verbose: If False, per-chunk and per-stage messages are no longer printed.
+    log_level: An optional logging level (e.g. logging.WARNING) for processing_log.txt.
+  """
+  global PRINT_DETAIL
+  PRINT_DETAIL = verbose
+  if log_level is not None:
+    logging.getLogger().setLevel(log_level)
+
+def print_detail(message):
+  """Prints a per-chunk or per-stage message unless detail printing has been turned off."""
+  if PRINT_DETAIL:
+    print(message)
+
+def _peak_memory_mb():
+  """Returns the peak resident set size of this process so far in MiB, or None where it cannot be read."""
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1]) / 2**10
+  except OSError:
+    pass
+  try:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if os.uname().sysname == 'Darwin' else peak / 2**10
+  except ImportError:
+    return None
+
+# Collects per-stage timings, row counts and memory for a run and writes them as a JSON report
+class RunMetrics:
+  """Per-stage metrics for a cleaning run.
+
+  Pass an instance as the metrics argument of the processing functions, then call
+  finish() to write the run report (and the cProfile dump, if enabled). Stages with
+  the same name are aggregated: wall and CPU time and row counts are summed, peak
+  memory is the maximum seen. Stages may be recorded from several threads.
+
+  CPU time is that of the thread running the stage, so stages that overlap on pipeline threads
+  do not count each other's work. It leaves out work handed to native thread pools, e.g. Arrow
+  reads. peak_memory_mb is the process high-water mark when the stage ended. tracemalloc peaks
+  are process-wide too, so once two stages have overlapped they are no longer recorded per stage,
+  only for the whole run (traced_peak_mb in the report).
+
+  Args:
+    report_path: Optional path of the JSON run report written by finish().
+    profile_path: Optional path of a cProfile stats dump written by finish().
+    trace_memory: If True, also record each stage's peak Python/NumPy allocations with
+      tracemalloc. This is accurate per stage but slows the run down noticeably.
+  """
+
+  def __init__(self, report_path=None, profile_path=None, trace_memory=False):
+    self.report_path = report_path
+    self.profile_path = profile_path
+    self.trace_memory = trace_memory
+    self.stages = {}
+    self.lock = threading.Lock()
+    self.active_stages = 0
+    self.overlapping = False
+    self.traced_peak_mb = None
+    self.started = time.perf_counter()
+    self.profiler = None
+    if profile_path:
+      self.profiler = cProfile.Profile()
+      self.profiler.enable()
+    if trace_memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def stage(self, name, rows_in=0):
+    """Returns a context manager that times one run of a stage. Set rows_out and rows_rejected on it."""
+    return StageTimer(self, name, rows_in)
+
+  def record(self, name, wall_seconds, cpu_seconds, rows_in, rows_out, rows_rejected, peak_memory_mb, traced_peak_mb=None):
+    """Adds one stage run to the aggregated metrics."""
+    with self.lock:
+      stage = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                                            'rows_rejected': 0, 'peak_memory_mb': None, 'traced_peak_mb': None})
+      stage['calls'] += 1
+      stage['wall_seconds'] += wall_seconds
+      stage['cpu_seconds'] += cpu_seconds
+      stage['rows_in'] += int(rows_in)
+      stage['rows_out'] += int(rows_out)
+      stage['rows_rejected'] += int(rows_rejected)
+      for key, value in (('peak_memory_mb', peak_memory_mb), ('traced_peak_mb', traced_peak_mb)):
+        if value is not None:
+          stage[key] = value if stage[key] is None else max(stage[key], value)
+
+  def merge(self, stages):
+    """Adds stage metrics collected elsewhere, e.g. returned by a worker process."""
+    with self.lock:
+      for name, other in stages.items():
+        stage = self.stages.setdefault(name, dict(other, calls=0, wall_seconds=0.0, cpu_seconds=0.0, rows_in=0, rows_out=0, rows_rejected=0))
+        for key in ('calls', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'rows_rejected'):
+          stage[key] += other[key]
+        for key in ('peak_memory_mb', 'traced_peak_mb'):
+          if other.get(key) is not None:
+            stage[key] = other[key] if stage.get(key) is None else max(stage[key], other[key])
+
+  def report(self):
+    """Returns the run report as a dict."""
+    report = {'wall_seconds': time.perf_counter() - self.started, 'peak_memory_mb': _peak_memory_mb(), 'stages': self.stages,
+              'value_caches': {name: cache.stats() for name, cache in VALUE_CACHES.items()}}
+    if self.trace_memory and tracemalloc.is_tracing():
+      report['traced_peak_mb'] = max(self.traced_peak_mb or 0.0, tracemalloc.get_traced_memory()[1] / 2**20)
+    return report
+
+  def _start_stage(self):
+    """Counts a stage as running and returns True if no other stage is running alongside it."""
+    with self.lock:
+      self.active_stages += 1
+      if self.active_stages > 1:
+        self.overlapping = True
+      return self.active_stages == 1
+
+  def _end_stage(self):
+    """Counts a stage as finished and returns its tracemalloc peak, or None if it is not a per-stage figure."""
+    with self.lock:
+      self.active_stages -= 1
+      if not self.trace_memory:
+        return None
+      peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+      self.traced_peak_mb = peak_mb if self.traced_peak_mb is None else max(self.traced_peak_mb, peak_mb)
+      return None if self.overlapping else peak_mb
+
+  def finish(self):
+    """Stops profiling and writes the run report and the cProfile dump, if their paths are set."""
+    report = self.report()
+    if self.profiler:
+      self.profiler.disable()
+      self.profiler.dump_stats(self.profile_path)
+      print(f"cProfile stats saved to {self.profile_path}.")
+      logging.info(f"cProfile stats saved to {self.profile_path}.")
+    if self.report_path:
+      with open(self.report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+      print(f"Run report saved to {self.report_path}.")
+      logging.info(f"Run report saved to {self.report_path}.")
+    return report
+
+# Times one run of a stage. Works without a RunMetrics too, so call sites do not need to check for one.
+class StageTimer:
+  """Context manager that measures one stage run and records it on a RunMetrics, if there is one."""
+
+  def __init__(self, metrics, name, rows_in=0):
+    self.metrics = metrics
+    self.name = name
+    self.rows_in = rows_in
+    self.rows_out = None
+    self.rows_rejected = 0
+
+  def __enter__(self):
+    if self.metrics is not None:
+      # Resetting the tracemalloc peak would also reset it for a stage running on another thread
+      if self.metrics._start_stage() and self.metrics.trace_memory and not self.metrics.overlapping:
+        tracemalloc.reset_peak()
+    self.wall_start = time.perf_counter()
+    self.cpu_start = time.thread_time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if self.metrics is not None:
+      cpu_seconds = time.thread_time() - self.cpu_start
+      traced_peak_mb = self.metrics._end_stage()
+      rows_out = self.rows_in if self.rows_out is None else self.rows_out
+      self.metrics.record(self.name, time.perf_counter() - self.wall_start, cpu_seconds,
+                          self.rows_in, rows_out, self.rows_rejected, _peak_memory_mb(), traced_peak_mb)
+    return False
+
+def measure_stage(metrics, name, rows_in=0):
+  """Returns a StageTimer for a stage. metrics may be None, in which case nothing is recorded."""
+  return StageTimer(metrics, name, rows_in)
+
+def measure_batches(batches, metrics, name='read'):
+  """Yields the batches of an iterator (e.g. a chunked pd.read_csv), timing each read as a stage."""
+  iterator = iter(batches)
+  while True:
+    with measure_stage(metrics, name) as stage:
+      batch = next(iterator, None)
+      stage.rows_in = stage.rows_out = 0 if batch is None else len(batch)
+    if batch is None:
+      return
+    yield batch
+
+# Pipelined mode: the next chunks are read on one background thread and finished chunks written on another,
+# each through a bounded queue, so reading, cleaning and writing overlap with a fixed number of chunks in memory
+PIPELINE_QUEUE_SIZE = 1
+
+_QUEUE_DONE = object()
+
+def prefetch(items, load, queue_size=PIPELINE_QUEUE_SIZE):
+  """Yields (item, data, error) for each item in order, with data = load(item) loaded ahead on a background thread.
+
+  The thread blocks once queue_size loaded items are waiting, so at most queue_size + 2 items
+  (waiting, being loaded and being used) are held at a time. With queue_size 0 every item is
+  loaded in the calling thread when it is needed.
+
+  Args:
+    items: The items to load, e.g. chunk file paths.
+    load: A function that loads one item.
+    queue_size: The number of loaded items that may wait for the caller.
+
+  Yields:
+    (item, data, error) tuples. If load raised, error is the exception and data is None; the
+    following items are still loaded.
+  """
+  def load_one(item):
+    try:
+      return item, load(item), None
+    except Exception as e:
+      return item, None, e
+
+  if queue_size <= 0:
+    for item in items:
+      yield load_one(item)
+    return
+
+  loaded = queue.Queue(maxsize=queue_size)
+  stop = threading.Event()
+
+  def reader():
+    for item in items:
+      if stop.is_set():
+        break
+      loaded.put(load_one(item))
+    loaded.put(_QUEUE_DONE)
+
+  thread = threading.Thread(target=reader, name='chunk-prefetch', daemon=True)
+  thread.start()
+  try:
+    while True:
+      entry = loaded.get()
+      if entry is _QUEUE_DONE:
+        return
+      yield entry
+  finally:
+    # If the caller stops early, drain the queue so the reader is not left blocked on a full queue
+    stop.set()
+    while thread.is_alive():
+      try:
+        loaded.get(timeout=0.1)
+      except queue.Empty:
+        pass
+
+class BackgroundWriter:
+  """Runs write calls in submission order on a background thread, fed through a bounded queue.
+
+  submit() blocks while queue_size writes are already waiting, which holds the caller back to
+  the speed of the writes and caps the finished chunks held in memory at queue_size + 1. Use it as
+  a context manager: leaving the block waits for every queued write. With queue_size 0 every
+  write runs in the calling thread inside submit().
+
+  Writes should handle and log their own errors. An exception that escapes a write is logged,
+  and the first one is re-raised by close().
+
+  Args:
+    queue_size: The number of writes that may wait for the writer thread.
+  """
+
+  def __init__(self, queue_size=PIPELINE_QUEUE_SIZE):
+    self.error = None
+    self.pending = None
+    self.thread = None
+    if queue_size > 0:
+      self.pending = queue.Queue(maxsize=queue_size)
+      self.thread = threading.Thread(target=self._run, name='chunk-writer', daemon=True)
+      self.thread.start()
+
+  def _run(self):
+    while True:
+      task = self.pending.get()
+      if task is _QUEUE_DONE:
+        return
+      self._write(*task)
+
+  def _write(self, func, args):
+    try:
+      func(*args)
+    except Exception as e:
+      print(f"Error in background write: {e}")
+      logging.exception(f"Error in background write: {e}")
+      if self.error is None:
+        self.error = e
+
+  def submit(self, func, *args):
+    """Queues func(*args) to run after the writes already submitted, blocking while the queue is full."""
+    if self.thread is None:
+      self._write(func, args)
+    else:
+      self.pending.put((func, args))
+
+  def close(self):
+    """Waits for every submitted write to finish, then re-raises the first exception a write raised, if any."""
+    if self.thread is not None:
+      self.pending.put(_QUEUE_DONE)
+      self.thread.join()
+      self.thread = None
+    if self.error is not None:
+      raise self.error
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+# Compressed files. The codec is picked from the file extension, as pandas does, so a .csv.gz or .csv.zst path
+# can be given wherever a CSV path is taken. zstd needs the optional zstandard package.
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Levels used when writing compressed files. Fast levels, since most files written here are read back once.
+COMPRESSION_LEVELS = {'gzip': 1, 'zstd': 3}
+
+# zstd compression worker threads: -1 uses one per CPU, 0 compresses on the calling thread
+ZSTD_THREADS = -1
+
+# Decompressed block size and the number of blocks a ReadAheadStream reads ahead of the parser
+READ_AHEAD_BYTES = 8 * 2**20
+READ_AHEAD_BLOCKS = 2
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+def compression_of(path):
+  """Returns the codec of a file from its extension: 'gzip', 'zstd' or None."""
+  for compression, extension in COMPRESSION_EXTENSIONS.items():
+    if str(path).endswith(extension):
+      return compression
+  return None
+
+def with_compression(path, compression):
+  """Returns path with its compression extension replaced by the one for compression, or removed if it is None."""
+  if compression is not None and compression not in COMPRESSION_EXTENSIONS:
+    raise ValueError(f"Unsupported compression '{compression}'. Use one of {list(COMPRESSION_EXTENSIONS)}.")
+  current = compression_of(path)
+  if current:
+    path = path[:-len(COMPRESSION_EXTENSIONS[current])]
+  return path + COMPRESSION_EXTENSIONS[compression] if compression else path
+
+def compression_options(path):
+  """Returns the compression argument for DataFrame.to_csv(path): None, or the codec of path with its level."""
+  compression = compression_of(path)
+  if compression == 'gzip':
+    # A fixed mtime keeps the output bytes reproducible, so checkpoint content hashes stay stable
+    return {'method': 'gzip', 'compresslevel': COMPRESSION_LEVELS['gzip'], 'mtime': 0}
+  if compression == 'zstd':
+    return {'method': 'zstd', 'level': COMPRESSION_LEVELS['zstd'], 'threads': ZSTD_THREADS}
+  return None
+
+def open_compressed(path, mode='rb', encoding=None, newline=None, read_ahead=True):
+  """Opens a file like open(), compressing or decompressing it on the fly when its extension is .gz or .zst.
+
+  Appending adds a new gzip member or zstd frame, which every reader of the format reads as one stream.
+
+  Args:
+    path: The path to the file.
+    mode: 'rb', 'wb' or 'ab', or 'r', 'w' or 'a' for text.
+    encoding: The text encoding, in text modes.
+    newline: The newline argument of open(), in text modes.
+    read_ahead: If True, compressed files opened for reading are decompressed ahead of the caller on a
+      background thread (see ReadAheadStream).
+
+  Returns:
+    A file object. Uncompressed files are opened with open() unchanged.
+  """
+  compression = compression_of(path)
+  if compression is None:
+    return open(path, mode, encoding=encoding, newline=newline)
+
+  binary_mode = mode[0] + 'b'
+  if compression == 'gzip':
+    handle = gzip.GzipFile(path, binary_mode, compresslevel=COMPRESSION_LEVELS['gzip'], mtime=0)
+  elif zstandard is None:
+    raise ImportError(f"Reading or writing {path} needs the zstandard package (pip install zstandard).")
+  else:
+    handle = zstandard.open(path, binary_mode, cctx=zstandard.ZstdCompressor(level=COMPRESSION_LEVELS['zstd'], threads=ZSTD_THREADS))
+  if binary_mode == 'rb' and read_ahead:
+    handle = io.BufferedReader(ReadAheadStream(handle))
+  if 'b' not in mode:
+    handle = io.TextIOWrapper(handle, encoding=encoding, newline=newline)
+  return handle
+
+# Read a decompressing stream on a background thread, so decompression overlaps with parsing
+class ReadAheadStream(io.RawIOBase):
+  """A read-only raw stream that reads blocks of a source stream ahead of the caller, on a background thread.
+
+  zlib and zstd release the GIL while they decompress, so with a decompressing source the next blocks
+  are decompressed while the caller parses the current one. Blocks are loaded with prefetch, so at
+  most queue_size + 2 blocks of block_bytes are held. Closing the stream closes the source.
+
+  Args:
+    source: A readable binary stream.
+    block_bytes: The size of the blocks read from the source.
+    queue_size: The number of blocks read ahead.
+  """
+
+  def __init__(self, source, block_bytes=READ_AHEAD_BYTES, queue_size=READ_AHEAD_BLOCKS):
+    self.source = source
+    self.blocks = prefetch(itertools.repeat(block_bytes), source.read, queue_size)
+    self.block = memoryview(b'')
+
+  def readable(self):
+    return True
+
+  def readinto(self, buffer):
+    while not len(self.block):
+      if self.blocks is None:
+        return 0
+      _, data, error = next(self.blocks)
+      if error is not None:
+        raise error
+      if not data:
+        self.blocks.close()
+        self.blocks = None
+        return 0
+      self.block = memoryview(data)
+    size = min(len(buffer), len(self.block))
+    buffer[:size] = self.block[:size]
+    self.block = self.block[size:]
+    return size
+
+  def close(self):
+    if self.blocks is not None:
+      self.blocks.close()
+      self.blocks = None
+    if not self.closed:
+      self.source.close()
+    super().close()
+
 # prompt: Create a function to read a specified CSV, drop columns from a dataframe based on a list of specified columns and convert the revised dataframe to a specified CSV.
 
 import pandas as pd
 
-def process_drop_cols_csv(input_csv, output_csv, columns_to_drop):
+def process_drop_cols_csv(input_csv, output_csv, columns_to_drop, metrics=None):
   """Reads a CSV, drops specified columns, and writes the result to another CSV.
 
   Args:
     input_csv: Path to the input CSV file.
     output_csv: Path to the output CSV file.
     columns_to_drop: A list of column names to drop from the dataframe.
+    metrics: An optional RunMetrics to record the read, drop_columns and write stages on.
+
+  Either path may end in .gz or .zst to read or write a compressed file.
   """
 
   try:
     print(f"Processing CSV file ({input_csv}). Columns to be dropped are {columns_to_drop}")
     logging.info(f"Processing CSV file ({input_csv}). Columns to be dropped are {columns_to_drop}")
 
-    df = pd.read_csv(input_csv, encoding='utf-8',low_memory=True)
-    df = df.drop(columns=columns_to_drop, errors="ignore")
-    df.to_csv(output_csv, encoding='utf-8-sig',index=False)
+    # Dropped columns are excluded through usecols so they are never parsed
+    with measure_stage(metrics, 'read') as stage:
+      df = pd.read_csv(input_csv, encoding='utf-8',low_memory=True, **car_owner_read_options(columns_to_drop))
+      stage.rows_in = stage.rows_out = len(df)
+    with measure_stage(metrics, 'drop_columns', len(df)):
+      df = df.drop(columns=columns_to_drop, errors="ignore")
+    with measure_stage(metrics, 'write', len(df)):
+      df.to_csv(output_csv, encoding='utf-8-sig',index=False, compression=compression_options(output_csv))
 
     print(f"CSV file ({input_csv}) processed successfully. Output saved to {output_csv}")
     logging.info(f"CSV file ({input_csv}) processed successfully. Output saved to {output_csv}")
@@ -58,7 +601,7 @@ def remove_duplicate_records(df, columns):
                and a new dataframe with duplicate records.
     """
     try:
-        print(f"Processing dataframe to remove and store duplicate records.")
+        print_detail(f"Processing dataframe to remove and store duplicate records.")
         logging.info(f"Processing dataframe to remove and store duplicate records.")
         duplicate_df = pd.DataFrame()
         df_deduplicated = df.drop_duplicates(subset=columns, keep='first')
@@ -67,7 +610,7 @@ def remove_duplicate_records(df, columns):
         if not duplicate_rows.empty:
             duplicate_df = pd.concat([duplicate_df, duplicate_rows], ignore_index=True)
 
-        print(f"Duplicate removal complete. Duplicate records appended to duplicate_df.")
+        print_detail(f"Duplicate removal complete. Duplicate records appended to duplicate_df.")
         logging.info(f"Duplicate removal complete. Duplicate records appended to duplicate_df.")
         return df_deduplicated, duplicate_df
 
@@ -78,21 +621,42 @@ def remove_duplicate_records(df, columns):
 
 # prompt: Create a function to process a specified CSV file and then run the function to remove duplicates and convert the valid and duplicates dataframes to csv files.
 
-def process_duplicates_csv(file_path, output_valid_csv, output_duplicates_csv, columns, sep=','):
+def process_duplicates_csv(file_path, output_valid_csv, output_duplicates_csv, columns, sep=',', chunksize=None, metrics=None, key_index_path=None):
     """
     Processes a single CSV file, removes duplicates, and outputs valid and duplicate dataframes to CSV files.
+
+    With chunksize set, the file is streamed in chunks of that many rows and only a
+    64-bit hash of each unique key is kept in memory (see HashedKeySet), so memory
+    scales with the number of unique keys rather than the size of the file. The first
+    occurrence of each key is kept and duplicates are written out as they are found.
+
+    Pass a RunMetrics as metrics to record the read, dedup and write stages.
+
+    Pass key_index_path to also drop records already seen in earlier runs: the keys are looked
+    up in and added to a PersistentKeyIndex at that path, and are committed when the file is
+    done. This always streams the file, in chunks of 250000 rows unless chunksize is set.
+
+    Any of the CSV paths may end in .gz or .zst to read or write a compressed file.
     """
+    if chunksize or key_index_path:
+        return _process_duplicates_csv_streaming(file_path, output_valid_csv, output_duplicates_csv, columns, sep, chunksize or 250000, metrics, key_index_path)
+
     try:
-        df = pd.read_csv(file_path, sep=sep, low_memory=True, encoding='utf-8')
+        with measure_stage(metrics, 'read') as stage:
+            df = pd.read_csv(file_path, sep=sep, low_memory=True, encoding='utf-8', **car_owner_read_options(string_columns=columns))
+            stage.rows_in = stage.rows_out = len(df)
         print(f"Processing CSV file: {file_path} for duplicates.")
         logging.info(f"Processing CSV file: {file_path} for duplicates.")
 
         # Remove duplicates based on email
-        df, duplicates_df = remove_duplicate_records(df, columns)
+        with measure_stage(metrics, 'dedup', len(df)) as stage:
+            df, duplicates_df = remove_duplicate_records(df, columns)
+            stage.rows_out, stage.rows_rejected = len(df), len(duplicates_df)
 
         # Save valid and duplicate dataframes to CSV files
-        df.to_csv(output_valid_csv, index=False, encoding='utf-8-sig')
-        duplicates_df.to_csv(output_duplicates_csv, index=False, encoding='utf-8-sig')
+        with measure_stage(metrics, 'write', len(df) + len(duplicates_df)):
+            df.to_csv(output_valid_csv, index=False, encoding='utf-8-sig', compression=compression_options(output_valid_csv))
+            duplicates_df.to_csv(output_duplicates_csv, index=False, encoding='utf-8-sig', compression=compression_options(output_duplicates_csv))
 
         print(f"Processed file: {file_path}. Valid data saved to {output_valid_csv}, duplicates to {output_duplicates_csv}.")
         logging.info(f"Processed file: {file_path}. Valid data saved to {output_valid_csv}, duplicates to {output_duplicates_csv}.")
@@ -101,16 +665,378 @@ def process_duplicates_csv(file_path, output_valid_csv, output_duplicates_csv, c
         print(f"Error processing file {file_path}: {e}")
         logging.error(f"Error processing file {file_path}: {e}")
 
+def _process_duplicates_csv_streaming(file_path, output_valid_csv, output_duplicates_csv, columns, sep, chunksize, metrics=None, key_index_path=None):
+    """Streams a CSV file in chunks and splits it into valid and duplicate CSV files using hashed keys."""
+    seen_keys = None
+    try:
+        print(f"Processing CSV file: {file_path} for duplicates in chunks of {chunksize} rows.")
+        logging.info(f"Processing CSV file: {file_path} for duplicates in chunks of {chunksize} rows.")
+
+        seen_keys = PersistentKeyIndex(key_index_path, columns) if key_index_path else HashedKeySet()
+        valid_columns = None
+        duplicates_columns = None
+        duplicate_count = 0
+
+        with open_compressed(output_valid_csv, 'w', newline='', encoding='utf-8-sig') as valid_handle, \
+             open_compressed(output_duplicates_csv, 'w', newline='', encoding='utf-8-sig') as duplicates_handle:
+
+            # Key columns are read as strings so the same key hashes the same way in every chunk
+            read_options = car_owner_read_options(string_columns=columns)
+            reader = pd.read_csv(file_path, sep=sep, chunksize=chunksize, low_memory=True, encoding='utf-8', **read_options)
+            for chunk in measure_batches(reader, metrics):
+                with measure_stage(metrics, 'dedup', len(chunk)) as stage:
+                    is_duplicate, new_keys = _find_streaming_duplicates(chunk, columns, seen_keys)
+                    chunk_duplicates = int(is_duplicate.sum())
+                    stage.rows_out, stage.rows_rejected = len(chunk) - chunk_duplicates, chunk_duplicates
+                duplicate_count += chunk_duplicates
+                with measure_stage(metrics, 'write', len(chunk)):
+                    valid_columns = _append_csv(chunk[~is_duplicate], valid_handle, valid_columns)
+                    duplicates_columns = _append_csv(chunk[is_duplicate], duplicates_handle, duplicates_columns)
+                seen_keys.add(new_keys)
+
+        if key_index_path:
+            seen_keys.commit()
+        print(f"Processed file: {file_path}. {len(seen_keys)} unique keys, {duplicate_count} duplicates. Valid data saved to {output_valid_csv}, duplicates to {output_duplicates_csv}.")
+        logging.info(f"Processed file: {file_path}. {len(seen_keys)} unique keys, {duplicate_count} duplicates. Valid data saved to {output_valid_csv}, duplicates to {output_duplicates_csv}.")
+
+    except Exception as e:
+        print(f"Error processing file {file_path}: {e}")
+        logging.error(f"Error processing file {file_path}: {e}")
+    finally:
+        if isinstance(seen_keys, PersistentKeyIndex):
+            seen_keys.close()
+
+# Compact set of 64-bit key hashes used for duplicate detection across chunks
+class HashedKeySet:
+    """A set of uint64 key hashes stored as sorted NumPy runs.
+
+    New hashes are added as a sorted run; runs of similar size are merged so there
+    are only O(log n) runs to search. Each key costs 8 bytes, instead of a full
+    Python tuple per key. Two different keys collide with a probability of about
+    n^2 / 2^65, which is negligible for tens of millions of keys.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes):
+        """Returns a boolean array that is True where a hash is already in the set."""
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.searchsorted(run, hashes)
+            positions[positions == len(run)] = 0
+            found |= run[positions] == hashes
+        return found
+
+    def add(self, hashes):
+        """Adds hashes that are not yet in the set. hashes must be unique."""
+        if len(hashes) == 0:
+            return
+        self.runs.append(np.sort(np.asarray(hashes, dtype=np.uint64)))
+        while len(self.runs) > 1 and len(self.runs[-1]) * 2 >= len(self.runs[-2]):
+            newest = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], newest]))
+
+# Hash the key columns of a dataframe into one uint64 per row
+def hash_key_columns(df, columns):
+    """Returns a uint64 NumPy array with one hash per row of the given key columns."""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy(dtype=np.uint64)
+
+# On-disk set of key hashes that persists between runs, for deduplicating new extracts against everything cleaned before
+class PersistentKeyIndex:
+    """A SQLite-backed set of uint64 key hashes with the same contains/add interface as HashedKeySet.
+
+    Hashes are stored as the integer primary key of a single table, so each lookup and insert
+    is a B-tree operation and an incremental load costs time in proportion to the new rows,
+    not to the history. Lookups go through a temporary table joined against the index, one
+    batch at a time. Keys added during a run only become visible to later runs after commit(),
+    so a run that fails part way leaves the index as it was. The number of keys is stored with
+    the index and updated on commit(), so len() does not count the history.
+
+    Args:
+        path: The path to the SQLite database file. It is created if it does not exist.
+        columns: The key column names. An existing index built on different columns is refused.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS key_hashes (hash INTEGER PRIMARY KEY)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS index_info (name TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute("CREATE TEMP TABLE batch_hashes (hash INTEGER PRIMARY KEY)")
+
+        stored = self.connection.execute("SELECT value FROM index_info WHERE name = 'columns'").fetchone()
+        if stored is None:
+            self.connection.execute("INSERT INTO index_info VALUES ('columns', ?)", (json.dumps(list(columns)),))
+            self.connection.commit()
+        elif json.loads(stored[0]) != list(columns):
+            self.connection.close()
+            raise ValueError(f"Key index {path} was built on columns {json.loads(stored[0])}, not {list(columns)}.")
+
+        # Indexes from before the count was stored are counted once here
+        stored_count = self.connection.execute("SELECT value FROM index_info WHERE name = 'key_count'").fetchone()
+        if stored_count is None:
+            self.stored_count = self.connection.execute("SELECT COUNT(*) FROM key_hashes").fetchone()[0]
+            self.connection.execute("INSERT INTO index_info VALUES ('key_count', ?)", (str(self.stored_count),))
+            self.connection.commit()
+        else:
+            self.stored_count = int(stored_count[0])
+        self.added = 0
+
+    def __len__(self):
+        return self.stored_count + self.added
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @staticmethod
+    def _as_rows(hashes):
+        # SQLite integers are signed 64-bit, so the uint64 hashes are stored with the same bits as int64.
+        # Sorted rows touch each B-tree page once per batch, which matters once the index outgrows the page cache.
+        return zip(np.sort(np.asarray(hashes, dtype=np.uint64).view(np.int64)).tolist())
+
+    def contains(self, hashes):
+        """Returns a boolean array that is True where a hash is already in the index."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        self.connection.execute("DELETE FROM batch_hashes")
+        self.connection.executemany("INSERT OR IGNORE INTO batch_hashes VALUES (?)", self._as_rows(hashes))
+        found = self.connection.execute("SELECT hash FROM batch_hashes JOIN key_hashes USING (hash)").fetchall()
+        return np.isin(hashes.view(np.int64), np.array([row[0] for row in found], dtype=np.int64))
+
+    def add(self, hashes):
+        """Adds hashes to the index. They are saved for later runs by commit()."""
+        cursor = self.connection.executemany("INSERT OR IGNORE INTO key_hashes VALUES (?)", self._as_rows(hashes))
+        self.added += max(cursor.rowcount, 0)
+
+    def commit(self):
+        """Saves the keys added so far."""
+        self.stored_count += self.added
+        self.added = 0
+        self.connection.execute("UPDATE index_info SET value = ? WHERE name = 'key_count'", (str(self.stored_count),))
+        self.connection.commit()
+
+    def rollback(self):
+        """Discards the keys added since the last commit()."""
+        self.connection.rollback()
+        self.added = 0
+
+    def close(self):
+        """Closes the database. Keys added since the last commit() are discarded."""
+        self.connection.close()
+
+# Register count exponent of the HyperLogLog sketches used by estimate_data_quality: 2^18 one-byte registers, 256 KiB each
+HLL_PRECISION = 18
+
+# Probabilistic distinct counter, so the number of unique keys can be estimated in fixed memory
+class HyperLogLog:
+    """A HyperLogLog sketch that estimates the number of distinct uint64 hashes added to it.
+
+    The top bits of each hash pick one of 2^precision registers, and each register keeps the
+    largest position of the first 1 bit seen in the remaining bits. The count is estimated from
+    the register histogram with Ertl's improved estimator ("New cardinality estimation algorithms
+    for HyperLogLog sketches", 2017), which needs no bias tables or small-range switch. The
+    relative standard error is about 1.04 / sqrt(2^precision), 0.2% at the default precision.
+
+    Args:
+        precision: The number of index bits, from 4 to 18. The sketch takes 2^precision bytes.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be between 4 and 18, not {precision}.")
+        self.precision = precision
+        self.registers = np.zeros(2**precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        """The relative standard error of count()."""
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def add(self, hashes):
+        """Adds a uint64 array of hashes. Repeated hashes do not change the sketch."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        value_bits = 64 - self.precision
+        registers = (hashes >> np.uint64(value_bits)).astype(np.intp)
+        values = hashes & np.uint64(2**value_bits - 1)
+        # Bit length of each value from the float exponents of its two 32-bit halves, which are exact in float64
+        high_bits = np.frexp((values >> np.uint64(32)).astype(np.float64))[1]
+        low_bits = np.frexp((values & np.uint64(2**32 - 1)).astype(np.float64))[1]
+        bit_length = np.where(high_bits > 0, high_bits + 32, low_bits)
+        np.maximum.at(self.registers, registers, (value_bits + 1 - bit_length).astype(np.uint8))
+
+    def merge(self, other):
+        """Adds the hashes counted by another sketch of the same precision."""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog sketches of precision {self.precision} and {other.precision}.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """Returns the estimated number of distinct hashes added."""
+        m = len(self.registers)
+        value_bits = 64 - self.precision
+        histogram = np.bincount(self.registers, minlength=value_bits + 2)
+        if histogram[0] == m:
+            return 0
+        z = m * self._tau(1 - histogram[value_bits + 1] / m)
+        for k in range(value_bits, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        z += m * self._sigma(histogram[0] / m)
+        return int(round(m * m / (2 * np.log(2) * z)))
+
+    @staticmethod
+    def _sigma(x):
+        if x == 1:
+            return np.inf
+        y, z = 1.0, x
+        while True:
+            x = x * x
+            previous = z
+            z += x * y
+            y += y
+            if z == previous:
+                return z
+
+    @staticmethod
+    def _tau(x):
+        if x == 0 or x == 1:
+            return 0.0
+        y, z = 1.0, 1 - x
+        while True:
+            x = np.sqrt(x)
+            previous = z
+            y *= 0.5
+            z -= (1 - x)**2 * y
+            if z == previous:
+                return z / 3
+
+# Fixed-size uniform sample of the rows of a chunked stream
+class RowReservoir:
+    """Keeps a uniform random sample of up to size rows from a stream of DataFrame chunks.
+
+    Every row gets a random priority and the reservoir keeps the rows with the lowest priorities
+    seen so far. This gives every row the same chance of being in the sample, like reservoir
+    sampling, but a whole chunk is handled with array operations. Once the reservoir is full,
+    only the few rows of a chunk with a priority below the largest kept one are copied.
+    The sample keeps the rows in stream order.
+
+    Args:
+        size: The number of rows to keep.
+        seed: The random seed. The same seed and stream always give the same sample.
+    """
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.rows = None
+        self.priorities = np.empty(0)
+        self.rows_seen = 0
+
+    def add(self, df):
+        """Offers the rows of a chunk to the sample."""
+        self.rows_seen += len(df)
+        priorities = self.rng.random(len(df))
+        if len(self.priorities) == self.size:
+            candidates = priorities < self.priorities.max()
+            df, priorities = df[candidates], priorities[candidates]
+        if len(df) == 0:
+            return
+        rows = df if self.rows is None else pd.concat([self.rows, df])
+        priorities = np.concatenate([self.priorities, priorities])
+        if len(priorities) > self.size:
+            kept = np.sort(np.argpartition(priorities, self.size - 1)[:self.size])
+            rows, priorities = rows.iloc[kept], priorities[kept]
+        self.rows, self.priorities = rows, priorities
+
+    def sample(self):
+        """Returns the sampled rows as a DataFrame with a fresh index."""
+        if self.rows is None:
+            return pd.DataFrame()
+        return self.rows.reset_index(drop=True)
+
+# File extensions for the intermediate formats the chunk stages can read and write
+INTERMEDIATE_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Write a dataframe to an intermediate file in the chosen format
+def write_intermediate(df, path, file_format='csv', compression=None):
+  """Writes a dataframe to an intermediate file.
+
+  Args:
+    df: The pandas DataFrame to write.
+    path: The path to the output file.
+    file_format: 'csv' (utf-8-sig text), 'parquet' or 'arrow' (Arrow IPC / Feather).
+    compression: The codec columnar files compress their pages or buffers with, e.g. 'zstd'. Defaults
+      to snappy for parquet and none for arrow, which does not support gzip. CSV files are compressed
+      by the extension of path instead (see intermediate_file_name).
+  """
+  if file_format == 'csv':
+    df.to_csv(path, index=False, encoding='utf-8-sig', compression=compression_options(path))
+    return
+  if file_format not in INTERMEDIATE_EXTENSIONS:
+    raise ValueError(f"Unsupported intermediate format '{file_format}'. Use one of {list(INTERMEDIATE_EXTENSIONS)}.")
+
+  # Columnar formats need one type per column, so mixed object columns are stored as text
+  df = df.reset_index(drop=True)
+  for column in df.columns[df.dtypes == object]:
+    values = df[column]
+    df[column] = values.where(values.isna(), values.astype(str))
+
+  options = {'compression': compression} if compression else {}
+  if file_format == 'parquet':
+    df.to_parquet(path, index=False, **options)
+  else:
+    df.to_feather(path, **options)
+
+def intermediate_file_name(name, file_format='csv', compression=None):
+  """Returns the file name of an intermediate file, e.g. 'chunk_1.csv', or 'chunk_1.csv.gz' for a gzip CSV.
+
+  Only CSV files get a compression extension. Columnar formats are compressed inside the file.
+  """
+  filename = f"{name}{INTERMEDIATE_EXTENSIONS[file_format]}"
+  return with_compression(filename, compression) if file_format == 'csv' else filename
+
+# Read an intermediate file, picking the format from its extension
+def read_intermediate(path, **csv_kwargs):
+  """Reads an intermediate file written by write_intermediate.
+
+  Args:
+    path: The path to the file. The format is taken from the extension. CSV files ending in .gz
+      or .zst are decompressed as they are read.
+    **csv_kwargs: Extra keyword arguments passed to pd.read_csv for CSV files.
+
+  Returns:
+    A pandas DataFrame.
+  """
+  if path.endswith(INTERMEDIATE_EXTENSIONS['parquet']):
+    return pd.read_parquet(path)
+  if path.endswith(INTERMEDIATE_EXTENSIONS['arrow']):
+    return pd.read_feather(path)
+  csv_kwargs.setdefault('encoding', 'utf-8')
+  csv_kwargs.setdefault('low_memory', True)
+  return pd.read_csv(path, **csv_kwargs)
 
 # prompt: Create a function to split a large csv into chunks in a specified folder or path using the chunksize parameter in read_csv
 
-def split_csv_into_chunks(file_path, chunksize, output_directory, sep=','):
+def split_csv_into_chunks(file_path, chunksize, output_directory, sep=',', file_format='csv', metrics=None, compression=None):
   """Splits a large CSV file into smaller chunks using the chunksize parameter.
 
   Args:
-    file_path: The path to the large CSV file.
+    file_path: The path to the large CSV file. It may be compressed (.gz or .zst).
     chunksize: The number of rows per chunk.
     output_directory: The directory where the chunks should be saved.
+    sep: The delimiter used in the CSV file.
+    file_format: The format of the chunk files: 'csv', 'parquet' or 'arrow'.
+    metrics: An optional RunMetrics to record the read and write stages on.
+    compression: Optional codec to compress the chunk files with: 'gzip' or 'zstd' for CSV chunks
+      (written as chunk_1.csv.gz or chunk_1.csv.zst), or a parquet/arrow codec for columnar chunks.
   """
   try:
     print(f"Processing CSV file: {file_path} to split into chunks.")
@@ -119,12 +1045,14 @@ def split_csv_into_chunks(file_path, chunksize, output_directory, sep=','):
     if not os.path.exists(output_directory):
       os.makedirs(output_directory)
 
-    for i, chunk in enumerate(pd.read_csv(file_path, chunksize=chunksize, sep=sep, encoding='utf-8')):
-      output_file = os.path.join(output_directory, f"chunk_{i+1}.csv")
-      chunk.to_csv(output_file, index=False, encoding='utf-8-sig')
+    reader = pd.read_csv(file_path, chunksize=chunksize, sep=sep, encoding='utf-8', **car_owner_read_options())
+    for i, chunk in enumerate(measure_batches(reader, metrics)):
+      output_file = os.path.join(output_directory, intermediate_file_name(f"chunk_{i+1}", file_format, compression))
+      with measure_stage(metrics, 'write', len(chunk)):
+        write_intermediate(chunk, output_file, file_format, compression)
 
     print(f"File '{file_path}' split into {i+1} chunks in '{output_directory}'.")
-    logging(f"File '{file_path}' split into {i+1} chunks in '{output_directory}'.")
+    logging.info(f"File '{file_path}' split into {i+1} chunks in '{output_directory}'.")
 
   except FileNotFoundError as e:
     print(f"Error: {e}")
@@ -133,9 +1061,386 @@ def split_csv_into_chunks(file_path, chunksize, output_directory, sep=','):
     print(f"An unexpected error occurred when splitting CSV into chunks: {e}")
     logging.error(f"An unexpected error occurred when splitting CSV into chunks: {e}")
 
+# Default size of a byte-range chunk: large enough to amortize per-chunk overhead, small enough to parse in one go
+CHUNK_BYTES = 64 * 2**20
+
+# Block size for scanning and copying memory-mapped files, so a chunk is never copied into memory whole
+COPY_BLOCK_BYTES = 8 * 2**20
+
+# Count one byte value between two offsets of a memory-mapped file, a block at a time
+def _count_byte(mm, start, end, byte):
+  count = 0
+  for block_start in range(start, end, COPY_BLOCK_BYTES):
+    count += mm[block_start:min(block_start + COPY_BLOCK_BYTES, end)].count(byte)
+  return count
+
+# Find the end of the record that contains pos, given that start is the beginning of a record
+def _next_record_end(mm, start, pos, quotechar=b'"'):
+  """Returns the offset just past the newline that ends the record containing pos.
+
+  A newline only ends a record when it is outside quotes, i.e. when an even number of quote
+  characters lie between the start of the record run and the newline. Escaped quotes ("")
+  count twice, so they do not change the parity.
+  """
+  quotes = _count_byte(mm, start, pos, quotechar)
+  while True:
+    newline = mm.find(b'\n', pos)
+    if newline == -1:
+      return len(mm)
+    quotes += _count_byte(mm, pos, newline, quotechar)
+    if quotes % 2 == 0:
+      return newline + 1
+    pos = newline + 1
+
+def find_csv_byte_ranges(file_path, chunk_bytes=CHUNK_BYTES, quotechar='"'):
+  """Scans a CSV file with memory-mapped I/O and cuts it into byte ranges at record boundaries.
+
+  The file is not parsed: only quote characters and newlines are looked at, so the scan runs at
+  disk speed. Newlines inside quoted fields are not treated as record boundaries.
+
+  Args:
+    file_path: The path to the CSV file.
+    chunk_bytes: The approximate size of each range in bytes. A range ends at the first record
+      boundary at or after this size.
+    quotechar: The quote character used in the CSV file.
+
+  Returns:
+    A tuple of the header line as bytes (including its newline and any BOM) and a list of
+    (offset, length) byte ranges covering the data rows.
+
+  Raises:
+    ValueError: If the file is compressed. Compressed files can only be read from the start;
+      use iter_csv_record_blocks instead.
+  """
+  if compression_of(file_path):
+    raise ValueError(f"{file_path} is compressed, so it cannot be cut into byte ranges. Read it with iter_csv_record_blocks or split it with split_csv_by_byte_ranges.")
+  quote = quotechar.encode('utf-8')
+  with open(file_path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return b'', []
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      header_end = _next_record_end(mm, 0, 0, quote)
+      header = mm[:header_end]
+      ranges = []
+      start = header_end
+      while start < len(mm):
+        end = _next_record_end(mm, start, min(start + chunk_bytes, len(mm)) - 1, quote)
+        ranges.append((start, end - start))
+        start = end
+  return header, ranges
+
+# Record boundaries in a buffer that starts at a record boundary
+def _record_ends(data, quotechar='"'):
+  """Returns the offsets just past every newline in data that ends a record, as a NumPy array."""
+  array = np.frombuffer(data, dtype=np.uint8)
+  newlines = np.flatnonzero(array == ord('\n'))
+  quotes = np.flatnonzero(array == ord(quotechar))
+  return newlines[np.searchsorted(quotes, newlines) % 2 == 0] + 1
+
+def iter_csv_record_blocks(file_path, block_bytes=CHUNK_BYTES, quotechar='"'):
+  """Reads a CSV file front to back and yields it as blocks of whole records.
+
+  The streaming counterpart of find_csv_byte_ranges, for files that cannot be memory-mapped,
+  such as compressed files. The blocks are cut where find_csv_byte_ranges would cut the
+  uncompressed file. Compressed files are decompressed on a background thread while the caller
+  works on the previous block (see ReadAheadStream).
+
+  Args:
+    file_path: The path to the CSV file, compressed or not.
+    block_bytes: The approximate size of each block in bytes. A block ends at the first record
+      boundary at or after this size.
+    quotechar: The quote character used in the CSV file.
+
+  Yields:
+    (header, block) tuples: the header line as bytes (including its newline and any BOM), and a
+    run of data records as bytes.
+  """
+  header = None
+  pending = b''
+  with open_compressed(file_path, 'rb') as f:
+    while True:
+      data = f.read(block_bytes)
+      pending = pending + data if pending else data
+      if not data:
+        break
+      ends = _record_ends(pending, quotechar)
+      if header is None:
+        if not len(ends):
+          continue
+        header, pending = pending[:ends[0]], pending[ends[0]:]
+        ends = ends[1:] - ends[0]
+      # Cut every block that is complete, rescanning only what is left over
+      while len(ends) and ends[-1] >= block_bytes:
+        end = ends[np.searchsorted(ends, block_bytes)]
+        yield header, pending[:end]
+        pending = pending[end:]
+        ends = ends[ends > end] - end
+  if header is None:
+    header, pending = pending, b''
+  if pending:
+    yield header, pending
+
+def read_csv_byte_range(file_path, offset, length, header, **csv_kwargs):
+  """Reads one byte range of a CSV file found by find_csv_byte_ranges into a dataframe.
+
+  Args:
+    file_path: The path to the CSV file.
+    offset: The byte offset of the range.
+    length: The length of the range in bytes.
+    header: The header line returned by find_csv_byte_ranges, parsed in front of the range.
+    **csv_kwargs: Extra keyword arguments passed to pd.read_csv.
+
+  Returns:
+    A pandas DataFrame with the rows in the range.
+  """
+  with open(file_path, 'rb') as f:
+    f.seek(offset)
+    data = f.read(length)
+  csv_kwargs.setdefault('encoding', 'utf-8')
+  csv_kwargs.setdefault('low_memory', True)
+  return pd.read_csv(io.BytesIO(header + data), **csv_kwargs)
+
+# Split a large CSV into chunk files by copying raw byte ranges, without parsing the rows
+
+def split_csv_by_byte_ranges(file_path, output_directory, chunk_bytes=CHUNK_BYTES, quotechar='"', metrics=None, compression=None):
+  """Splits a large CSV file into CSV chunk files of about chunk_bytes each.
+
+  Unlike split_csv_into_chunks, the rows are not parsed and re-written: each chunk file is the
+  header line followed by a raw byte range of the source file, copied in blocks. The
+  chunks are cut at record boundaries, so quoted fields with newlines are kept whole.
+  A compressed source is read front to back with iter_csv_record_blocks instead, and chunk_bytes
+  then counts uncompressed bytes.
+
+  Args:
+    file_path: The path to the large CSV file. It may be compressed (.gz or .zst).
+    output_directory: The directory where the chunks should be saved.
+    chunk_bytes: The approximate size of each chunk in bytes.
+    quotechar: The quote character used in the CSV file.
+    metrics: An optional RunMetrics to record the split stage on.
+    compression: Optional codec to compress the chunk files with, 'gzip' or 'zstd'.
+
+  Returns:
+    A list of the chunk file paths, in chunk order.
+  """
+  chunk_files = []
+  try:
+    print(f"Processing CSV file: {file_path} to split into chunks of about {chunk_bytes:,} bytes.")
+    logging.info(f"Processing CSV file: {file_path} to split into chunks of about {chunk_bytes:,} bytes.")
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    with measure_stage(metrics, 'split'):
+      if compression_of(file_path):
+        for i, (header, block) in enumerate(iter_csv_record_blocks(file_path, chunk_bytes, quotechar)):
+          output_file = os.path.join(output_directory, intermediate_file_name(f"chunk_{i+1}", 'csv', compression))
+          with open_compressed(output_file, 'wb') as out:
+            out.write(header)
+            out.write(block)
+          chunk_files.append(output_file)
+      else:
+        header, ranges = find_csv_byte_ranges(file_path, chunk_bytes, quotechar)
+        with open(file_path, 'rb') as f:
+          for i, (offset, length) in enumerate(ranges):
+            output_file = os.path.join(output_directory, intermediate_file_name(f"chunk_{i+1}", 'csv', compression))
+            with open_compressed(output_file, 'wb') as out:
+              out.write(header)
+              _copy_bytes(f, out, offset, length)
+            chunk_files.append(output_file)
+
+    print(f"File '{file_path}' split into {len(chunk_files)} chunks in '{output_directory}'.")
+    logging.info(f"File '{file_path}' split into {len(chunk_files)} chunks in '{output_directory}'.")
+
+  except FileNotFoundError as e:
+    print(f"Error: {e}")
+    logging.error(f"Error: {e}")
+  except Exception as e:
+    print(f"An unexpected error occurred when splitting CSV into byte-range chunks: {e}")
+    logging.error(f"An unexpected error occurred when splitting CSV into byte-range chunks: {e}")
+
+  return chunk_files
+
+# Find the records in one byte range whose field count does not match the header. Runs in a worker process in parallel mode.
+def _find_malformed_records(file_path, offset, length, expected_fields, sep=',', quotechar='"'):
+  """Checks the field count of every record in a byte range of a CSV file.
+
+  The range is scanned as a NumPy byte array: separators and newlines with an odd number of
+  quotes before them are inside quoted fields and are not counted. This assumes quotes only
+  appear around quoted fields, as in RFC 4180 CSV written by pandas or the csv module.
+
+  Args:
+    file_path: The path to the CSV file.
+    offset: The byte offset of the range. It must start at a record boundary.
+    length: The length of the range in bytes.
+    expected_fields: The number of fields in the header.
+    sep: The delimiter used in the CSV file.
+    quotechar: The quote character used in the CSV file.
+
+  Returns:
+    A tuple of the number of newlines in the range, the number of records in it and a list of
+    (offset, length, line, fields) tuples for the malformed records, with offsets absolute and
+    lines relative to the range start. Blank lines are neither records nor malformed, since
+    pd.read_csv skips them.
+  """
+  with open(file_path, 'rb') as f:
+    f.seek(offset)
+    data = f.read(length)
+  return _scan_field_counts(data, offset, expected_fields, sep, quotechar)
+
+def _scan_field_counts(data, offset, expected_fields, sep=',', quotechar='"'):
+  """Checks the field count of every record in a bytes buffer that starts at a record boundary.
+
+  Returns the same tuple as _find_malformed_records, with record offsets counted from offset.
+  """
+  data = np.frombuffer(data, dtype=np.uint8)
+  if not len(data):
+    return 0, 0, []
+
+  # A newline or separator is inside quotes when an odd number of quotes come before it
+  quotes = np.flatnonzero(data == ord(quotechar))
+  newlines = np.flatnonzero(data == ord('\n'))
+  separators = np.flatnonzero(data == ord(sep))
+  record_ends = newlines[np.searchsorted(quotes, newlines) % 2 == 0]
+  separators = separators[np.searchsorted(quotes, separators) % 2 == 0]
+  if len(record_ends) == 0 or record_ends[-1] != len(data) - 1:
+    record_ends = np.append(record_ends, len(data))
+  record_starts = np.concatenate(([0], record_ends[:-1] + 1))
+
+  fields = np.diff(np.searchsorted(separators, np.concatenate(([0], record_ends)))) + 1
+  # A blank line, empty or a lone '\r' before its newline, is skipped by pd.read_csv, so it is passed through
+  record_lengths = record_ends - record_starts
+  blank = (record_lengths == 0) | ((record_lengths == 1) & (data[np.minimum(record_starts, len(data) - 1)] == ord('\r')))
+  lines = np.searchsorted(newlines, record_starts)
+
+  malformed = np.flatnonzero(~blank & (fields != expected_fields))
+  records = [(offset + int(record_starts[i]), int(min(record_ends[i] + 1, len(data)) - record_starts[i]), int(lines[i]), int(fields[i]))
+             for i in malformed]
+  return len(newlines), int((~blank).sum()), records
+
+# prompt: Create a pre-validation stage that checks field counts against the header in parallel and quarantines malformed rows with their line numbers
+
+def quarantine_malformed_rows(input_csv, output_csv, quarantine_csv, chunk_bytes=CHUNK_BYTES, workers=1, sep=',', quotechar='"', metrics=None):
+  """
+  Checks that every record of a CSV file has as many fields as the header. Well-formed records
+  are copied byte for byte to output_csv; malformed ones go to quarantine_csv with their line
+  number, so the pd.read_csv calls downstream never see a ragged row. Blank lines are copied
+  through rather than quarantined, since pd.read_csv skips them.
+
+  A compressed input_csv (.gz or .zst) is read front to back with iter_csv_record_blocks and
+  checked in this process, whatever workers is. Either output may also be compressed.
+
+  Args:
+      input_csv (str): The path to the source CSV file.
+      output_csv (str): The path to the output CSV file for well-formed records.
+      quarantine_csv (str): The path to the output CSV file for malformed records. It has the
+          columns line_number (1-based line in input_csv, the header is line 1), field_count and record.
+      chunk_bytes (int): The approximate size of the byte ranges checked by each worker task.
+          Memory use is a few times chunk_bytes per worker.
+      workers (int): The number of worker processes. 1 checks the ranges one at a time in this process.
+      sep (str): The delimiter used in the CSV file.
+      quotechar (str): The quote character used in the CSV file.
+      metrics (RunMetrics): Optional metrics to record the quarantine stage on.
+
+  Returns:
+      int: The number of malformed records quarantined.
+  """
+
+  quarantined = 0
+  try:
+    print(f"Checking field counts in {input_csv} for malformed rows.")
+    logging.info(f"Checking field counts in {input_csv} for malformed rows.")
+
+    with measure_stage(metrics, 'quarantine') as stage:
+      if compression_of(input_csv):
+        quarantined = _quarantine_record_blocks(input_csv, output_csv, quarantine_csv, chunk_bytes, sep, quotechar, stage)
+      else:
+        header, ranges = find_csv_byte_ranges(input_csv, chunk_bytes, quotechar)
+        expected_fields = len(next(csv.reader([header.decode('utf-8-sig')], delimiter=sep, quotechar=quotechar), []))
+        tasks = [(input_csv, offset, length, expected_fields, sep, quotechar) for offset, length in ranges]
+
+        with open(input_csv, 'rb') as source, open_compressed(output_csv, 'wb') as output, \
+             open_compressed(quarantine_csv, 'w', newline='', encoding='utf-8-sig') as quarantine:
+          writer = csv.writer(quarantine)
+          writer.writerow(['line_number', 'field_count', 'record'])
+          output.write(header)
+
+          executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(tasks) > 1 else None
+          try:
+            checked = executor.map(_find_malformed_records, *zip(*tasks)) if executor and tasks else (_find_malformed_records(*task) for task in tasks)
+            line = 1 + header.count(b'\n')
+            # Ranges come back in file order, so good bytes are copied sequentially around the malformed records
+            for (offset, length), (newline_count, record_count, records) in zip(ranges, checked):
+              position = offset
+              for record_offset, record_length, record_line, field_count in records:
+                _copy_bytes(source, output, position, record_offset - position)
+                source.seek(record_offset)
+                record = source.read(record_length).decode('utf-8', errors='replace').rstrip('\r\n')
+                writer.writerow([line + record_line, field_count, record])
+                position = record_offset + record_length
+              _copy_bytes(source, output, position, offset + length - position)
+              line += newline_count
+              quarantined += len(records)
+              stage.rows_in += record_count
+              stage.rows_rejected += len(records)
+          finally:
+            if executor:
+              executor.shutdown()
+      stage.rows_out = stage.rows_in - stage.rows_rejected
+
+    print(f"Field count check complete for {input_csv}. {quarantined} malformed rows saved to {quarantine_csv}, well-formed rows to {output_csv}.")
+    logging.info(f"Field count check complete for {input_csv}. {quarantined} malformed rows saved to {quarantine_csv}, well-formed rows to {output_csv}.")
+
+  except FileNotFoundError:
+    print(f"Error: Input file not found at {input_csv}")
+    logging.error(f"Error: Input file not found at {input_csv}")
+  except Exception as e:
+    print(f"An unexpected error occurred when quarantining malformed rows: {e}")
+    logging.error(f"An unexpected error occurred when quarantining malformed rows: {e}")
+
+  return quarantined
+
+def _quarantine_record_blocks(input_csv, output_csv, quarantine_csv, chunk_bytes, sep, quotechar, stage):
+  """Quarantines the malformed rows of a compressed CSV file, reading it front to back in this process.
+
+  Returns the number of malformed rows, and counts the records on stage as quarantine_malformed_rows does.
+  """
+  quarantined = 0
+  line = None
+  with open_compressed(output_csv, 'wb') as output, \
+       open_compressed(quarantine_csv, 'w', newline='', encoding='utf-8-sig') as quarantine:
+    writer = csv.writer(quarantine)
+    writer.writerow(['line_number', 'field_count', 'record'])
+    for header, block in iter_csv_record_blocks(input_csv, chunk_bytes, quotechar):
+      if line is None:
+        expected_fields = len(next(csv.reader([header.decode('utf-8-sig')], delimiter=sep, quotechar=quotechar), []))
+        output.write(header)
+        line = 1 + header.count(b'\n')
+      newline_count, record_count, records = _scan_field_counts(block, 0, expected_fields, sep, quotechar)
+      position = 0
+      for record_offset, record_length, record_line, field_count in records:
+        output.write(block[position:record_offset])
+        record = block[record_offset:record_offset + record_length].decode('utf-8', errors='replace').rstrip('\r\n')
+        writer.writerow([line + record_line, field_count, record])
+        position = record_offset + record_length
+      output.write(block[position:])
+      line += newline_count
+      quarantined += len(records)
+      stage.rows_in += record_count
+      stage.rows_rejected += len(records)
+  return quarantined
+
+# Copy a byte range from one open binary file to another in blocks
+def _copy_bytes(source, output, offset, length):
+  source.seek(offset)
+  while length > 0:
+    block = source.read(min(COPY_BLOCK_BYTES, length))
+    if not block:
+      break
+    output.write(block)
+    length -= len(block)
+
 # prompt: Create a function to get chunked CSVs from a specified folder, runs the validation functions and outputs the cleaned chunks in specified folders. Include error checking and logging.
 
-def process_chunked_csvs_output_folders(input_folder, output_valid_folder, output_error_folder, email_column_name='email', date_columns=['created_at']):
+def process_chunked_csvs_output_folders(input_folder, output_valid_folder, output_error_folder, email_column_name='email', date_columns=['date_of_birth'], workers=1, manifest_path=None, file_format='csv', metrics=None, pipelined=False, compression=None):
   """
   Processes chunked CSV files from a specified folder, runs validation functions,
   and outputs the cleaned chunks in specified folders. Includes error checking and logging.
@@ -145,66 +1450,600 @@ def process_chunked_csvs_output_folders(input_folder, output_valid_folder, outpu
       output_valid_folder (str): The path to the folder to output cleaned chunks.
       output_error_folder (str): The path to the folder to output chunks with errors.
       email_column_name (str): The name of the email column.
-      date_columns (list): A list of column names to consider for date validation.
+      date_columns (list): The date columns to normalize to YYYY-MM-DD. Records with unparseable
+          or out-of-range dates go to the error output.
+      workers (int): The number of worker processes. 1 processes the chunks one at a time
+          in this process; more than 1 sends the chunks to a process pool.
+      manifest_path (str): Optional path to a JSON checkpoint manifest. When given, chunks whose
+          content and cleaning config are unchanged since the last run are skipped, and the
+          manifest is updated after every chunk so a crashed run can resume.
+      file_format (str): The format of the input chunks and the cleaned/error chunk outputs:
+          'csv', 'parquet' or 'arrow'.
+      metrics (RunMetrics): Optional metrics to record the per-chunk stages on, including
+          the stages run in worker processes.
+      pipelined (bool): With workers=1, read the next chunks and write the finished ones on
+          background threads while a chunk is cleaned. At most 2 * PIPELINE_QUEUE_SIZE + 3
+          chunks are held in memory.
+      compression (str): Optional codec to compress the cleaned/error chunk outputs with, as in
+          split_csv_into_chunks. Compressed CSV input chunks (.csv.gz, .csv.zst) are read either way.
+
+  Returns:
+      list: One result dict per chunk, in chunk order, with the chunk file name, whether
+          it succeeded, its valid and error row counts and the error message if it failed.
   """
 
+  results = []
   try:
     # Setup logging
     #logging.basicConfig(filename='processing_log.txt', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     print(f"Processing chunks from: {input_folder} for data cleaning and output to folders.")
     logging.info(f"Processing chunks from: {input_folder} for data cleaning and output to folders.")
 
-    for filename in os.listdir(input_folder):
-      if filename.endswith(".csv"):
-        file_path = os.path.join(input_folder, filename)
-        print(f"Processing file: {file_path}")
-        logging.info(f"Processing file: {file_path}")
+    os.makedirs(output_valid_folder, exist_ok=True)
+    os.makedirs(output_error_folder, exist_ok=True)
+
+    filenames = list_chunk_files(input_folder, INTERMEDIATE_EXTENSIONS[file_format])
+    tasks = [(os.path.join(input_folder, filename), filename, output_valid_folder, output_error_folder, email_column_name, file_format, metrics is not None,
+              None, date_columns, compression)
+             for filename in filenames]
+
+    # Skip chunks the manifest already records as cleaned with the same content and config
+    manifest = None
+    skipped = {}
+    if manifest_path:
+      manifest = load_chunk_manifest(manifest_path)
+      # compression only joins the config when set, so existing manifests stay current
+      config = {'compression': compression} if compression else {}
+      config_hash = cleaning_config_hash(email_column_name=email_column_name, file_format=file_format, date_columns=list(date_columns), **config)
+      content_hashes = {filename: file_content_hash(os.path.join(input_folder, filename)) for filename in filenames}
+      for filename in filenames:
+        entry = manifest['chunks'].get(filename)
+        if is_chunk_current(entry, content_hashes[filename], config_hash, output_valid_folder, output_error_folder):
+          skipped[filename] = dict(entry['result'], skipped=True)
+      tasks = [task for task in tasks if task[1] not in skipped]
+      print(f"Checkpoint manifest {manifest_path}: {len(skipped)} chunks unchanged, {len(tasks)} to clean.")
+      logging.info(f"Checkpoint manifest {manifest_path}: {len(skipped)} chunks unchanged, {len(tasks)} to clean.")
+
+    def record(result):
+      stages = result.pop('stages', None)
+      if metrics is not None and stages:
+        metrics.merge(stages)
+      if manifest is not None and result['success']:
+        entry = {'content_hash': content_hashes[result['file']], 'config_hash': config_hash, 'result': result}
+        manifest['chunks'][result['file']] = entry
+        append_chunk_manifest_entry(result['file'], entry, manifest_path)
+      return result
+
+    if workers > 1:
+      print(f"Cleaning {len(tasks)} chunks with {workers} worker processes.")
+      logging.info(f"Cleaning {len(tasks)} chunks with {workers} worker processes.")
+      with ProcessPoolExecutor(max_workers=workers, initializer=set_verbosity, initargs=(PRINT_DETAIL,)) as executor:
+        cleaned = [record(result) for result in executor.map(_clean_chunk_file, *zip(*tasks))] if tasks else []
+    elif pipelined:
+      print(f"Cleaning {len(tasks)} chunks with background reads and writes.")
+      logging.info(f"Cleaning {len(tasks)} chunks with background reads and writes.")
+      cleaned = _clean_chunk_files_pipelined(tasks, metrics, record)
+    else:
+      cleaned = [record(_clean_chunk_file(*task)) for task in tasks]
+
+    cleaned = {result['file']: result for result in cleaned}
+    results = [skipped[filename] if filename in skipped else cleaned[filename] for filename in filenames]
+    if manifest is not None:
+      save_chunk_manifest(manifest, manifest_path)
+
+    failed = [result['file'] for result in results if not result['success']]
+    print(f"Finished cleaning {len(results)} chunks from {input_folder}. Failed chunks: {len(failed)} {failed}")
+    logging.info(f"Finished cleaning {len(results)} chunks from {input_folder}. Failed chunks: {len(failed)} {failed}")
+    log_value_cache_stats()
 
-        try:
-          df = pd.read_csv(file_path, low_memory=True, encoding='utf-8')
+  except Exception as e:
+    print(f"Critical error during processing: {e}")
+    logging.critical(f"Critical error during processing: {e}")
 
-          # Run validation functions
-          df = validate_email_dataframe(df, email_column_name,'noemail')
-          columns_to_combine = ['address', 'province', 'city', 'postal_code']
-          new_column_name = 'full_address'
-          df = combine_columns(df, columns_to_combine, new_column_name)
-          columns_to_check = ['vehicle_identification_number', 'id_card_number']
-          df, chunk_error_df = validate_alphanumeric_columns(df, columns_to_check)
+  return results
 
-          # Output cleaned chunk
-          if not os.path.exists(output_valid_folder):
-            os.makedirs(output_valid_folder)
+# prompt: Clean a large CSV in parallel by byte ranges, without writing intermediate chunk files
 
-          output_valid_file = os.path.join(output_valid_folder, f"valid_{filename}")
-          df.to_csv(output_valid_file, index=False, encoding='utf-8-sig')
-          print(f"Final valid data saved to {output_valid_file}.")
-          logging.info(f"Final valid data saved to {output_valid_file}.")
+def process_csv_byte_ranges(input_csv, output_valid_folder, output_error_folder, chunk_bytes=CHUNK_BYTES, email_column_name='email', date_columns=['date_of_birth'], workers=1, file_format='csv', metrics=None, compression=None):
+  """
+  Cuts a CSV file into byte ranges with find_csv_byte_ranges and cleans each range as a chunk,
+  reading it straight from the source file. The cleaned and error chunks are written to the
+  output folders with the same names process_chunked_csvs_output_folders uses, so
+  combine_csv_chunks can merge them.
 
-          # Output chunk with errors
-          if not os.path.exists(output_error_folder):
-            os.makedirs(output_error_folder)
+  The byte ranges are read with random access, so input_csv must not be compressed. Split a
+  compressed file with split_csv_by_byte_ranges and clean the chunks with
+  process_chunked_csvs_output_folders instead.
 
-          output_error_file = os.path.join(output_error_folder, f"error_{filename}")
-          chunk_error_df.to_csv(output_error_file, index=False, encoding='utf-8-sig')
-          print(f"Final error data saved to {output_error_file}.")
-          logging.info(f"Final error data saved to {output_error_file}.")
+  Args:
+      input_csv (str): The path to the CSV file to clean.
+      output_valid_folder (str): The path to the folder to output cleaned chunks.
+      output_error_folder (str): The path to the folder to output chunks with errors.
+      chunk_bytes (int): The approximate size of each range in bytes.
+      email_column_name (str): The name of the email column.
+      date_columns (list): The date columns to normalize to YYYY-MM-DD.
+      workers (int): The number of worker processes. 1 cleans the ranges one at a time
+          in this process.
+      file_format (str): The format of the cleaned/error chunk outputs: 'csv', 'parquet' or 'arrow'.
+      metrics (RunMetrics): Optional metrics to record the split and per-chunk stages on.
+      compression (str): Optional codec to compress the cleaned/error chunk outputs with.
 
-          print(f"File from {file_path} processed successfully.")
-          logging.info(f"File {file_path} processed successfully.")
+  Returns:
+      list: One result dict per range, in file order, as returned by process_chunked_csvs_output_folders.
+  """
 
-        except Exception as e:
-          print(f"Error processing file {file_path}: {e}")
-          logging.error(f"Error processing file {file_path}: {e}")
+  results = []
+  try:
+    print(f"Processing byte ranges of: {input_csv} for data cleaning and output to folders.")
+    logging.info(f"Processing byte ranges of: {input_csv} for data cleaning and output to folders.")
+
+    os.makedirs(output_valid_folder, exist_ok=True)
+    os.makedirs(output_error_folder, exist_ok=True)
+
+    with measure_stage(metrics, 'split'):
+      header, ranges = find_csv_byte_ranges(input_csv, chunk_bytes)
+    tasks = [(input_csv, f"chunk_{i+1}{INTERMEDIATE_EXTENSIONS[file_format]}", output_valid_folder, output_error_folder,
+              email_column_name, file_format, metrics is not None, (offset, length, header), date_columns, compression)
+             for i, (offset, length) in enumerate(ranges)]
+
+    if workers > 1:
+      print(f"Cleaning {len(tasks)} byte ranges with {workers} worker processes.")
+      logging.info(f"Cleaning {len(tasks)} byte ranges with {workers} worker processes.")
+      with ProcessPoolExecutor(max_workers=workers, initializer=set_verbosity, initargs=(PRINT_DETAIL,)) as executor:
+        results = list(executor.map(_clean_chunk_file, *zip(*tasks))) if tasks else []
+    else:
+      results = [_clean_chunk_file(*task) for task in tasks]
+
+    for result in results:
+      stages = result.pop('stages', None)
+      if metrics is not None and stages:
+        metrics.merge(stages)
+
+    failed = [result['file'] for result in results if not result['success']]
+    print(f"Finished cleaning {len(results)} byte ranges from {input_csv}. Failed chunks: {len(failed)} {failed}")
+    logging.info(f"Finished cleaning {len(results)} byte ranges from {input_csv}. Failed chunks: {len(failed)} {failed}")
 
   except Exception as e:
     print(f"Critical error during processing: {e}")
     logging.critical(f"Critical error during processing: {e}")
 
+  return results
+
+# List the CSV chunk files in a folder in chunk order (chunk_2 before chunk_10)
+def list_chunk_files(input_folder, extension=".csv"):
+  """Lists the chunk files in a folder, sorted by chunk number and then by name.
+
+  Args:
+    input_folder: The path to the folder containing chunk files.
+    extension: The file extension of the chunk files. CSV chunks compressed with one of
+      COMPRESSION_EXTENSIONS, e.g. chunk_1.csv.gz, are listed too.
+
+  Returns:
+    A list of file names.
+  """
+  def chunk_sort_key(filename):
+    numbers = re.findall(r"\d+", with_compression(filename, None))
+    return (int(numbers[-1]) if numbers else -1, filename)
+
+  extensions = (extension,)
+  if extension == INTERMEDIATE_EXTENSIONS['csv']:
+    extensions += tuple(extension + suffix for suffix in COMPRESSION_EXTENSIONS.values())
+  return sorted((filename for filename in os.listdir(input_folder) if filename.endswith(extensions)), key=chunk_sort_key)
+
+# Clean a single chunk file and write its valid and error outputs. Runs in a worker process in parallel mode.
+def _clean_chunk_file(file_path, filename, output_valid_folder, output_error_folder, email_column_name='email', file_format='csv', collect_metrics=False, byte_range=None, date_columns=DEFAULT_DATE_COLUMNS, compression=None):
+  """Cleans one chunk file and writes the valid and error chunk files for it.
+
+  Args:
+    file_path: The path to the chunk file, or to the source CSV when byte_range is given.
+    filename: The chunk file name, used to name the output files.
+    output_valid_folder: The path to the folder to output the cleaned chunk.
+    output_error_folder: The path to the folder to output the chunk errors.
+    email_column_name: The name of the email column.
+    file_format: The format to write the output chunks in: 'csv', 'parquet' or 'arrow'.
+    collect_metrics: If True, the result also holds the chunk's stage metrics under 'stages'.
+    byte_range: Optional (offset, length, header) tuple from find_csv_byte_ranges. When given,
+      the chunk is read straight from that byte range of file_path.
+    date_columns: The date columns to normalize.
+    compression: Optional codec to compress the output chunks with.
+
+  Returns:
+    A dict with the chunk file name, success flag, valid/error row counts, error message
+    and the paths of the valid and error output files.
+  """
+  metrics = RunMetrics() if collect_metrics else None
+  result = _new_chunk_result(filename, output_valid_folder, output_error_folder, file_format, compression)
+
+  try:
+    df = _read_chunk_file(file_path, byte_range, metrics)
+
+    # Run validation functions
+    df, chunk_error_df = clean_chunk_dataframe(df, email_column_name, metrics, date_columns)
+
+    _write_chunk_files(df, chunk_error_df, result, file_format, metrics, compression)
+    print_detail(f"File from {file_path} processed successfully.")
+    logging.info(f"File {file_path} processed successfully.")
+    # Worker processes have their own value caches, which the parent never sees
+    if multiprocessing.parent_process() is not None:
+      log_value_cache_stats()
+
+  except Exception as e:
+    result['error'] = str(e)
+    print(f"Error processing file {file_path}: {e}")
+    logging.error(f"Error processing file {file_path}: {e}")
+
+  if metrics is not None:
+    result['stages'] = metrics.stages
+  return result
+
+def _new_chunk_result(filename, output_valid_folder, output_error_folder, file_format='csv', compression=None):
+  """Returns the result dict of a chunk that has not been cleaned yet.
+
+  CSV outputs take the extension of compression in place of any the chunk file has, e.g. chunk_1.csv.gz
+  gives valid_chunk_1.csv when compression is None.
+  """
+  output_name = with_compression(filename, compression) if file_format == 'csv' else filename
+  return {'file': filename, 'success': False, 'valid_rows': 0, 'error_rows': 0, 'error': None,
+          'valid_file': os.path.join(output_valid_folder, f"valid_{output_name}"),
+          'error_file': os.path.join(output_error_folder, f"error_{output_name}")}
+
+def _read_chunk_file(file_path, byte_range=None, metrics=None):
+  """Reads one chunk file, or one byte range of the source CSV, with the car owner schema."""
+  print_detail(f"Processing file: {file_path}")
+  logging.info(f"Processing file: {file_path}")
+  with measure_stage(metrics, 'read') as stage:
+    if byte_range:
+      df = read_csv_byte_range(file_path, *byte_range, **car_owner_read_options())
+    else:
+      df = read_intermediate(file_path, **car_owner_read_options())
+    stage.rows_in = stage.rows_out = len(df)
+  return df
+
+def _write_chunk_files(df, chunk_error_df, result, file_format='csv', metrics=None, compression=None):
+  """Writes a cleaned chunk and its errors to the files named in result and marks the result successful."""
+  # Output cleaned chunk
+  with measure_stage(metrics, 'write', len(df)):
+    write_intermediate(df, result['valid_file'], file_format, compression)
+  print_detail(f"Final valid data saved to {result['valid_file']}.")
+  logging.info(f"Final valid data saved to {result['valid_file']}.")
+
+  # Output chunk with errors
+  with measure_stage(metrics, 'write', len(chunk_error_df)):
+    write_intermediate(chunk_error_df, result['error_file'], file_format, compression)
+  print_detail(f"Final error data saved to {result['error_file']}.")
+  logging.info(f"Final error data saved to {result['error_file']}.")
+
+  result.update(success=True, valid_rows=len(df), error_rows=len(chunk_error_df))
+
+# Pipelined counterpart of calling _clean_chunk_file on each task: reads run ahead and writes behind on background threads
+def _clean_chunk_files_pipelined(tasks, metrics=None, on_result=None, queue_size=PIPELINE_QUEUE_SIZE):
+  """Cleans chunk files like _clean_chunk_file, overlapping each chunk's cleaning with the next reads and previous writes.
+
+  Args:
+    tasks: Tuples of _clean_chunk_file arguments.
+    metrics: An optional RunMetrics to record the stages on.
+    on_result: An optional function called with each chunk's result dict once the chunk is
+      written, in chunk order. It runs on the writer thread and its return value replaces the result.
+    queue_size: The number of chunks that may wait to be cleaned, and to be written.
+
+  Returns:
+    list: The result dicts, in chunk order.
+  """
+  results = []
+
+  def read_chunk(task):
+    file_path, byte_range = task[0], task[7]
+    return _read_chunk_file(file_path, byte_range, metrics)
+
+  def finish_chunk(file_path, result, file_format, compression, df=None, chunk_error_df=None):
+    if df is not None:
+      try:
+        _write_chunk_files(df, chunk_error_df, result, file_format, metrics, compression)
+        print_detail(f"File from {file_path} processed successfully.")
+        logging.info(f"File {file_path} processed successfully.")
+      except Exception as e:
+        result['error'] = str(e)
+        print(f"Error processing file {file_path}: {e}")
+        logging.error(f"Error processing file {file_path}: {e}")
+    results.append(on_result(result) if on_result else result)
+
+  with BackgroundWriter(queue_size) as writer:
+    for task, df, read_error in prefetch(tasks, read_chunk, queue_size):
+      file_path, filename, output_valid_folder, output_error_folder, email_column_name, file_format, _, _, date_columns, compression = task
+      result = _new_chunk_result(filename, output_valid_folder, output_error_folder, file_format, compression)
+      try:
+        if read_error is not None:
+          raise read_error
+        # Run validation functions
+        df, chunk_error_df = clean_chunk_dataframe(df, email_column_name, metrics, date_columns)
+        writer.submit(finish_chunk, file_path, result, file_format, compression, df, chunk_error_df)
+      except Exception as e:
+        result['error'] = str(e)
+        print(f"Error processing file {file_path}: {e}")
+        logging.error(f"Error processing file {file_path}: {e}")
+        writer.submit(finish_chunk, file_path, result, file_format, compression)
+  return results
+
+# Bump when the cleaning steps change in a way that should invalidate checkpointed chunk outputs
+CLEANING_VERSION = 3
+
+# Hash a file's bytes in blocks so large chunks are not loaded into memory
+def file_content_hash(file_path, block_size=1024 * 1024):
+  """Returns the SHA-256 hex digest of a file's contents."""
+  digest = hashlib.sha256()
+  with open(file_path, 'rb') as f:
+    for block in iter(lambda: f.read(block_size), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+# Hash the cleaning configuration, so a config change invalidates checkpointed outputs
+def cleaning_config_hash(**config):
+  """Returns a SHA-256 hex digest of the cleaning config and CLEANING_VERSION."""
+  config = dict(config, cleaning_version=CLEANING_VERSION)
+  return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def load_chunk_manifest(manifest_path):
+  """Loads a chunk checkpoint manifest, or returns an empty one if it does not exist or is unreadable.
+
+  Entries appended to the manifest journal since the manifest was last saved are applied on top.
+  """
+  try:
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+      manifest = json.load(f)
+    manifest.setdefault('chunks', {})
+  except FileNotFoundError:
+    manifest = {'chunks': {}}
+  except Exception as e:
+    print(f"Could not read checkpoint manifest {manifest_path}, starting fresh: {e}")
+    logging.warning(f"Could not read checkpoint manifest {manifest_path}, starting fresh: {e}")
+    manifest = {'chunks': {}}
+
+  try:
+    with open(chunk_manifest_journal(manifest_path), 'r', encoding='utf-8') as f:
+      for line in f:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          # A run that crashed while appending leaves a partial last line
+          break
+        manifest['chunks'][record['file']] = record['entry']
+  except FileNotFoundError:
+    pass
+  return manifest
+
+def chunk_manifest_journal(manifest_path):
+  """Returns the path of the journal that chunk entries are appended to between manifest saves."""
+  return f"{manifest_path}.journal"
+
+def append_chunk_manifest_entry(filename, entry, manifest_path):
+  """Appends one chunk's manifest entry to the manifest journal as a JSON line.
+
+  Appending costs the same for every chunk, where rewriting the whole manifest after each chunk
+  would cost O(n^2) over a run. load_chunk_manifest replays the journal, so a crashed run still
+  resumes from its last finished chunk.
+  """
+  folder = os.path.dirname(manifest_path)
+  if folder:
+    os.makedirs(folder, exist_ok=True)
+  with open(chunk_manifest_journal(manifest_path), 'a', encoding='utf-8') as f:
+    f.write(json.dumps({'file': filename, 'entry': entry}, ensure_ascii=False) + '\n')
+
+def save_chunk_manifest(manifest, manifest_path):
+  """Writes a chunk checkpoint manifest atomically, so a crash never leaves a half-written file, and clears the journal."""
+  write_json_atomic(manifest, manifest_path)
+  journal = chunk_manifest_journal(manifest_path)
+  if os.path.exists(journal):
+    os.remove(journal)
+
+def write_json_atomic(data, path):
+  """Writes data as JSON to a temporary file and renames it over path, so readers never see a half-written file."""
+  folder = os.path.dirname(path)
+  if folder:
+    os.makedirs(folder, exist_ok=True)
+  temp_path = f"{path}.tmp"
+  with open(temp_path, 'w', encoding='utf-8') as f:
+    json.dump(data, f, indent=2, ensure_ascii=False)
+  os.replace(temp_path, path)
+
+def is_chunk_current(entry, content_hash, config_hash, output_valid_folder=None, output_error_folder=None):
+  """Checks whether a manifest entry matches a chunk's content and config and its outputs still exist.
+
+  When the output folders are given, the recorded outputs must also be in them, so a run into new
+  folders cleans every chunk again instead of pointing at the outputs of an earlier run.
+  """
+  if not entry:
+    return False
+  if entry.get('content_hash') != content_hash or entry.get('config_hash') != config_hash:
+    return False
+  result = entry.get('result', {})
+  for path, folder in ((result.get('valid_file'), output_valid_folder), (result.get('error_file'), output_error_folder)):
+    if not path or not os.path.exists(path):
+      return False
+    if folder is not None and os.path.abspath(os.path.dirname(path)) != os.path.abspath(folder):
+      return False
+  return True
+
+# Default number of distinct values each per-value cache keeps across chunks
+VALUE_CACHE_SIZE = 200000
+
+# Per-value result caches for the run, by name. Each worker process has its own.
+VALUE_CACHES = {}
+
+# Leading rows sampled to estimate how many distinct values a column holds
+DISTINCT_SAMPLE_ROWS = 10000
+
+# Columns estimated to hold a larger share of distinct values than this are not factorized
+MAX_DISTINCT_SHARE = 0.5
+
+# Bounded LRU cache of value -> result shared by the chunks of a run
+class ValueCache:
+    """A bounded LRU cache of per-value validator results, with hit-rate stats.
+
+    A cache that still hits less than min_hit_rate after warmup lookups turns itself off.
+    This is the case for near-unique columns, where looking values up costs more than it saves.
+
+    Args:
+      name: The cache name used in the logs.
+      maxsize: The maximum number of values kept. The least recently used are evicted first.
+      min_hit_rate: The hit rate below which the cache turns itself off after warmup.
+      warmup: The number of lookups before the hit rate is checked.
+    """
+
+    def __init__(self, name, maxsize=VALUE_CACHE_SIZE, min_hit_rate=0.05, warmup=VALUE_CACHE_SIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self.min_hit_rate = min_hit_rate
+        self.warmup = warmup
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+
+    def lookup(self, values):
+        """Returns a list with the cached result for each value, or None where it is not cached."""
+        if not self.enabled:
+            return [None] * len(values)
+        results = []
+        for value in values:
+            result = self.entries.get(value)
+            if result is not None:
+                self.entries.move_to_end(value)
+            results.append(result)
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(values) - hits
+        if self.hits + self.misses >= self.warmup and self.hit_rate() < self.min_hit_rate:
+            self.enabled = False
+            self.entries.clear()
+            logging.info(f"Value cache '{self.name}' turned off: hit rate {self.hit_rate():.1%} after {self.hits + self.misses} lookups.")
+        return results
+
+    def store(self, values, results):
+        """Caches the results of values that were not cached."""
+        if not self.enabled:
+            return
+        for value, result in zip(values, results):
+            self.entries[value] = result
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        """Returns the share of lookups that were hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """Returns the cache stats as a dict."""
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(), 'size': len(self.entries), 'enabled': self.enabled}
+
+def get_value_cache(name, maxsize=VALUE_CACHE_SIZE):
+    """Returns the run's ValueCache with this name, creating it on first use."""
+    if name not in VALUE_CACHES:
+        VALUE_CACHES[name] = ValueCache(name, maxsize)
+    return VALUE_CACHES[name]
+
+def log_value_cache_stats():
+    """Logs the hit rate of every value cache in this process."""
+    for name, cache in VALUE_CACHES.items():
+        stats = cache.stats()
+        print_detail(f"Value cache '{name}': {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%}), {stats['size']} values cached.")
+        logging.info(f"Value cache '{name}': {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%}), {stats['size']} values cached.")
+
+# Estimate a column's cardinality from a sample, to decide whether factorizing it pays off
+def estimate_distinct_count(values, sample_rows=DISTINCT_SAMPLE_ROWS):
+    """Estimates the number of distinct non-missing values in a Series from its leading rows.
+
+    Uses the bias-corrected Chao1 estimator, which extrapolates from how many sampled values
+    were seen exactly once or twice. A plain distinct count of the sample cannot tell a column
+    with a few tens of thousands of values (dates) from an all-distinct one (emails).
+
+    Args:
+      values: A pandas Series.
+      sample_rows: The number of leading rows to sample.
+
+    Returns:
+      The estimated number of distinct values, at most the number of rows.
+    """
+    counts = values.iloc[:sample_rows].value_counts().to_numpy()
+    singletons = np.count_nonzero(counts == 1)
+    doubletons = np.count_nonzero(counts == 2)
+    estimate = len(counts) + singletons * (singletons - 1) / (2 * (doubletons + 1))
+    return min(int(estimate), len(values))
+
+# Run a per-value function once per distinct value of a column and broadcast the results to the rows
+def map_distinct(values, func, cache=None, fill_value=None, broadcast=True, max_distinct_share=MAX_DISTINCT_SHARE):
+    """Applies a vectorized per-value function to the distinct values of a column only.
+
+    Args:
+      values: A pandas Series.
+      func: A function that takes a pandas Series of distinct, non-missing values (with the
+        dtype of values) and returns a NumPy array of results of the same length, or a tuple
+        of such arrays.
+      cache: An optional ValueCache. Values cached by earlier chunks are not passed to func.
+      fill_value: The result for missing values, or a tuple with one per output of func.
+      broadcast: If False, return the factorize codes and the per-distinct-value results
+        instead, for callers that map them back to the rows themselves.
+      max_distinct_share: Columns estimated to hold more than this share of distinct values
+        (e.g. email addresses) are passed to func whole, without factorizing or the cache,
+        which would cost more than they save.
+
+    Returns:
+      A NumPy array with one result per row, or a tuple of them if func returns a tuple.
+      With broadcast=False, a tuple of (codes, results), where codes is -1 for missing values.
+    """
+    if estimate_distinct_count(values) > max_distinct_share * len(values):
+        not_null = values.notna().to_numpy(dtype=bool)
+        codes = None
+        uniques = values[not_null].reset_index(drop=True)
+        use_cache = False
+    else:
+        not_null = None
+        codes, uniques = pd.factorize(values)
+        uniques = pd.Series(uniques, dtype=values.dtype)
+        use_cache = cache is not None and cache.enabled
+
+    cached = cache.lookup(uniques.to_numpy(dtype=object)) if use_cache else None
+    missing = np.array([result is None for result in cached], dtype=bool) if use_cache else None
+    computed = func(uniques[missing].reset_index(drop=True) if use_cache else uniques)
+    single = not isinstance(computed, tuple)
+    computed = (computed,) if single else computed
+
+    outputs = list(computed)
+    if use_cache:
+        for i, computed_output in enumerate(computed):
+            output = np.empty(len(uniques), dtype=object)
+            output[missing] = computed_output
+            output[~missing] = [result[i] for result, is_missing in zip(cached, missing) if not is_missing]
+            outputs[i] = output.astype(computed_output.dtype)
+        cache.store(uniques[missing].to_numpy(dtype=object), list(zip(*computed)))
+
+    if not broadcast:
+        if codes is None:
+            codes = np.full(len(values), -1, dtype=np.intp)
+            codes[not_null] = np.arange(len(uniques))
+        return codes, outputs[0] if single else tuple(outputs)
+
+    fill_values = (fill_value,) if single else (fill_value if isinstance(fill_value, tuple) else (fill_value,) * len(outputs))
+    rows = []
+    for output, fill in zip(outputs, fill_values):
+        if codes is None:
+            row = np.full(len(values), fill, dtype=output.dtype)
+            row[not_null] = output
+        else:
+            # Missing values have code -1, which picks the fill value appended at the end
+            row = np.append(output, np.array([fill], dtype=output.dtype))[codes]
+        rows.append(row)
+    return rows[0] if single else tuple(rows)
+
 # prompt: Create a function to check whether the specified columns contain alphanumerical characters only and if they don't save the invalid records to a dataframe, dropthe invalid record from the original dataframe. Return both the cleaned and invalid records dataframes.
 
 def validate_alphanumeric_columns(df, columns_to_validate):
     """Checks if specified columns contain only alphanumeric characters and separates invalid records.
 
+    All columns are checked into one combined mask and the frame is split once. Each
+    invalid record gets an error_reason column listing the failed checks as
+    '<column>:not_alphanumeric', separated by ';'. Missing values are not flagged.
+
     Args:
       df: The pandas DataFrame.
       columns_to_validate: A list of column names to validate.
@@ -212,9 +2051,8 @@ def validate_alphanumeric_columns(df, columns_to_validate):
     Returns:
       A tuple containing two DataFrames: (cleaned_df, invalid_records_df)
     """
-    invalid_records_df = pd.DataFrame()
-
     try:
+        failed_checks = {}
         for column in columns_to_validate:
             if column not in df.columns:
                 print(f"Column '{column}' not found in DataFrame.")
@@ -225,18 +2063,20 @@ def validate_alphanumeric_columns(df, columns_to_validate):
 
             # Try to convert column to string and check for alphanumeric characters
             try:
-                invalid_rows = df[~df[column].astype(str).str.isalnum()]
-                invalid_records_df = pd.concat([invalid_records_df, invalid_rows])
-                df = df[df[column].astype(str).str.isalnum()]
+                values = df[column]
+                is_valid = values.isna().to_numpy(dtype=bool) | values.astype(str).str.isalnum().fillna(False).to_numpy(dtype=bool)
+                failed_checks[f"{column}:not_alphanumeric"] = ~is_valid
 
-                print(f"Finished validating column '{column}'. Invalid rows found: {len(invalid_rows)}.")
-                logging.info(f"Finished validating column '{column}'. Invalid rows found: {len(invalid_rows)}.")
+                print_detail(f"Finished validating column '{column}'. Invalid rows found: {int((~is_valid).sum())}.")
+                logging.info(f"Finished validating column '{column}'. Invalid rows found: {int((~is_valid).sum())}.")
 
             except Exception as e:
                 print(f"Error processing column '{column}': {e}")
                 logging.error(f"Error processing column '{column}': {e}")
                 raise ValueError(f"Error processing column '{column}': {e}")
 
+        df, invalid_records_df = split_by_failed_checks(df, failed_checks)
+
     except Exception as e:
         print("An error occurred during validation.")
         logging.exception("An error occurred during validation.")
@@ -244,6 +2084,390 @@ def validate_alphanumeric_columns(df, columns_to_validate):
 
     return df, invalid_records_df
 
+# Split a dataframe on a set of failed-check masks, labelling each invalid row with its reason codes
+def split_by_failed_checks(df, failed_checks, reason_column='error_reason'):
+    """Splits a DataFrame into valid and invalid records using boolean failure masks.
+
+    Args:
+      df: The pandas DataFrame.
+      failed_checks: A dict mapping a reason code to a boolean NumPy array that is True
+        where the row failed that check.
+      reason_column: The name of the column holding the reason codes in the invalid records.
+
+    Returns:
+      A tuple containing two DataFrames: (valid_df, invalid_records_df). Reason codes for
+      rows that failed several checks are joined with ';'.
+    """
+    reasons = np.full(len(df), '', dtype=object)
+    any_failed = np.zeros(len(df), dtype=bool)
+    for reason, failed in failed_checks.items():
+        if not failed.any():
+            continue
+        needs_separator = any_failed & failed
+        reasons[needs_separator] = reasons[needs_separator] + ';'
+        reasons[failed] = reasons[failed] + reason
+        any_failed |= failed
+
+    invalid_records_df = df[any_failed].copy()
+    invalid_records_df[reason_column] = reasons[any_failed]
+    return df[~any_failed], invalid_records_df
+
+# Fixed-width views of identifier strings, so structural checks run over arrays of character codes
+def _string_bytes(arrow_strings):
+    """Returns the bytes of all the values of an Arrow string array, back to back, as a uint8 array."""
+    offset_type = np.int64 if pyarrow.types.is_large_string(arrow_strings.type) else np.int32
+    offsets = np.frombuffer(arrow_strings.buffers()[1], dtype=offset_type)[arrow_strings.offset:arrow_strings.offset + len(arrow_strings) + 1]
+    data = arrow_strings.buffers()[2]
+    if data is None:
+        return np.empty(0, dtype=np.uint8)
+    return np.frombuffer(data, dtype=np.uint8)[offsets[0]:offsets[-1]]
+
+def _fixed_width_codes(values, widths):
+    """Returns the character codes of the values whose length is one of widths.
+
+    With pyarrow the codes are read straight from the Arrow string buffer, without creating a
+    Python string per value. Characters outside ASCII are stored as codes of 128 and above,
+    which no check accepts.
+
+    Args:
+      values: A pandas Series of strings.
+      widths: The string lengths to keep.
+
+    Returns:
+      A tuple of (lengths, codes). lengths is an integer array with the length of each value,
+      -1 for missing values. codes maps each width to a tuple of (positions, code_array), where
+      code_array is a (width, len(positions)) uint8 array holding one row per character
+      position, so checks on a position read contiguous memory.
+    """
+    strings = values.astype(COMPACT_STRING_DTYPE)
+    if COMPACT_STRING_DTYPE == 'string[pyarrow]':
+        arrow_strings = pyarrow.array(strings.array)
+        if isinstance(arrow_strings, pyarrow.ChunkedArray):
+            arrow_strings = arrow_strings.combine_chunks()
+        byte_lengths = pyarrow.compute.binary_length(arrow_strings).fill_null(-1).to_numpy().astype(np.int64)
+        # Without a byte of 128 or above every string is ASCII, so its length is its byte length
+        all_ascii = _string_bytes(arrow_strings).max(initial=0) < 128
+        if all_ascii:
+            lengths = byte_lengths
+        else:
+            lengths = pyarrow.compute.utf8_length(arrow_strings).fill_null(-1).to_numpy().astype(np.int64)
+    else:
+        lengths = strings.str.len().to_numpy(dtype=np.int64, na_value=-1)
+        objects = strings.to_numpy(dtype=object, na_value='')
+
+    codes = {}
+    for width in widths:
+        at_width = lengths == width
+        positions = np.flatnonzero(at_width)
+        if not len(positions):
+            code_array = np.empty((width, 0), dtype=np.uint8)
+        elif COMPACT_STRING_DTYPE == 'string[pyarrow]':
+            # Values with one byte per character are ASCII; once filtered their bytes sit back to back
+            if all_ascii:
+                selected = arrow_strings.filter(at_width)
+                code_array = np.ascontiguousarray(_string_bytes(selected).reshape(len(selected), width).T)
+            else:
+                is_ascii = byte_lengths[positions] == width
+                selected = arrow_strings.filter(at_width & (byte_lengths == width))
+                code_array = np.full((width, len(positions)), 255, dtype=np.uint8)
+                code_array[:, is_ascii] = _string_bytes(selected).reshape(len(selected), width).T
+        else:
+            code_array = np.empty((width, len(positions)), dtype=np.uint8)
+            code_points = np.array(objects[positions], dtype=f'<U{width}').view(np.uint32).reshape(len(positions), width)
+            np.minimum(code_points.T, 255, out=code_array, casting='unsafe')
+        codes[width] = positions, code_array
+    return lengths, codes
+
+def _weighted_sum(rows, weights):
+    """Returns the sum of each row of rows times its weight, as one integer per column."""
+    total = np.zeros(rows.shape[1], dtype=np.uint16)
+    for row, weight in zip(rows, weights):
+        if weight:
+            total += row * np.uint16(weight)
+    return total
+
+def _digits_to_int(digits):
+    """Returns the integer spelled by the rows of a (width, n) array of digit values, most significant first."""
+    number = np.zeros(digits.shape[1], dtype=np.int32)
+    for row in digits:
+        number = number * 10 + row
+    return number
+
+def _valid_calendar_dates(years, months, days, min_year=1900):
+    """Returns a mask of the (year, month, day) integer triples that are real dates from min_year up to today."""
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    month_days = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(months, 0, 12)] + (leap & (months == 2))
+    today = dt.date.today()
+    return ((years >= min_year) & (months >= 1) & (months <= 12) & (days >= 1) & (days <= month_days)
+            & (years * 10000 + months * 100 + days <= today.year * 10000 + today.month * 100 + today.day))
+
+def check_id_card_numbers(values, date_of_birth=None, column='id_card_number'):
+    """Runs the GB 11643 structural checks on resident ID numbers.
+
+    18-digit numbers must have a known province-level region code, a real birth date from 1900
+    up to today and the right check character ('X' or 'x' for 10). 15-digit numbers issued
+    before 1999 have no check character; their birth date is read as 19YYMMDD. All checks run as
+    NumPy operations over the character codes. Missing values are not flagged.
+
+    Args:
+      values: A pandas Series of ID numbers.
+      date_of_birth: An optional Series of YYYY-MM-DD dates. Numbers whose birth date differs
+        from it are flagged.
+      column: The column name used in the reason codes.
+
+    Returns:
+      A dict mapping each reason code ('<column>:bad_length', 'bad_characters', 'bad_region_code',
+      'bad_birth_date', 'bad_check_digit', 'birth_date_mismatch') to a boolean NumPy array that
+      is True where the row failed that check.
+    """
+    lengths, codes = _fixed_width_codes(values, (18, 15))
+    failed = {reason: np.zeros(len(values), dtype=bool)
+              for reason in ('bad_characters', 'bad_region_code', 'bad_birth_date', 'bad_check_digit', 'birth_date_mismatch')}
+    failed = {'bad_length': (lengths != -1) & (lengths != 18) & (lengths != 15), **failed}
+    birth_dates = np.full(len(values), -1, dtype=np.int32)
+
+    for width, (positions, code_array) in codes.items():
+        # Code points below '0' wrap around to large values, so a digit is any code that ends up at most 9
+        digits = code_array - np.uint8(ord('0'))
+        if width == 18:
+            check_characters = np.where(code_array[17] == ord('x'), ord('X'), code_array[17])
+            well_formed = (digits[:17].max(axis=0) <= 9) & ((digits[17] <= 9) | (check_characters == ord('X')))
+        else:
+            well_formed = digits.max(axis=0) <= 9
+        # The other checks run on every row and only count for the well-formed ones
+        failed['bad_characters'][positions] = ~well_formed
+        failed['bad_region_code'][positions] = well_formed & ~KNOWN_ID_CARD_REGIONS[_digits_to_int(digits[0:2]) % 100]
+
+        if width == 18:
+            expected = ID_CARD_CHECK_CHARACTERS[_weighted_sum(digits[:17], ID_CARD_WEIGHTS) % 11]
+            failed['bad_check_digit'][positions] = well_formed & (expected != check_characters)
+            years, months, days = _digits_to_int(digits[6:10]), _digits_to_int(digits[10:12]), _digits_to_int(digits[12:14])
+        else:
+            years, months, days = 1900 + _digits_to_int(digits[6:8]), _digits_to_int(digits[8:10]), _digits_to_int(digits[10:12])
+        valid_birth_date = _valid_calendar_dates(years, months, days)
+        failed['bad_birth_date'][positions] = well_formed & ~valid_birth_date
+        birth_dates[positions] = np.where(well_formed & valid_birth_date, years * 10000 + months * 100 + days, -1)
+
+    if date_of_birth is not None:
+        # YYYY-MM-DD dates are read as the YYYYMMDD number spelled by their digits
+        _, date_codes = _fixed_width_codes(date_of_birth, (10,))
+        date_positions, date_array = date_codes[10]
+        recorded = _digits_to_int(date_array[[0, 1, 2, 3, 5, 6, 8, 9]] - np.uint8(ord('0')))
+        expected = birth_dates[date_positions]
+        failed['birth_date_mismatch'][date_positions] = (expected != -1) & (recorded != expected)
+
+    return {f"{column}:{reason}": mask for reason, mask in failed.items()}
+
+def check_vins(values, column='vehicle_identification_number'):
+    """Runs the ISO 3779 structural checks on vehicle identification numbers.
+
+    VINs must be 17 characters long, use only digits and the letters other than I, O and Q,
+    and carry the right check digit in position 9 ('X' for 10), which GB 16735 makes mandatory
+    for vehicles sold in China. Lowercase letters are read as uppercase. All checks run as NumPy
+    operations over the character codes. Missing values are not flagged.
+
+    Args:
+      values: A pandas Series of VINs.
+      column: The column name used in the reason codes.
+
+    Returns:
+      A dict mapping each reason code ('<column>:bad_length', 'bad_characters', 'bad_check_digit')
+      to a boolean NumPy array that is True where the row failed that check.
+    """
+    lengths, codes = _fixed_width_codes(values, (17,))
+    positions, code_array = codes[17]
+    bad_length = (lengths != -1) & (lengths != 17)
+    bad_characters = np.zeros(len(values), dtype=bool)
+    bad_check_digit = np.zeros(len(values), dtype=bool)
+
+    # bytes.translate looks up every code in one pass, several times faster than fancy indexing
+    character_values = np.frombuffer(code_array.tobytes().translate(VIN_CHARACTER_VALUES.view(np.uint8).tobytes()),
+                                     dtype=np.int8).reshape(code_array.shape)
+    well_formed = character_values.min(axis=0) >= 0
+    bad_characters[positions] = ~well_formed
+
+    expected = VIN_CHECK_CHARACTERS[_weighted_sum(character_values.view(np.uint8), VIN_WEIGHTS) % 11]
+    check_characters = np.where(code_array[8] == ord('x'), ord('X'), code_array[8])
+    bad_check_digit[positions] = well_formed & (expected != check_characters)
+
+    return {f"{column}:bad_length": bad_length, f"{column}:bad_characters": bad_characters, f"{column}:bad_check_digit": bad_check_digit}
+
+def validate_identifier_columns(df, id_card_columns=ID_CARD_COLUMNS, vin_columns=VIN_COLUMNS, date_of_birth_column='date_of_birth'):
+    """Separates records whose resident ID numbers or VINs fail their structural checks.
+
+    Args:
+      df: The pandas DataFrame.
+      id_card_columns: Column names of resident ID numbers, checked with check_id_card_numbers.
+      vin_columns: Column names of VINs, checked with check_vins.
+      date_of_birth_column: The column of YYYY-MM-DD birth dates the ID numbers must agree with,
+        or None. It is skipped when missing from df.
+
+    Returns:
+      A tuple containing two DataFrames: (valid_df, invalid_records_df). invalid_records_df has
+      an 'error_reason' column with the failed checks, e.g. 'id_card_number:bad_check_digit'.
+    """
+    try:
+        print_detail(f"Checking identifier columns: {list(id_card_columns) + list(vin_columns)}")
+        logging.info(f"Checking identifier columns: {list(id_card_columns) + list(vin_columns)}")
+        date_of_birth = df[date_of_birth_column] if date_of_birth_column in df.columns else None
+        failed_checks = {}
+        for column in id_card_columns:
+            if column in df.columns:
+                failed_checks.update(check_id_card_numbers(df[column], date_of_birth, column))
+        for column in vin_columns:
+            if column in df.columns:
+                failed_checks.update(check_vins(df[column], column))
+
+        valid_df, invalid_records_df = split_by_failed_checks(df, failed_checks)
+
+        print_detail(f"Identifier check complete. Invalid records: {len(invalid_records_df)}")
+        logging.info(f"Identifier check complete. Invalid records: {len(invalid_records_df)}")
+        return valid_df, invalid_records_df
+
+    except Exception as e:
+        print(f"An error occurred during the identifier check: {e}")
+        logging.exception(f"An error occurred during the identifier check: {e}")
+        raise e
+
+def detect_date_formats(values, candidate_formats=DATE_FORMATS, sample_size=500, min_share=0.002):
+    """Detects the formats used in a column of date strings from a sample of its distinct values.
+
+    Formats are picked greedily: the format that parses the most sampled values first, then
+    the format that parses the most of the values left over, and so on. A value that both
+    formats of an AMBIGUOUS_DATE_FORMATS pair parse as different dates counts for neither, so
+    03/04/1985 alone does not add a day-first or month-first format.
+
+    Args:
+      values: An array-like of date strings. Missing values are ignored.
+      candidate_formats: The strftime formats to try.
+      sample_size: The number of distinct values to sample.
+      min_share: Formats that parse less than this share of the sample are left out.
+
+    Returns:
+      A list of formats, most common first.
+    """
+    sample = pd.Series(pd.unique(pd.Series(values).dropna().astype(str).str.strip().to_numpy())[:sample_size], dtype=object)
+    min_hits = max(1, min_share * len(sample))
+    formats = []
+    while len(sample) and len(formats) < len(candidate_formats):
+        parsed = {fmt: pd.to_datetime(sample, format=fmt, errors='coerce') for fmt in candidate_formats}
+        hits = {fmt: parsed[fmt].notna().to_numpy() for fmt in candidate_formats if fmt not in formats}
+        for first, second in AMBIGUOUS_DATE_FORMATS:
+            if first in parsed and second in parsed:
+                ambiguous = (parsed[first].notna() & parsed[second].notna() & (parsed[first] != parsed[second])).to_numpy()
+                for fmt in (first, second):
+                    if fmt in hits:
+                        hits[fmt] = hits[fmt] & ~ambiguous
+        best = max(hits, key=lambda fmt: hits[fmt].sum())
+        if hits[best].sum() < min_hits:
+            break
+        formats.append(best)
+        # Values the new format parses are explained, including ambiguous ones it reads one way
+        sample = sample[parsed[best].isna().to_numpy()]
+    return formats
+
+def normalize_date_column(values, formats=None, min_date='1900-01-01', max_date=None):
+    """Parses a column of date strings with explicit formats and normalizes it to YYYY-MM-DD.
+
+    Only the distinct strings are parsed, one vectorized pass per format, and the results
+    are mapped back to the rows (see map_distinct). Birth dates repeat heavily, so this parses
+    a small fraction of the rows, and strings parsed by earlier chunks come from the run's
+    value cache.
+
+    Args:
+      values: A pandas Series of date strings.
+      formats: The strftime formats to try, in order. Detected with detect_date_formats if None.
+        Only these formats are used: a value none of them parse is unparseable, and so is a
+        value that both formats of an AMBIGUOUS_DATE_FORMATS pair parse as different dates.
+      min_date: The earliest valid date.
+      max_date: The latest valid date. Defaults to today.
+
+    Returns:
+      A tuple of the normalized Series (YYYY-MM-DD strings; invalid values are left as they
+      were), a boolean array that is True where a value could not be parsed and a boolean
+      array that is True where a parsed date is outside [min_date, max_date].
+    """
+    if formats is None:
+        formats = detect_date_formats(values.iloc[:DATE_DETECTION_ROWS])
+    lower = pd.Timestamp(min_date)
+    upper = pd.Timestamp(max_date) if max_date is not None else pd.Timestamp(dt.date.today())
+    cache = get_value_cache(f"date:{'|'.join(formats)}:{lower.date()}:{upper.date()}")
+    ambiguous_pairs = [pair for pair in AMBIGUOUS_DATE_FORMATS if pair[0] in formats and pair[1] in formats]
+
+    def parse(dates):
+        stripped = dates.astype(str).str.strip()
+        # Second resolution holds any four-digit year; dates pandas cannot represent at all are reported as unparseable
+        parsed = pd.Series(pd.NaT, index=stripped.index, dtype='datetime64[s]')
+        for fmt in formats:
+            unparsed = parsed.isna().to_numpy()
+            if not unparsed.any():
+                break
+            parsed[unparsed] = pd.to_datetime(stripped[unparsed], format=fmt, errors='coerce')
+        # When a column uses both formats of a pair, a value that reads as two different dates is rejected rather than guessed
+        for first, second in ambiguous_pairs:
+            first_dates = pd.to_datetime(stripped, format=first, errors='coerce')
+            second_dates = pd.to_datetime(stripped, format=second, errors='coerce')
+            parsed[(first_dates.notna() & second_dates.notna() & (first_dates != second_dates)).to_numpy()] = pd.NaT
+        unparseable = parsed.isna().to_numpy()
+        out_of_range = ((parsed < lower) | (parsed > upper)).to_numpy()
+        normalized = parsed.dt.strftime('%Y-%m-%d').to_numpy(dtype=object)
+        normalized[unparseable | out_of_range] = dates[unparseable | out_of_range].to_numpy(dtype=object)
+        return normalized, unparseable, out_of_range
+
+    codes, (normalized, unique_unparseable, unique_out_of_range) = map_distinct(values, parse, cache, broadcast=False)
+
+    # Map the distinct results back to the rows with one take; missing values have code -1 and stay missing
+    present = codes >= 0
+    unparseable = present & unique_unparseable[codes]
+    out_of_range = present & unique_out_of_range[codes]
+    result = pd.array(normalized, dtype=COMPACT_STRING_DTYPE).take(codes, allow_fill=True)
+    return pd.Series(result, index=values.index, name=values.name), unparseable, out_of_range
+
+# prompt: Create a function to normalize date columns with explicit formats and separate records with invalid dates
+
+def validate_date_columns(df, columns, formats=None, min_date='1900-01-01', max_date=None):
+    """Normalizes date columns to YYYY-MM-DD and separates records with invalid dates.
+
+    Args:
+      df: The pandas DataFrame.
+      columns: A list of date column names. Columns missing from df are skipped.
+      formats: Optional list of strftime formats. Detected per column when None.
+      min_date: The earliest valid date.
+      max_date: The latest valid date. Defaults to today.
+
+    Returns:
+      A tuple containing two DataFrames: (updated_df, invalid_records_df). invalid_records_df
+      has an 'error_reason' column with '<column>:unparseable_date' or '<column>:date_out_of_range'.
+
+    Raises:
+      Exception: Any error from the date checks is logged and re-raised, like the other cleaning steps.
+    """
+    try:
+        print_detail(f"Normalizing date columns: {columns}")
+        logging.info(f"Normalizing date columns: {columns}")
+        failed_checks = {}
+        normalized_columns = {}
+        for column in columns:
+            if column not in df.columns:
+                continue
+            # Invalid dates keep their original string so the error output shows what was wrong
+            normalized, unparseable, out_of_range = normalize_date_column(df[column], formats, min_date, max_date)
+            normalized_columns[column] = normalized
+            failed_checks[f"{column}:unparseable_date"] = unparseable
+            failed_checks[f"{column}:date_out_of_range"] = out_of_range
+
+        valid_df, invalid_records_df = split_by_failed_checks(df.assign(**normalized_columns), failed_checks)
+
+        print_detail(f"Date validation complete. Invalid records: {len(invalid_records_df)}")
+        logging.info(f"Date validation complete. Invalid records: {len(invalid_records_df)}")
+        return valid_df, invalid_records_df
+
+    except Exception as e:
+        # Returning df unchanged would pass every unchecked date as valid, so the chunk or batch fails instead
+        print(f"An error occurred during date validation: {e}")
+        logging.exception(f"An error occurred during date validation: {e}")
+        raise e
+
 # prompt: Create a function to remove the time from a date in specified columns
 
 def remove_time_from_date(df, columns):
@@ -257,7 +2481,7 @@ def remove_time_from_date(df, columns):
     The DataFrame with the time component removed from the specified columns.
   """
   try:
-    print(f"Removing time from specified date columns: {columns}")
+    print_detail(f"Removing time from specified date columns: {columns}")
     logging.info(f"Removing time from specified date columns: {columns}")
     for column in columns:
       if column in df.columns:
@@ -265,7 +2489,7 @@ def remove_time_from_date(df, columns):
         df[column] = pd.to_datetime(df[column], errors='coerce')
         # Remove the time component
         df[column] = df[column].dt.date
-    print("Date cleaning complete. Time removed from date columns.")
+    print_detail("Date cleaning complete. Time removed from date columns.")
     logging.info("Date cleaning complete. Time removed from date columns.")
     return df
   except Exception as e:
@@ -290,25 +2514,19 @@ def validate_and_remove_invalid_emails(df, email_column):
             and a new dataframe with records containing invalid email addresses.
     """
     try:
-        print(f"Removing invalid emails from {email_column}.")
+        print_detail(f"Removing invalid emails from {email_column}.")
         logging.info(f"Removing invalid emails from {email_column}.")
 
-        # Regular expression for basic email validation
-        email_regex = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-
-        # Create a new dataframe to store records with invalid email addresses
-        error_df = pd.DataFrame()
+        # Validate the whole column at once; missing emails count as invalid
+        emails = df[email_column]
+        not_null = emails.notna().to_numpy(dtype=bool)
+        is_valid = np.zeros(len(df), dtype=bool)
+        is_valid[not_null] = emails[not_null].astype(str).str.match(EMAIL_REGEX).fillna(False).to_numpy(dtype=bool)
 
-        # Iterate through the dataframe and validate email addresses
-        for index, row in df.iterrows():
-            email = row[email_column]
-            if not re.match(email_regex, email):
-                # Append record to the error dataframe
-                error_df = pd.concat([error_df, pd.DataFrame([row])], ignore_index=True)
-                # Drop the record from the original dataframe
-                df.drop(index, inplace=True)
+        error_df = df[~is_valid].reset_index(drop=True)
+        df = df[is_valid]
 
-        print("Validation complete. Invalid email records appended to error_df.")
+        print_detail("Validation complete. Invalid email records appended to error_df.")
         logging.info("Validation complete. Invalid email records appended to error_df.")
         return df, error_df
 
@@ -319,7 +2537,7 @@ def validate_and_remove_invalid_emails(df, email_column):
 
 # prompt: create a function to validate email addresses in a dataframe, all values in the column should be set as lower case, option to see the value as null if it matches a specified string or if the email address is invalid. Return the updated dataframe. Include error checking.
 
-def validate_email_dataframe(df, email_column, null_if_match=None):
+def validate_email_dataframe(df, email_column, null_if_match=None, return_errors=False):
     """Validates email addresses in a DataFrame column and optionally sets them to null.
 
     Args:
@@ -327,9 +2545,12 @@ def validate_email_dataframe(df, email_column, null_if_match=None):
       email_column: The name of the column containing email addresses.
       null_if_match: An optional string. If an email address matches this string
         or is invalid, it will be set to null.
+      return_errors: If True, also return a DataFrame of the records whose email
+        was present but invalid, holding the original email value.
 
     Returns:
-      The updated DataFrame with validated email addresses.
+      The updated DataFrame with validated email addresses, or a tuple of
+      (updated_df, error_df) when return_errors is True.
 
     Raises:
       KeyError: If email_column is not found in the DataFrame.
@@ -342,37 +2563,28 @@ def validate_email_dataframe(df, email_column, null_if_match=None):
             logging.error(f"Column '{email_column}' not found in DataFrame.")
             raise KeyError(f"Column '{email_column}' not found in DataFrame.")
 
-        print(f"Validating emails in column '{email_column}'.")
+        print_detail(f"Validating emails in column '{email_column}'.")
         logging.info(f"Validating emails in column '{email_column}'.")
 
-        # Function to validate email addresses
-        def validate_email(email):
-            try:
-                if email is None or pd.isnull(email):
-                    return None
-                email = str(email).lower()  # Convert to lowercase
-
-                # Check if the email matches the 'null_if_match' string
-                if null_if_match and null_if_match in str(email):
-                    #logging.info(f"Email '{email}' matches null_if_match condition, setting to None.")
-                    return None
-
-                # Regex pattern for valid email
-                pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-                if re.fullmatch(pattern, email):
-                    return email
-                else:
-                    #logging.warning(f"Email '{email}' is invalid, setting to None.")
-                    return None
-
-            except Exception as e:
-                print(f"Error validating email '{email}': {e}")
-                logging.error(f"Error validating email '{email}': {e}")
-                return None
-
-        # Apply the validation to the email column
-        df[email_column] = df[email_column].apply(validate_email)
-        print(f"Finished validating emails in column '{email_column}'.")
+        # Lowercase, placeholder check and regex match run once per distinct email, over all of them at once
+        def classify(emails):
+            lowered = emails.astype(str).str.lower()
+            if null_if_match:
+                is_placeholder = lowered.str.contains(null_if_match, regex=False).to_numpy(dtype=bool)
+            else:
+                is_placeholder = np.zeros(len(lowered), dtype=bool)
+            is_valid = lowered.str.fullmatch(EMAIL_REGEX).to_numpy(dtype=bool)
+            validated = lowered.to_numpy(dtype=object)
+            validated[~is_valid | is_placeholder] = None
+            return validated, ~is_valid & ~is_placeholder
+
+        validated, is_error = map_distinct(df[email_column], classify, get_value_cache(f"email:{null_if_match}"), fill_value=(None, False))
+
+        if return_errors:
+            error_df = df.iloc[np.flatnonzero(is_error)].copy()
+
+        df[email_column] = validated
+        print_detail(f"Finished validating emails in column '{email_column}'.")
         logging.info(f"Finished validating emails in column '{email_column}'.")
 
     except KeyError as e:
@@ -385,6 +2597,8 @@ def validate_email_dataframe(df, email_column, null_if_match=None):
         logging.exception(f"An error occurred while validating emails: {e}")
         raise e
 
+    if return_errors:
+        return df, error_df
     return df
 
 # Combine the list of specified columns into a new column
@@ -405,11 +2619,22 @@ def combine_columns(df, columns_to_combine, new_column_name, separator=" "):
   """
 
   try:
-    print(f"Combining columns: {columns_to_combine} into {new_column_name}.")
+    print_detail(f"Combining columns: {columns_to_combine} into {new_column_name}.")
     logging.info(f"Combining columns: {columns_to_combine} into {new_column_name}.")
-    df[new_column_name] = df[columns_to_combine].apply(lambda row: separator.join(row.dropna().astype(str)), axis=1)
+    # Build the combined strings column by column, adding the separator only between present values
+    combined = np.full(len(df), '', dtype=object)
+    has_value = np.zeros(len(df), dtype=bool)
+    for column in columns_to_combine:
+      values = df[column]
+      present = values.notna().to_numpy(dtype=bool)
+      text = values.astype(str).to_numpy(dtype=object)
+      needs_separator = has_value & present
+      combined[needs_separator] = combined[needs_separator] + separator
+      combined[present] = combined[present] + text[present]
+      has_value |= present
+    df[new_column_name] = combined
     df = df.drop(columns=columns_to_combine)
-    print(f"Combined columns:{columns_to_combine} successfully.")
+    print_detail(f"Combined columns:{columns_to_combine} successfully.")
     logging.info(f"Combined columns: {columns_to_combine} successfully.")
 
     return df
@@ -422,76 +2647,143 @@ def combine_columns(df, columns_to_combine, new_column_name, separator=" "):
     logging.error(f"An error occurred while combining columns: {e}.")
     raise e
 
+# Run the chunk cleaning steps (email validation, address combining, date and identifier checks) on a single dataframe
+def clean_chunk_dataframe(df, email_column_name='email', metrics=None, date_columns=DEFAULT_DATE_COLUMNS):
+  """Runs the standard cleaning steps on a single chunk of car owner records.
+
+  Args:
+    df: The pandas DataFrame holding one chunk of records.
+    email_column_name: The name of the email column.
+    metrics: An optional RunMetrics to record the email_validation, combine,
+      date_validation and identifier_check stages on.
+    date_columns: The date columns to normalize with validate_date_columns.
+
+  Returns:
+    A tuple containing two DataFrames: (cleaned_df, invalid_records_df)
+  """
+  with measure_stage(metrics, 'email_validation', len(df)):
+    df = validate_email_dataframe(df, email_column_name, 'noemail')
+  columns_to_combine = ['address', 'province', 'city', 'postal_code']
+  new_column_name = 'full_address'
+  with measure_stage(metrics, 'combine', len(df)):
+    df = combine_columns(df, columns_to_combine, new_column_name)
+  with measure_stage(metrics, 'date_validation', len(df)) as stage:
+    df, date_error_df = validate_date_columns(df, list(date_columns))
+    stage.rows_out, stage.rows_rejected = len(df), len(date_error_df)
+  with measure_stage(metrics, 'identifier_check', len(df)) as stage:
+    df, invalid_records_df = validate_identifier_columns(df)
+    stage.rows_out, stage.rows_rejected = len(df), len(invalid_records_df)
+  if len(date_error_df):
+    invalid_records_df = pd.concat([date_error_df, invalid_records_df])
+  return df, invalid_records_df
+
 # prompt: Create a function to get chunked csvs from a specified folder, runs the validation functions and merges the chunks into a specified final valid csv file and final error csv file. INclude error checking and logging.
 
-def process_chunked_csvs(input_folder, output_valid_csv, output_error_csv, email_column_name='email', date_columns=['created_at']):
+def process_chunked_csvs(input_folder, output_valid_csv, output_error_csv, email_column_name='email', date_columns=['date_of_birth'], checkpoint_folder=None, file_format='csv', metrics=None, pipelined=False, partition_by=None, compression=None):
   """
   Processes chunked CSV files from a specified folder, runs validation functions,
   and merges the results into final valid and error CSV files.
 
+  Each cleaned chunk is appended to the output files as soon as it is ready, so memory
+  is bounded by one chunk. The header is written once and the utf-8-sig BOM only at
+  the start of each file. Chunks are processed in chunk order.
+
   Args:
       input_folder (str): The path to the folder containing chunked CSV files.
       output_valid_csv (str): The path to the output CSV file for valid records.
       output_error_csv (str): The path to the output CSV file for error records.
-      output_duplicates_csv (str): The path to the output CSV file for duplicate records.
       email_column_name (str): The name of the email column.
-      date_columns (list): A list of column names to consider for date validation.
+      date_columns (list): The date columns to normalize to YYYY-MM-DD. Records with unparseable
+          or out-of-range dates go to the error output.
+      checkpoint_folder (str): Optional folder for per-chunk cleaned outputs and a checkpoint
+          manifest. When given, chunks that are unchanged since the last run are not cleaned
+          again; their checkpointed outputs are merged instead.
+      file_format (str): The format of the input chunks and checkpointed outputs: 'csv',
+          'parquet' or 'arrow'. The final valid and error files are always CSV.
+      metrics (RunMetrics): Optional metrics to record the read, cleaning and write stages on.
+      pipelined (bool): Read the next chunks and append the finished ones on background threads
+          while a chunk is cleaned. At most 2 * PIPELINE_QUEUE_SIZE + 3 chunks are held in memory.
+      partition_by (list): Optional partition columns, e.g. ['province'] or ['province', 'city'].
+          When given, output_valid_csv and output_error_csv are folders that receive one CSV per
+          partition and a manifest.json (see PartitionedCsvWriter). The partition values are read
+          from each chunk before cleaning, since combine_columns folds province and city into
+          full_address. Not available with checkpoint_folder, whose cleaned chunks no longer hold them.
+      compression (str): Optional codec, 'gzip' or 'zstd', for the checkpointed chunk outputs and the
+          partition files. The single output files are compressed by their extension instead, e.g.
+          output_valid_csv='cleaned.csv.gz'.
   """
 
   try:
     # Setup logging
     #logging.basicConfig(filename='processing_log.txt', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    valid_df = pd.DataFrame()
-    error_df = pd.DataFrame()
-
     print(f"Processing chunks for data cleaning & combining from {input_folder} to single cleaned file: {output_valid_csv}")
     logging.info(f"Processing chunks for data cleaning & combining from {input_folder} to single cleaned file: {output_valid_csv}")
 
-    for filename in os.listdir(input_folder):
-      if filename.endswith(".csv"):
-        file_path = os.path.join(input_folder, filename)
-        print(f"Processing chunk: {file_path}")
-        logging.info(f"Processing chunk: {file_path}")
-
-        try:
-          df = pd.read_csv(file_path, low_memory=True, encoding='utf-8')
-
-          # Run validation functions
-          df = validate_email_dataframe(df, email_column_name,'noemail')
-          columns_to_combine = ['address', 'province', 'city', 'postal_code']
-          new_column_name = 'full_address'
-          df = combine_columns(df, columns_to_combine, new_column_name)
-          columns_to_check = ['vehicle_identification_number', 'id_card_number']
-          df, chunk_error_df = validate_alphanumeric_columns(df, columns_to_check)
-
-          valid_df = pd.concat([valid_df, df], ignore_index=True)
-
-          # Concatenate error dataframes
-          #chunk_error_df = pd.concat([chunk_error_df,chunk_dup_error_df], ignore_index=True)
-          error_df = pd.concat([error_df, chunk_error_df], ignore_index=True)
-
-          print(f"File {file_path} processed successfully.")
-          logging.info(f"File {file_path} processed successfully.")
+    if partition_by and checkpoint_folder:
+      raise ValueError("partition_by cannot be combined with checkpoint_folder: checkpointed chunks no longer hold the partition columns.")
+
+    with open_csv_output(output_valid_csv, partition_by, compression=compression) as valid_output, \
+         open_csv_output(output_error_csv, partition_by, compression=compression) as error_output:
+
+      if checkpoint_folder:
+        results = process_chunked_csvs_output_folders(input_folder, os.path.join(checkpoint_folder, 'valid'), os.path.join(checkpoint_folder, 'error'),
+                                                      email_column_name, date_columns, manifest_path=os.path.join(checkpoint_folder, 'manifest.json'),
+                                                      file_format=file_format, metrics=metrics, pipelined=pipelined, compression=compression)
+        for result in results:
+          if result['success']:
+            # Read checkpointed CSV outputs as text so values are written back unchanged
+            with measure_stage(metrics, 'merge', result['valid_rows'] + result['error_rows']):
+              valid_output.write(read_intermediate(result['valid_file'], dtype=str, encoding='utf-8-sig'))
+              error_output.write(read_intermediate(result['error_file'], dtype=str, encoding='utf-8-sig'))
+      else:
+        file_paths = [os.path.join(input_folder, filename) for filename in list_chunk_files(input_folder, INTERMEDIATE_EXTENSIONS[file_format])]
+        queue_size = PIPELINE_QUEUE_SIZE if pipelined else 0
+
+        def read_chunk(file_path):
+          print_detail(f"Processing chunk: {file_path}")
+          logging.info(f"Processing chunk: {file_path}")
+          with measure_stage(metrics, 'read') as stage:
+            df = read_intermediate(file_path, **car_owner_read_options())
+            stage.rows_in = stage.rows_out = len(df)
+          return df
+
+        def write_chunk(file_path, df, chunk_error_df, partition_values):
+          try:
+            # Append the cleaned chunk and its errors straight to the final files
+            with measure_stage(metrics, 'write', len(df) + len(chunk_error_df)):
+              valid_output.write(df, partition_values)
+              error_output.write(chunk_error_df, partition_values)
+
+            print_detail(f"File {file_path} processed successfully.")
+            logging.info(f"File {file_path} processed successfully.")
+
+          except Exception as e:
+            print(f"Error processing file {file_path}: {e}")
+            logging.error(f"Error processing file {file_path}: {e}")
+
+        # With queue_size 0 the reads and writes run in this thread, one chunk after another
+        with BackgroundWriter(queue_size) as writer:
+          for file_path, df, read_error in prefetch(file_paths, read_chunk, queue_size):
+            try:
+              if read_error is not None:
+                raise read_error
 
-        except Exception as e:
-          print(f"Error processing file {file_path}: {e}")
-          logging.error(f"Error processing file {file_path}: {e}")
+              partition_values = df[list(partition_by)] if partition_by else None
 
-    # Remove duplicates from full dataframe
-    #valid_df, duplicates_df = remove_duplicate_records(valid_df, ['mail_address']) #remove duplicates based on email
-    #error_df = pd.concat([error_df, chunk_dup_error_df], ignore_index=True)
+              # Run validation functions
+              df, chunk_error_df = clean_chunk_dataframe(df, email_column_name, metrics, date_columns)
+              writer.submit(write_chunk, file_path, df, chunk_error_df, partition_values)
 
-    # Save final dataframes
-    valid_df.to_csv(output_valid_csv, index=False, encoding='utf-8-sig')
-    error_df.to_csv(output_error_csv, index=False, encoding='utf-8-sig')
-    #duplicates_df.to_csv(output_duplicates_csv, index=False)
+            except Exception as e:
+              print(f"Error processing file {file_path}: {e}")
+              logging.error(f"Error processing file {file_path}: {e}")
 
+    log_value_cache_stats()
     print(f"Final cleaned data saved to {output_valid_csv}.")
     logging.info(f"Final cleaned data saved to {output_valid_csv}.")
     print(f"Final garbage data saved to {output_error_csv}.")
     logging.info(f"Final garbage data saved to {output_error_csv}.")
-    #logging.info(f"Final duplicates data saved to {output_duplicates_csv}.")
 
   except Exception as e:
     print(f"Critical error during processing of chunks: {e}")
@@ -499,31 +2791,599 @@ def process_chunked_csvs(input_folder, output_valid_csv, output_error_csv, email
 
 # prompt: Create a function that will combine csv chunks from a specified folder into one csv file
 
-def combine_csv_chunks(input_folder, output_file):
+def combine_csv_chunks(input_folder, output_file, file_format='csv', metrics=None):
   """
   Combines multiple CSV chunks from a folder into a single CSV file.
 
   Args:
-    input_folder: The path to the folder containing CSV chunks.
-    output_file: The path to the output CSV file.
+    input_folder: The path to the folder containing CSV chunks. Compressed CSV chunks are read too.
+    output_file: The path to the output CSV file. It is compressed if it ends in .gz or .zst.
+    file_format: The format of the chunk files: 'csv', 'parquet' or 'arrow'. The output is always CSV.
+    metrics: An optional RunMetrics to record the read and write stages on.
   """
 
-  combined_df = pd.DataFrame()
   print(f"Combining CSV chunks from {input_folder}")
   logging.info(f"Combining CSV chunks from {input_folder}")
 
-  for filename in os.listdir(input_folder):
-    if filename.endswith(".csv"):
+  columns = None
+  with open_compressed(output_file, 'w', newline='', encoding='utf-8-sig') as output_handle:
+    for filename in list_chunk_files(input_folder, INTERMEDIATE_EXTENSIONS[file_format]):
       file_path = os.path.join(input_folder, filename)
       try:
-        df = pd.read_csv(file_path, encoding='utf-8')
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
+        # CSV chunks are read as text so values are written back unchanged
+        with measure_stage(metrics, 'read') as stage:
+          df = read_intermediate(file_path, dtype=str, encoding='utf-8-sig')
+          stage.rows_in = stage.rows_out = len(df)
+        with measure_stage(metrics, 'write', len(df)):
+          columns = _append_csv(df, output_handle, columns)
       except Exception as e:
         print(f"Error reading file {file_path}: {e}")
         logging.error(f"Error reading file {file_path}: {e}")
 
-  combined_df.to_csv(output_file, index=False, encoding='utf-8-sig')
   print(f"Combined CSV chunks saved to {output_file}")
   logging.info(f"Combined CSV chunks saved to {output_file}")
 
+# Append a dataframe to an already open CSV handle, writing the header only once
+def _append_csv(df, handle, columns=None):
+  """Appends a dataframe to an open CSV file handle.
+
+  The first non-empty-schema dataframe written sets the header. Later dataframes are
+  aligned to those columns so every appended row matches the header.
+
+  Args:
+    df: The pandas DataFrame to append.
+    handle: A text file handle opened for writing.
+    columns: The columns already written as the header, or None if no header has been written.
+
+  Returns:
+    The header columns of the file, or None if nothing has been written yet.
+  """
+  if df is None or len(df.columns) == 0:
+    return columns
+  if columns is None:
+    df.to_csv(handle, index=False)
+    return list(df.columns)
+  if list(df.columns) != columns:
+    df = df.reindex(columns=columns)
+  df.to_csv(handle, index=False, header=False)
+  return columns
+
+# Single-file CSV output with the same interface as PartitionedCsvWriter
+class CsvAppender:
+  """Appends DataFrames to one CSV file with _append_csv, writing the header and BOM once.
+
+  Args:
+    path: The path of the CSV file. It is overwritten, and compressed if it ends in .gz or .zst.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.handle = open_compressed(path, 'w', newline='', encoding='utf-8-sig')
+    self.columns = None
+
+  def write(self, df, partition_values=None):
+    """Appends the rows of df. partition_values is accepted for PartitionedCsvWriter compatibility and ignored."""
+    self.columns = _append_csv(df, self.handle, self.columns)
+
+  def close(self):
+    """Closes the file."""
+    self.handle.close()
 
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+# Partitioned CSV output: one file per partition in Hive-style folders, e.g. province=广东/city=广州市/part.csv
+PARTITION_MAX_OPEN_FILES = 64
+PARTITION_MANIFEST = 'manifest.json'
+# pyarrow.dataset and other Hive-style readers read this folder value back as a missing value
+MISSING_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+_UNSAFE_PARTITION_CHARACTERS = set('%/\\:*?"<>|=')
+
+def partition_folder_name(column, value):
+  """Returns the folder name of one partition level, e.g. 'province=广东'.
+
+  Missing and empty values map to MISSING_PARTITION. Characters that are not safe in folder names
+  are percent-encoded, which Hive-style readers decode.
+  """
+  if value is None or pd.isna(value) or str(value) == '':
+    return f"{column}={MISSING_PARTITION}"
+  escaped = ''.join(f"%{ord(character):02X}" if character in _UNSAFE_PARTITION_CHARACTERS or ord(character) < 32 else character
+                    for character in str(value))
+  return f"{column}={escaped}"
+
+class PartitionedCsvWriter:
+  """Streams DataFrames into one CSV file per partition, keeping a bounded number of files open.
+
+  Rows go to <output_folder>/<column>=<value>/.../part.csv, one folder level per partition column.
+  The partition values are encoded in the folder names rather than written in the files. Each file
+  gets its header once and the utf-8-sig BOM only at its start, like the single-file outputs. At
+  most max_open_files files are open at a time. When another one is needed, the least recently
+  written file is closed and later reopened for appending.
+
+  close() writes <output_folder>/manifest.json with the partition columns, the total row count and,
+  for every partition, its values, its file path relative to output_folder, its row count and its
+  size in bytes. When the folder holds a manifest from an earlier run, the files it lists are
+  removed first, so partitions that no longer have rows do not survive a re-run.
+
+  With compression, the files are named part.csv.gz or part.csv.zst, and a reopened file gets a new
+  gzip member or zstd frame appended, which readers of either format read as one stream.
+
+  Args:
+    output_folder: The folder to write the partitions and the manifest to.
+    partition_by: The partition columns, outermost first, e.g. ['province', 'city'].
+    max_open_files: The maximum number of partition files open at a time.
+    compression: Optional codec to compress the partition files with, 'gzip' or 'zstd'.
+  """
+
+  def __init__(self, output_folder, partition_by, max_open_files=PARTITION_MAX_OPEN_FILES, compression=None):
+    self.output_folder = output_folder
+    self.partition_by = list(partition_by)
+    self.max_open_files = max(1, max_open_files)
+    self.file_name = with_compression('part.csv', compression)
+    self.partitions = {}
+    self.handles = OrderedDict()
+    os.makedirs(output_folder, exist_ok=True)
+    self._remove_previous_partitions()
+
+  def _remove_previous_partitions(self):
+    manifest_path = os.path.join(self.output_folder, PARTITION_MANIFEST)
+    if not os.path.exists(manifest_path):
+      return
+    with open(manifest_path, encoding='utf-8') as f:
+      previous = json.load(f)
+    for partition in previous.get('partitions', []):
+      path = os.path.join(self.output_folder, *partition['path'].split('/'))
+      if os.path.exists(path):
+        os.remove(path)
+    os.remove(manifest_path)
+
+  def _handle(self, partition):
+    handle = self.handles.pop(partition['path'], None)
+    if handle is None:
+      if len(self.handles) >= self.max_open_files:
+        _, oldest = self.handles.popitem(last=False)
+        oldest.close()
+      path = os.path.join(self.output_folder, *partition['path'].split('/'))
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      # Reopened files are appended to without a BOM, which only goes at the start of a file
+      if partition['opened']:
+        handle = open_compressed(path, 'a', newline='', encoding='utf-8')
+      else:
+        handle = open_compressed(path, 'w', newline='', encoding='utf-8-sig')
+      partition['opened'] = True
+    self.handles[partition['path']] = handle
+    return handle
+
+  def write(self, df, partition_values=None):
+    """Appends the rows of df to their partition files, keeping their order within each partition.
+
+    Args:
+      df: The pandas DataFrame to write.
+      partition_values: An optional DataFrame holding the partition columns, indexed like df. It may
+        hold more rows than df, e.g. the whole chunk before cleaning. Defaults to the partition
+        columns of df, which are then left out of the written rows.
+    """
+    if partition_values is None:
+      keys = df[self.partition_by]
+      df = df.drop(columns=self.partition_by)
+    else:
+      keys = partition_values[self.partition_by].reindex(df.index)
+    if not len(df):
+      return
+
+    for values, positions in keys.groupby(self.partition_by, sort=False, dropna=False, observed=True).indices.items():
+      values = values if isinstance(values, tuple) else (values,)
+      path = '/'.join(partition_folder_name(column, value) for column, value in zip(self.partition_by, values)) + '/' + self.file_name
+      partition = self.partitions.get(path)
+      if partition is None:
+        partition = self.partitions[path] = {
+            'values': {column: None if pd.isna(value) or str(value) == '' else str(value) for column, value in zip(self.partition_by, values)},
+            'path': path, 'rows': 0, 'columns': None, 'opened': False}
+      rows = df.iloc[positions]
+      partition['columns'] = _append_csv(rows, self._handle(partition), partition['columns'])
+      partition['rows'] += len(rows)
+
+  def close(self):
+    """Closes every partition file and writes the manifest.
+
+    Returns:
+      The manifest dict.
+    """
+    for handle in self.handles.values():
+      handle.close()
+    self.handles.clear()
+    partitions = [{**partition['values'], 'path': partition['path'], 'rows': partition['rows'],
+                   'bytes': os.path.getsize(os.path.join(self.output_folder, *partition['path'].split('/')))}
+                  for _, partition in sorted(self.partitions.items())]
+    manifest = {'partition_by': self.partition_by, 'total_rows': sum(partition['rows'] for partition in partitions),
+                'partitions': partitions}
+    write_json_atomic(manifest, os.path.join(self.output_folder, PARTITION_MANIFEST))
+    return manifest
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+def open_csv_output(path, partition_by=None, max_open_files=PARTITION_MAX_OPEN_FILES, compression=None):
+  """Returns a PartitionedCsvWriter into the folder path if partition_by is given, otherwise a CsvAppender for the file path.
+
+  compression only applies to the partition files. A single file is compressed by the extension of path.
+  """
+  if partition_by:
+    return PartitionedCsvWriter(path, partition_by, max_open_files, compression)
+  return CsvAppender(path)
+
+# Read back only the partitions a query needs, using the manifest instead of listing folders
+def read_partitions(output_folder, workers=1, **filters):
+  """Reads the partitions of a PartitionedCsvWriter output folder that match the filters.
+
+  Only the matching files are read. The partition columns are added back as the first columns,
+  and values are read as text so they come back exactly as written.
+
+  Args:
+    output_folder: The folder holding the partitions and manifest.json.
+    workers: The number of threads reading partition files at once.
+    **filters: Partition values to keep, e.g. province='广东'. Pass a list to keep any of several
+      values, and None for missing values.
+
+  Returns:
+    A pandas DataFrame of the matching rows, in manifest order.
+  """
+  with open(os.path.join(output_folder, PARTITION_MANIFEST), encoding='utf-8') as f:
+    manifest = json.load(f)
+  unknown = set(filters) - set(manifest['partition_by'])
+  if unknown:
+    raise ValueError(f"Not partition columns of {output_folder}: {sorted(unknown)}")
+  wanted = {column: set(value) if isinstance(value, (list, tuple, set)) else {value} for column, value in filters.items()}
+  partitions = [partition for partition in manifest['partitions']
+                if all(partition[column] in values for column, values in wanted.items())]
+
+  def read_partition(partition):
+    df = pd.read_csv(os.path.join(output_folder, *partition['path'].split('/')), dtype=str, encoding='utf-8-sig')
+    for position, column in enumerate(manifest['partition_by']):
+      df.insert(position, column, partition[column])
+    return df
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    frames = list(executor.map(read_partition, partitions))
+  if not frames:
+    return pd.DataFrame(columns=manifest['partition_by'])
+  return pd.concat(frames, ignore_index=True)
+
+# Mark rows whose duplicate key was already seen in an earlier batch or earlier in the same batch
+def _find_streaming_duplicates(df, columns, seen_keys):
+  """Flags duplicate rows across batches, keeping the first occurrence of each key.
+
+  The batch's new keys are returned rather than added to seen_keys, so the caller adds them
+  only once the batch has been written. A batch that fails then does not mark the later
+  occurrences of its keys as duplicates.
+
+  Args:
+    df: The pandas DataFrame holding the current batch.
+    columns: A list of column names that make up the duplicate key.
+    seen_keys: A HashedKeySet or PersistentKeyIndex of keys already seen in earlier batches.
+
+  Returns:
+    A tuple of a boolean Series that is True for duplicate rows and a NumPy array of the
+    batch's keys that are not in seen_keys yet.
+  """
+  hashes = hash_key_columns(df, columns)
+  unique_hashes, first_positions = np.unique(hashes, return_index=True)
+  is_duplicate = np.ones(len(df), dtype=bool)
+  is_duplicate[first_positions] = False
+
+  already_seen = seen_keys.contains(unique_hashes)
+  is_duplicate[first_positions[already_seen]] = True
+  return pd.Series(is_duplicate, index=df.index), unique_hashes[~already_seen]
+
+# Stream the source CSV once through every cleaning stage, writing the valid, error and duplicate outputs as it goes
+def process_car_owners_pipeline(input_csv, output_valid_csv, output_error_csv, output_duplicates_csv, columns_to_drop, duplicate_columns, chunksize=250000, email_column_name='email', date_columns=['date_of_birth'], sep=',', quarantine_csv=None, workers=1, key_index_path=None, metrics=None, partition_by=None, compression=None):
+  """
+  Reads the source CSV once in bounded-size batches and pushes each batch through
+  column drop, duplicate removal and the chunk cleaning steps, appending the results
+  to the valid, error and duplicate CSV files as it goes. No intermediate files are written.
+
+  Args:
+      input_csv (str): The path to the source CSV file.
+      output_valid_csv (str): The path to the output CSV file for valid records.
+      output_error_csv (str): The path to the output CSV file for error records.
+      output_duplicates_csv (str): The path to the output CSV file for duplicate records.
+      columns_to_drop (list): A list of column names to drop from every batch.
+      duplicate_columns (list): A list of column names to consider for duplicate detection.
+      chunksize (int): The number of rows per batch.
+      email_column_name (str): The name of the email column.
+      date_columns (list): The date columns to normalize to YYYY-MM-DD. Records with unparseable
+          or out-of-range dates go to the error output.
+      sep (str): The delimiter used in the source CSV file.
+      quarantine_csv (str): Optional path for rows whose field count does not match the header.
+          When given, quarantine_malformed_rows checks the source first and the pipeline reads
+          the well-formed copy, which is removed at the end of the run.
+      workers (int): The number of worker processes for the malformed row check.
+      key_index_path (str): Optional path to a PersistentKeyIndex. When given, records whose key
+          was seen in an earlier run also go to the duplicates CSV, and this run's keys are added
+          to the index once the run completes. If any batch fails, the index is left unchanged.
+      metrics (RunMetrics): Optional metrics to record every stage on (quarantine, read,
+          drop_columns, dedup, email_validation, combine, date_validation, identifier_check, write).
+      partition_by (list): Optional partition columns, e.g. ['province'] or ['province', 'city'].
+          When given, output_valid_csv and output_error_csv are folders that receive one CSV per
+          partition and a manifest.json (see PartitionedCsvWriter). Duplicates stay in one file.
+      compression (str): Optional codec, 'gzip' or 'zstd', for the partition files. The input and
+          the single output files are compressed by their extension instead, e.g. input_csv='owners.csv.zst'.
+  """
+
+  wellformed_csv = None
+  seen_keys = None
+  try:
+    if quarantine_csv:
+      # The well-formed copy is compressed like the source it is copied from
+      wellformed_csv = with_compression(f"{os.path.splitext(with_compression(output_valid_csv, None))[0]}_wellformed.csv", compression_of(input_csv))
+      quarantine_malformed_rows(input_csv, wellformed_csv, quarantine_csv, workers=workers, sep=sep, metrics=metrics)
+      input_csv = wellformed_csv
+
+    print(f"Streaming {input_csv} through the cleaning pipeline in batches of {chunksize} rows.")
+    logging.info(f"Streaming {input_csv} through the cleaning pipeline in batches of {chunksize} rows.")
+
+    seen_keys = PersistentKeyIndex(key_index_path, duplicate_columns) if key_index_path else HashedKeySet()
+    batch_count = 0
+    failed_batches = 0
+
+    with open_csv_output(output_valid_csv, partition_by, compression=compression) as valid_output, \
+         open_csv_output(output_error_csv, partition_by, compression=compression) as error_output, \
+         CsvAppender(output_duplicates_csv) as duplicates_output:
+
+      # Dropped columns are never parsed and key columns are read as strings so keys hash the same way in every batch
+      read_options = car_owner_read_options(columns_to_drop, string_columns=duplicate_columns)
+      reader = pd.read_csv(input_csv, chunksize=chunksize, sep=sep, encoding='utf-8', low_memory=True, **read_options)
+      for batch in measure_batches(reader, metrics):
+        batch_count += 1
+        try:
+          with measure_stage(metrics, 'drop_columns', len(batch)):
+            batch = batch.drop(columns=columns_to_drop, errors="ignore")
+
+          with measure_stage(metrics, 'dedup', len(batch)) as stage:
+            is_duplicate, new_keys = _find_streaming_duplicates(batch, duplicate_columns, seen_keys)
+            duplicates_df = batch[is_duplicate]
+            batch = batch[~is_duplicate]
+            stage.rows_out, stage.rows_rejected = len(batch), len(duplicates_df)
+
+          # combine_columns folds province and city into full_address, so partition values are taken first
+          partition_values = batch[list(partition_by)] if partition_by else None
+          batch, batch_error_df = clean_chunk_dataframe(batch, email_column_name, metrics, date_columns)
+
+          with measure_stage(metrics, 'write', len(batch) + len(batch_error_df) + len(duplicates_df)):
+            duplicates_output.write(duplicates_df)
+            valid_output.write(batch, partition_values)
+            error_output.write(batch_error_df, partition_values)
+          # The keys count as seen only once the batch's rows are written
+          seen_keys.add(new_keys)
+
+          print_detail(f"Batch {batch_count} processed successfully.")
+          logging.info(f"Batch {batch_count} processed successfully.")
+
+        except Exception as e:
+          failed_batches += 1
+          print(f"Error processing batch {batch_count} of {input_csv}: {e}")
+          logging.error(f"Error processing batch {batch_count} of {input_csv}: {e}")
+
+    # A run with failed batches is incomplete, so its keys are not saved and it can be re-run as is
+    if key_index_path and failed_batches:
+      seen_keys.rollback()
+      print(f"{failed_batches} batches of {input_csv} failed, so the key index {key_index_path} was left unchanged.")
+      logging.warning(f"{failed_batches} batches of {input_csv} failed, so the key index {key_index_path} was left unchanged.")
+    elif key_index_path:
+      seen_keys.commit()
+    log_value_cache_stats()
+    print(f"Pipeline complete for {input_csv}. Valid data saved to {output_valid_csv}, errors to {output_error_csv}, duplicates to {output_duplicates_csv}.")
+    logging.info(f"Pipeline complete for {input_csv}. Valid data saved to {output_valid_csv}, errors to {output_error_csv}, duplicates to {output_duplicates_csv}.")
+
+  except FileNotFoundError:
+    print(f"Error: Input file not found at {input_csv}")
+    logging.error(f"Error: Input file not found at {input_csv}")
+  except Exception as e:
+    print(f"Critical error during pipeline processing: {e}")
+    logging.critical(f"Critical error during pipeline processing: {e}")
+  finally:
+    if isinstance(seen_keys, PersistentKeyIndex):
+      seen_keys.close()
+    if wellformed_csv and os.path.exists(wellformed_csv):
+      os.remove(wellformed_csv)
+
+# Number of rows sampled by estimate_data_quality to estimate the validation failure rates
+ESTIMATE_SAMPLE_ROWS = 100000
+
+# Wilson score interval for a share estimated from a sample
+def _wilson_interval(failures, sample_rows, z=1.96):
+  """Returns the (low, high) 95% confidence bounds of the share failures / sample_rows."""
+  if sample_rows == 0:
+    return 0.0, 1.0
+  share = failures / sample_rows
+  center = (share + z * z / (2 * sample_rows)) / (1 + z * z / sample_rows)
+  margin = z * np.sqrt(share * (1 - share) / sample_rows + z * z / (4 * sample_rows**2)) / (1 + z * z / sample_rows)
+  return max(0.0, center - margin), min(1.0, center + margin)
+
+def _share_estimate(failures, sample_rows, total_rows):
+  """Returns the report entry for a check that failed on failures of sample_rows sampled rows."""
+  low, high = _wilson_interval(failures, sample_rows)
+  share = failures / sample_rows if sample_rows else 0.0
+  return {'sample_failures': int(failures), 'share': share, 'share_low': low, 'share_high': high,
+          'estimated_rows': int(round(share * total_rows)),
+          'estimated_rows_low': int(round(low * total_rows)), 'estimated_rows_high': int(round(high * total_rows))}
+
+# Read a CSV in batches for estimate_data_quality, with pyarrow's much faster streaming reader when it is installed
+def _read_estimate_batches(input_csv, columns_to_drop, duplicate_columns, chunksize, sep, on_malformed):
+  """Yields the batches of a CSV as DataFrames of text columns, without the dropped columns.
+
+  Rows with the wrong number of fields are skipped after calling on_malformed(row). With pyarrow,
+  batches are CHUNK_BYTES of the file. Without it, the file is read in blocks of CHUNK_BYTES whose
+  ragged rows are found with the field count scan of quarantine_malformed_rows, since pd.read_csv
+  would stop at rows with too many fields and pad rows with too few. The rest of each block is
+  read by pd.read_csv in batches of chunksize rows.
+  """
+  if COMPACT_STRING_DTYPE == 'string':
+    read_options = car_owner_read_options(columns_to_drop, string_columns=duplicate_columns)
+    for header, block in iter_csv_record_blocks(input_csv):
+      expected_fields = len(next(csv.reader([header.decode('utf-8-sig')], delimiter=sep), []))
+      _, _, records = _scan_field_counts(block, 0, expected_fields, sep)
+      if records:
+        parts = []
+        position = 0
+        for record_offset, record_length, _, _ in records:
+          parts.append(block[position:record_offset])
+          on_malformed(block[record_offset:record_offset + record_length])
+          position = record_offset + record_length
+        parts.append(block[position:])
+        block = b''.join(parts)
+      for batch in pd.read_csv(io.BytesIO(header + block), chunksize=chunksize, sep=sep, encoding='utf-8', low_memory=True, **read_options):
+        yield batch.drop(columns=columns_to_drop, errors="ignore")
+    return
+
+  import pyarrow.csv
+  # Column names come from pandas, so generated names such as 'Unnamed: 21' match columns_to_drop
+  column_names = list(pd.read_csv(input_csv, sep=sep, encoding='utf-8', nrows=0).columns)
+  dropped = set(columns_to_drop or ())
+  kept = [column for column in column_names if column not in dropped]
+  reader = pyarrow.csv.open_csv(
+      input_csv,
+      read_options=pyarrow.csv.ReadOptions(column_names=column_names, skip_rows=1, block_size=CHUNK_BYTES),
+      parse_options=pyarrow.csv.ParseOptions(delimiter=sep, newlines_in_values=True, invalid_row_handler=on_malformed),
+      convert_options=pyarrow.csv.ConvertOptions(include_columns=kept, column_types={column: pyarrow.string() for column in kept},
+                                                 strings_can_be_null=True))
+  for record_batch in reader:
+    yield record_batch.to_pandas(types_mapper={pyarrow.string(): pd.StringDtype('pyarrow')}.get)
+
+# Profile a source CSV in one bounded-memory pass, before committing to a full cleaning run
+def estimate_data_quality(input_csv, columns_to_drop, duplicate_columns, report_path=None, sample_rows=ESTIMATE_SAMPLE_ROWS, chunksize=250000, email_column_name='email', date_columns=['date_of_birth'], sep=',', precision=HLL_PRECISION, seed=0, metrics=None):
+  """
+  Estimates how many duplicates, invalid emails and failed checks a source CSV holds, and how
+  much memory deduplicating it will need, without cleaning it.
+
+  The file is read once. Every batch is hashed into HyperLogLog sketches (one for the duplicate
+  key, one per column) and offered to a RowReservoir. The chunk cleaning steps then run on the
+  sampled rows only, and their failure rates are scaled up to the whole file with 95% Wilson
+  confidence bounds. Memory is bounded by one batch, the sample and the sketches.
+
+  Args:
+      input_csv (str): The path to the source CSV file.
+      columns_to_drop (list): Column names that are never parsed.
+      duplicate_columns (list): The column names of the duplicate key.
+      report_path (str): Optional path of the JSON estimate report.
+      sample_rows (int): The number of rows to run the cleaning steps on.
+      chunksize (int): The number of rows per batch when pyarrow is not installed.
+      email_column_name (str): The name of the email column.
+      date_columns (list): The date columns to check.
+      sep (str): The delimiter used in the source CSV file.
+      precision (int): The HyperLogLog precision. The duplicate estimate is within about
+          2 * 1.04 / sqrt(2^precision) of the distinct key count, 95% of the time.
+      seed (int): The sampling seed.
+      metrics (RunMetrics): Optional metrics to record the read, sketch, sample and
+          sample_validation stages on.
+
+  Returns:
+      The estimate report as a dict, or None if the input could not be read.
+  """
+  malformed_rows = 0
+
+  def skip_malformed(row):
+    nonlocal malformed_rows
+    malformed_rows += 1
+    return 'skip'
+
+  try:
+    print(f"Estimating data quality of {input_csv} from a {sample_rows}-row sample.")
+    logging.info(f"Estimating data quality of {input_csv} from a {sample_rows}-row sample.")
+    started = time.perf_counter()
+
+    key_sketch = HyperLogLog(precision)
+    column_sketches = {}
+    missing_counts = {}
+    in_memory_bytes = 0
+    reservoir = RowReservoir(sample_rows, seed)
+
+    batches = _read_estimate_batches(input_csv, columns_to_drop, duplicate_columns, chunksize, sep, skip_malformed)
+    for batch in measure_batches(batches, metrics):
+      with measure_stage(metrics, 'sketch', len(batch)):
+        # Key columns are hashed row by row and combined into the key hash. A sketch only needs each
+        # value once, so the other columns hash just the distinct values of the batch.
+        key_hashes = np.zeros(len(batch), dtype=np.uint64)
+        for column in batch.columns:
+          values = batch[column]
+          present = values.notna().to_numpy(dtype=bool)
+          missing_counts[column] = missing_counts.get(column, 0) + len(values) - int(present.sum())
+          if column in duplicate_columns:
+            hashes = pd.util.hash_pandas_object(values, index=False, categorize=False).to_numpy(dtype=np.uint64)
+            key_hashes = key_hashes * np.uint64(1000003) ^ hashes
+            hashes = hashes[present]
+          else:
+            hashes = pd.util.hash_array(values[present].unique(), categorize=False)
+          column_sketches.setdefault(column, HyperLogLog(precision)).add(hashes)
+        key_sketch.add(key_hashes)
+        in_memory_bytes += int(batch.memory_usage(index=False, deep=True).sum())
+      with measure_stage(metrics, 'sample', len(batch)):
+        reservoir.add(batch)
+
+    total_rows = reservoir.rows_seen
+    sample = reservoir.sample()
+    with measure_stage(metrics, 'sample_validation', len(sample)):
+      checks = {}
+      if len(sample):
+        # Invalid emails and the 'noemail' placeholder are set to null by the cleaning steps, not rejected
+        present = sample[email_column_name].notna().to_numpy(dtype=bool)
+        validated, email_error_df = validate_email_dataframe(sample.copy(), email_column_name, 'noemail', return_errors=True)
+        nulled = present & validated[email_column_name].isna().to_numpy(dtype=bool)
+        checks[f"{email_column_name}:invalid"] = _share_estimate(len(email_error_df), len(sample), total_rows)
+        checks[f"{email_column_name}:placeholder"] = _share_estimate(int(nulled.sum()) - len(email_error_df), len(sample), total_rows)
+
+        _, error_df = clean_chunk_dataframe(sample.copy(), email_column_name, None, date_columns)
+        checks['rejected'] = _share_estimate(len(error_df), len(sample), total_rows)
+        if len(error_df):
+          reason_counts = error_df['error_reason'].str.split(';').explode().value_counts()
+          for reason, failures in reason_counts.sort_index().items():
+            checks[reason] = _share_estimate(failures, len(sample), total_rows)
+
+    distinct_keys = min(key_sketch.count(), total_rows)
+    key_error = 2 * key_sketch.relative_error * distinct_keys
+    duplicates = {
+        'columns': list(duplicate_columns),
+        'distinct_keys': distinct_keys,
+        'estimated_rows': total_rows - distinct_keys,
+        'estimated_rows_low': max(0, int(total_rows - distinct_keys - key_error)),
+        'estimated_rows_high': min(total_rows, int(total_rows - distinct_keys + key_error)),
+        # HashedKeySet stores 8 bytes per unique key, and merging its two largest runs briefly needs two more copies
+        'hashed_key_set_mb': distinct_keys * 8 / 2**20,
+        'hashed_key_set_peak_mb': 3 * distinct_keys * 8 / 2**20,
+    }
+    columns = {column: {'distinct': min(sketch.count(), total_rows - missing_counts[column]), 'missing': missing_counts[column]}
+               for column, sketch in column_sketches.items()}
+
+    report = {'input': input_csv, 'rows': total_rows, 'malformed_rows': malformed_rows, 'sample_rows': len(sample),
+              'seconds': time.perf_counter() - started, 'hll_precision': precision, 'hll_relative_error': key_sketch.relative_error,
+              'in_memory_mb': in_memory_bytes / 2**20, 'duplicates': duplicates, 'checks': checks, 'columns': columns}
+    if report_path:
+      write_json_atomic(report, report_path)
+
+    print(f"Estimate for {input_csv}: {total_rows} rows ({malformed_rows} malformed), about {duplicates['estimated_rows']} duplicates "
+          f"({duplicates['estimated_rows_low']}-{duplicates['estimated_rows_high']}), dedup key set about {duplicates['hashed_key_set_mb']:.0f} MiB.")
+    logging.info(f"Estimate for {input_csv}: {total_rows} rows ({malformed_rows} malformed), about {duplicates['estimated_rows']} duplicates "
+                 f"({duplicates['estimated_rows_low']}-{duplicates['estimated_rows_high']}), dedup key set about {duplicates['hashed_key_set_mb']:.0f} MiB.")
+    for reason, estimate in checks.items():
+      print(f"  {reason}: about {estimate['estimated_rows']} rows ({estimate['share']:.2%}, {estimate['share_low']:.2%}-{estimate['share_high']:.2%})")
+      logging.info(f"  {reason}: about {estimate['estimated_rows']} rows ({estimate['share']:.2%}, {estimate['share_low']:.2%}-{estimate['share_high']:.2%})")
+    if report_path:
+      print(f"Estimate report saved to {report_path}.")
+      logging.info(f"Estimate report saved to {report_path}.")
+    return report
+
+  except FileNotFoundError:
+    print(f"Error: Input file not found at {input_csv}")
+    logging.error(f"Error: Input file not found at {input_csv}")
+  except Exception as e:
+    print(f"Error estimating data quality of {input_csv}: {e}")
+    logging.error(f"Error estimating data quality of {input_csv}: {e}")
+  return None
@@ -1,26 +1,56 @@
 # Import Custom Functions
 from ChinaCarOwnersNationWide_Juliett_functions import *
 
-# Step 1: Functions to run: 1. Drop unneccesary columns. 2. Check for duplicates, then use the valid CSV to create the chunks for further processing.
-# Drop unneccesary columns:
+# Streaming pipeline: reads the source CSV once and runs column drop, duplicate removal and the cleaning functions batch by batch, without intermediate files.
 input_csv = 'car-owners-china-v2.csv'
-output_csv = 'car-owners-china-v3.csv'
 columns_to_drop = ['gender', 'industry', 'monthly_salary', 'marital_status', 'education', 'brand', 'car_series', 'car_model', 'configuration', 'color', 'engine_number','Unnamed: 21']
-process_drop_cols_csv(input_csv, output_csv, columns_to_drop)
+# To preview a new extract first, estimate its duplicates, check failures and dedup memory in one fast pass, running the checks on a sample only:
+# estimate_data_quality(input_csv, columns_to_drop, duplicate_columns=['vehicle_identification_number','name', 'id_card_number'], report_path='estimate_report.json')
+# Worker processes re-import this module under the spawn and forkserver start methods, so the run only starts from main()
+def main():
+  # Per-batch console messages are turned off for large runs; per-stage timings, row counts and memory go to run_report.json instead.
+  set_verbosity(False)
+  metrics = RunMetrics(report_path='run_report.json')
+  process_car_owners_pipeline(input_csv, 'final_valid_data.csv', 'final_error_data.csv', 'car-owners-china_duplicate_data.csv', columns_to_drop, duplicate_columns=['vehicle_identification_number','name', 'id_card_number'], chunksize=250000, quarantine_csv='car-owners-china_malformed_data.csv', workers=os.cpu_count(), metrics=metrics)
+  metrics.finish()
+
+# For a new monthly extract, pass key_index_path='car_owner_keys.sqlite' to also move records already cleaned in earlier runs to the duplicates CSV.
+# To shard the valid and error outputs into one CSV per province (and city), pass folders and partition_by, then reload one slice with read_partitions:
+# process_car_owners_pipeline(input_csv, 'final_valid_data', 'final_error_data', 'car-owners-china_duplicate_data.csv', columns_to_drop, duplicate_columns=['vehicle_identification_number','name', 'id_card_number'], partition_by=['province', 'city'])
+# guangdong_df = read_partitions('final_valid_data', province='广东')
+# The source and the outputs can be gzip or Zstandard files: give them a .gz or .zst name, and pass compression='zstd' for files the functions name, such as partition files and chunks:
+# process_car_owners_pipeline('car-owners-china-v2.csv.zst', 'final_valid_data.csv.zst', 'final_error_data.csv.zst', 'car-owners-china_duplicate_data.csv.zst', columns_to_drop, duplicate_columns=['vehicle_identification_number','name', 'id_card_number'])
+
+# (Alternate) Staged run with intermediate files, kept for inspecting each step:
+# Step 1: Functions to run: 1. Drop unneccesary columns. 2. Check for duplicates, then use the valid CSV to create the chunks for further processing.
+# Quarantine rows with the wrong number of fields first, so the read_csv calls below do not fail on them:
+# quarantine_malformed_rows('car-owners-china-v2.csv', 'car-owners-china-v2_wellformed.csv', 'car-owners-china_malformed_data.csv', workers=os.cpu_count())
+# Drop unneccesary columns:
+# input_csv = 'car-owners-china-v2.csv'
+# output_csv = 'car-owners-china-v3.csv'
+# columns_to_drop = ['gender', 'industry', 'monthly_salary', 'marital_status', 'education', 'brand', 'car_series', 'car_model', 'configuration', 'color', 'engine_number','Unnamed: 21']
+# process_drop_cols_csv(input_csv, output_csv, columns_to_drop)
 
 # Check for Duplicates in the Original CSV:
-process_duplicates_csv('car-owners-china-v3.csv', 'car-owners-china_valid.csv', 'car-owners-china_duplicate_data.csv', sep=',', columns=['vehicle_identification_number','name', 'id_card_number'])
+# process_duplicates_csv('car-owners-china-v3.csv', 'car-owners-china_valid.csv', 'car-owners-china_duplicate_data.csv', sep=',', columns=['vehicle_identification_number','name', 'id_card_number'], chunksize=1000000)
 
 # Step 2: Function to split chunks based on the chunksize. Split the large CSV into chunks for further processing:
-split_csv_into_chunks('car-owners-china_valid.csv', 250000, 'chunks', sep=',')
+# split_csv_into_chunks('car-owners-china_valid.csv', 250000, 'chunks', sep=',')
+# Or cut the file by byte ranges without parsing it, which is much faster on large files:
+# split_csv_by_byte_ranges('car-owners-china_valid.csv', 'chunks')
 
 # Step 3: Run data cleaning functions and export chunks to specified output folders
-process_chunked_csvs_output_folders('chunks', 'cleaned_chunks', 'error_chunks')
+# process_chunked_csvs_output_folders('chunks', 'cleaned_chunks', 'error_chunks', workers=os.cpu_count())
 
 # Step 3 (Alternate): Run data cleaning functions and combine chunks to specified CSVs
 # Get chunked csvs from a specified folder, runs the validation functions and merges the chunks into a specified final valid csv file and final error csv file. INclude error checking and logging.
 # Run data cleaning functions and combine chunks to specified CSVs
-process_chunked_csvs('chunks', 'final_valid_data.csv', 'final_error_data.csv')
+# process_chunked_csvs('chunks', 'final_valid_data.csv', 'final_error_data.csv')
+# On one process, pipelined=True reads the next chunk and writes the last one on background threads while a chunk is cleaned:
+# process_chunked_csvs('chunks', 'final_valid_data.csv', 'final_error_data.csv', pipelined=True)
 
 # Step 4 (Optional): Function to Combine Chunks into a Single CSV
-combine_csv_chunks('cleaned_chunks', 'combined_cleaned_data.csv')
\ No newline at end of file
+# combine_csv_chunks('cleaned_chunks', 'combined_cleaned_data.csv')
+
+if __name__ == '__main__':
+  main()
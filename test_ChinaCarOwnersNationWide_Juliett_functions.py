@@ -0,0 +1,488 @@
+# Tests for the data cleaning functions. Run with: python -m pytest -q
+import csv
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ChinaCarOwnersNationWide_Juliett_functions as functions
+from ChinaCarOwnersNationWide_Juliett_functions import (
+    COMPACT_STRING_DTYPE, HashedKeySet, HyperLogLog, PersistentKeyIndex, RowReservoir, RunMetrics, check_id_card_numbers,
+    check_vins, combine_columns, estimate_data_quality, find_csv_byte_ranges, iter_csv_record_blocks, process_car_owners_pipeline,
+    process_duplicates_csv, quarantine_malformed_rows, read_csv_byte_range, validate_date_columns, validate_identifier_columns)
+
+ADDRESS_COLUMNS = ['address', 'province', 'city', 'postal_code']
+
+
+# Row-wise column combining as it was implemented before the vectorized version, kept as the reference
+def legacy_combine_columns(df, columns_to_combine, new_column_name, separator=" "):
+  df[new_column_name] = df[columns_to_combine].apply(lambda row: separator.join(row.dropna().astype(str)), axis=1)
+  return df.drop(columns=columns_to_combine)
+
+
+def make_address_frame(rows, seed=42):
+  """Builds address, province, city and postal_code columns with about 10% missing values in each."""
+  rng = np.random.default_rng(seed)
+  provinces = np.array(['北京', '广东', '浙江', '四川', '江苏'], dtype=object)
+  cities = np.array(['北京市', '广州市', '杭州市', '成都市', '南京市'], dtype=object)
+  df = pd.DataFrame({
+      'address': np.char.add('街道', np.arange(rows).astype(str)).astype(object),
+      'province': provinces[rng.integers(0, len(provinces), size=rows)],
+      'city': cities[rng.integers(0, len(cities), size=rows)],
+      'postal_code': rng.integers(100000, 999999, size=rows).astype(float),
+  })
+  for column in df.columns:
+    df.loc[rng.random(rows) < 0.1, column] = np.nan
+  return df
+
+
+def _full_address(df, combine):
+  return combine(df.copy(), ADDRESS_COLUMNS, 'full_address')['full_address'].astype(object)
+
+
+def test_combine_columns_matches_row_wise_implementation():
+  """The vectorized combine_columns gives the same full_address as the row-wise apply it replaced."""
+  df = make_address_frame(rows=20000)
+  assert _full_address(df, combine_columns).equals(_full_address(df, legacy_combine_columns))
+
+
+def test_combine_columns_matches_row_wise_implementation_on_edge_cases():
+  """Rows with every column missing, empty strings and float postal codes combine the same way."""
+  df = pd.DataFrame({
+      'address': ['街道1', np.nan, '', np.nan],
+      'province': ['广东', '北京', np.nan, np.nan],
+      'city': [np.nan, '北京市', '杭州市', np.nan],
+      'postal_code': [510000.0, np.nan, 310000.0, np.nan],
+  })
+  assert _full_address(df, combine_columns).equals(_full_address(df, legacy_combine_columns))
+
+
+def _date_errors(values, formats=None):
+  df = pd.DataFrame({'date_of_birth': pd.array(values, dtype=COMPACT_STRING_DTYPE)})
+  valid_df, invalid_records_df = validate_date_columns(df, ['date_of_birth'], formats=formats)
+  return valid_df['date_of_birth'].tolist(), dict(zip(invalid_records_df['date_of_birth'], invalid_records_df['error_reason']))
+
+
+def test_validate_date_columns_rejects_ambiguous_date_in_iso_column():
+  """A day/month date in a YYYY-MM-DD column goes to the error output instead of being parsed."""
+  dates = [f"1985-01-{day:02d}" for day in range(1, 29)]
+  valid, errors = _date_errors(dates + ['03/04/1985'])
+  assert valid == dates
+  assert errors == {'03/04/1985': 'date_of_birth:unparseable_date'}
+
+
+def test_validate_date_columns_rejects_dates_both_day_and_month_first_formats_read():
+  """With day-first and month-first dates in one column, only the dates that read one way pass."""
+  valid, errors = _date_errors(['25/12/1985', '12/25/1985', '05/05/1985', '03/04/1985'])
+  assert valid == ['1985-12-25', '1985-12-25', '1985-05-05']
+  assert errors == {'03/04/1985': 'date_of_birth:unparseable_date'}
+
+
+def test_validate_date_columns_uses_only_the_formats_passed():
+  """Explicit formats limit parsing; a day-first-only column reads 03/04/1985 as 3 April."""
+  valid, errors = _date_errors(['1985-01-02', '03/04/1985'], formats=['%d/%m/%Y'])
+  assert valid == ['1985-04-03']
+  assert errors == {'1985-01-02': 'date_of_birth:unparseable_date'}
+
+
+# Scalar GB 11643 and ISO 3779 check characters, written out independently of the vectorized checks
+def id_card_number(first_17):
+  total = sum(int(digit) * weight for digit, weight in zip(first_17, [7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2]))
+  return first_17 + '10X98765432'[total % 11]
+
+
+def vin(without_check):
+  values = dict(zip('0123456789', range(10)))
+  values.update(zip('ABCDEFGHJKLMNPRSTUVWXYZ', [1, 2, 3, 4, 5, 6, 7, 8, 1, 2, 3, 4, 5, 7, 9, 2, 3, 4, 5, 6, 7, 8, 9]))
+  total = sum(values[character] * weight for character, weight in zip(without_check, [8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2]))
+  return without_check[:8] + '0123456789X'[total % 11] + without_check[9:]
+
+
+@pytest.fixture(params=['string[pyarrow]', 'string'])
+def string_dtype(request, monkeypatch):
+  """Runs a test with the Arrow buffer reader and with the NumPy fallback used without pyarrow."""
+  if request.param == 'string[pyarrow]' and COMPACT_STRING_DTYPE != 'string[pyarrow]':
+    pytest.skip('pyarrow is not installed')
+  monkeypatch.setattr(functions, 'COMPACT_STRING_DTYPE', request.param)
+  return request.param
+
+
+def _failures(checks):
+  """Returns the reason codes each row failed, one list per row."""
+  rows = len(next(iter(checks.values())))
+  return [[reason.split(':')[1] for reason, failed in checks.items() if failed[row]] for row in range(rows)]
+
+
+ID_CARD_CASES = [
+    ('11010519491231002X', []),                                  # the GB 11643 example, check character X
+    ('11010519491231002x', []),                                  # lowercase x
+    (id_card_number('44030619850203123'), []),
+    ('110105491231002', []),                                     # 15 digits, born 1949-12-31, no check character
+    (None, []),
+    ('110105194912310021', ['bad_check_digit']),
+    (id_card_number('99010519491231002'), ['bad_region_code']),
+    (id_card_number('00010519491231002'), ['bad_region_code']),
+    (id_card_number('11010519490230002'), ['bad_birth_date']),   # 30 February
+    (id_card_number('11010518991231002'), ['bad_birth_date']),   # before 1900
+    (id_card_number('11010529991231002'), ['bad_birth_date']),   # in the future
+    ('110105491331002', ['bad_birth_date']),                     # 15 digits, month 13
+    ('990105491231002', ['bad_region_code']),
+    ('11010519491231002A', ['bad_characters']),
+    ('11010519491231002Ｘ', ['bad_characters']),                  # full-width X
+    ('1101051949123100', ['bad_length']),
+    ('', ['bad_length']),
+]
+
+
+def test_check_id_card_numbers(string_dtype):
+  """Each GB 11643 rule flags its own reason code, for 18- and 15-digit numbers."""
+  values = pd.Series([value for value, _ in ID_CARD_CASES], dtype=object)
+  assert _failures(check_id_card_numbers(values)) == [reasons for _, reasons in ID_CARD_CASES]
+
+
+def test_check_id_card_numbers_compares_birth_date(string_dtype):
+  """Numbers whose birth date differs from date_of_birth are flagged; missing or short dates are not compared."""
+  values = pd.Series(['11010519491231002X', '11010519491231002X', '110105491231002', '11010519491231002X'])
+  date_of_birth = pd.Series(['1949-12-31', '1950-01-01', '1949-12-30', None])
+  assert _failures(check_id_card_numbers(values, date_of_birth)) == [[], ['birth_date_mismatch'], ['birth_date_mismatch'], []]
+
+
+VIN_CASES = [
+    ('1M8GDM9AXKP042788', []),                                   # check digit X
+    ('1m8gdm9axkp042788', []),                                   # lowercase
+    ('1HGCM82633A004352', []),
+    ('11111111111111111', []),
+    (vin('LSVAU2A37N2183752'), []),
+    (None, []),
+    ('1M8GDM9A1KP042788', ['bad_check_digit']),
+    ('1HGCM82643A004352', ['bad_check_digit']),
+    ('1M8GDM9AXKP04278I', ['bad_characters']),                   # I, O and Q are not allowed
+    ('1M8GDM9AXKP04278O', ['bad_characters']),
+    ('1M8GDM9AXKQ042788', ['bad_characters']),
+    ('1M8GDM9AXKP04278-', ['bad_characters']),
+    ('1M8GDM9AXKP04278', ['bad_length']),
+    ('1M8GDM9AXKP0427880', ['bad_length']),
+]
+
+
+def test_check_vins(string_dtype):
+  """Each ISO 3779 rule flags its own reason code."""
+  values = pd.Series([value for value, _ in VIN_CASES], dtype=object)
+  assert _failures(check_vins(values)) == [reasons for _, reasons in VIN_CASES]
+
+
+def test_validate_identifier_columns_error_reasons(string_dtype):
+  """Rows failing several checks list every reason, joined with ';', and valid rows pass through."""
+  df = pd.DataFrame({
+      'id_card_number': ['11010519491231002X', '110105194912310021', id_card_number('99010519491231002'), '11010519491231002X'],
+      'vehicle_identification_number': ['1M8GDM9AXKP042788', '1M8GDM9AXKP042788', '1M8GDM9AXKP04278I', '1M8GDM9A1KP042788'],
+      'date_of_birth': ['1949-12-31', '1949-12-31', '1949-12-31', '1950-01-01'],
+  })
+  valid_df, invalid_records_df = validate_identifier_columns(df)
+  assert valid_df.index.tolist() == [0]
+  assert invalid_records_df['error_reason'].tolist() == [
+      'id_card_number:bad_check_digit',
+      'id_card_number:bad_region_code;vehicle_identification_number:bad_characters',
+      'id_card_number:birth_date_mismatch;vehicle_identification_number:bad_check_digit',
+  ]
+
+
+def _write_quoted_csv(path, rows=60, line_terminator='\n'):
+  """Writes a CSV whose note field holds newlines, quotes and commas and is longer than the ranges cut in the tests."""
+  with open(path, 'w', encoding='utf-8', newline='') as f:
+    writer = csv.writer(f, lineterminator=line_terminator)
+    writer.writerow(['id', 'note', 'city'])
+    for row in range(rows):
+      note = f'line one of {row}\nline "two", {row}\n\nline four' if row % 3 == 0 else f'plain {row}'
+      writer.writerow([row, note, '杭州市'])
+  with open(path, 'rb') as f:
+    data = f.read()
+  # Offsets where a record starts: after a newline with an even number of quotes before it
+  starts, quotes = set(), 0
+  for position, byte in enumerate(data):
+    if byte == ord('"'):
+      quotes += 1
+    elif byte == ord('\n') and quotes % 2 == 0:
+      starts.add(position + 1)
+  return data, starts
+
+
+@pytest.mark.parametrize('line_terminator', ['\n', '\r\n'])
+def test_find_csv_byte_ranges_cuts_only_at_record_boundaries(tmp_path, line_terminator):
+  """With ranges shorter than a quoted field, every cut is a record start and the ranges cover the file once."""
+  path = tmp_path / 'quoted.csv'
+  data, starts = _write_quoted_csv(path, line_terminator=line_terminator)
+  header, ranges = find_csv_byte_ranges(path, chunk_bytes=16)
+
+  assert header == data[:len(header)] and len(header) in starts
+  assert ranges[0][0] == len(header)
+  assert all(offset + length == next_offset for (offset, length), (next_offset, _) in zip(ranges, ranges[1:]))
+  assert ranges[-1][0] + ranges[-1][1] == len(data)
+  assert all(offset in starts and length > 0 for offset, length in ranges)
+
+  frames = [read_csv_byte_range(path, offset, length, header) for offset, length in ranges]
+  pd.testing.assert_frame_equal(pd.concat(frames, ignore_index=True), pd.read_csv(path))
+
+
+def test_iter_csv_record_blocks_cuts_where_byte_ranges_do(tmp_path):
+  """The streaming reader yields the same header and record blocks as the byte ranges, compressed or not."""
+  path = tmp_path / 'quoted.csv'
+  data, _ = _write_quoted_csv(path)
+  header, ranges = find_csv_byte_ranges(path, chunk_bytes=40)
+  expected = [(header, data[offset:offset + length]) for offset, length in ranges]
+
+  gzip_path = tmp_path / 'quoted.csv.gz'
+  with functions.open_compressed(gzip_path, 'wb') as f:
+    f.write(data)
+  assert list(iter_csv_record_blocks(path, block_bytes=40)) == expected
+  assert list(iter_csv_record_blocks(gzip_path, block_bytes=40)) == expected
+
+
+def _write_ragged_csv(path, repeats=8):
+  """Writes a CSV with short, long, blank and multi-line quoted rows.
+
+  Returns the bytes a well-formed copy must hold and the (line_number, field_count, record)
+  rows expected in the quarantine file.
+  """
+  records = ['{n},plain {n},杭州市', '{n},"quoted\nover, two lines",成都市', '{n},short', '', '{n},too,many,fields', '{n},"a ""quote""",北京市']
+  data, wellformed, quarantined = b'id,note,city\n', b'id,note,city\n', []
+  line = 2
+  for n in range(repeats):
+    for record in records:
+      encoded = (record.format(n=n) + '\n').encode('utf-8')
+      data += encoded
+      fields = len(next(csv.reader([record.format(n=n)]), []))
+      if record and fields != 3:
+        quarantined.append((line, fields, record.format(n=n)))
+      else:
+        wellformed += encoded
+      line += encoded.count(b'\n')
+  with open(path, 'wb') as f:
+    f.write(data)
+  return wellformed, quarantined
+
+
+@pytest.mark.parametrize('workers, compression', [(1, None), (2, None), (1, 'gzip')])
+def test_quarantine_malformed_rows(tmp_path, workers, compression):
+  """Ragged rows go to quarantine with their line numbers across range boundaries; blank lines pass through."""
+  source = tmp_path / 'ragged.csv'
+  wellformed, expected = _write_ragged_csv(source)
+  if compression:
+    with open(source, 'rb') as f, functions.open_compressed(tmp_path / 'ragged.csv.gz', 'wb') as out:
+      out.write(f.read())
+    source = tmp_path / 'ragged.csv.gz'
+  metrics = RunMetrics()
+
+  # 48-byte ranges put cuts between most records, including right after quoted newlines
+  count = quarantine_malformed_rows(str(source), str(tmp_path / 'ok.csv'), str(tmp_path / 'bad.csv'), chunk_bytes=48, workers=workers, metrics=metrics)
+
+  assert count == len(expected) == 16
+  with open(tmp_path / 'ok.csv', 'rb') as f:
+    assert f.read() == wellformed
+  quarantine = pd.read_csv(tmp_path / 'bad.csv', encoding='utf-8-sig', dtype={'record': str})
+  assert list(quarantine.itertuples(index=False, name=None)) == expected
+  stage = metrics.stages['quarantine']
+  assert (stage['rows_in'], stage['rows_out'], stage['rows_rejected']) == (40, 24, 16)
+  assert len(pd.read_csv(tmp_path / 'ok.csv')) == 24
+
+
+def _write_owner_keys_csv(path, rows=400, seed=7):
+  """Writes a CSV whose email/name keys repeat across the file, with missing emails among them."""
+  rng = np.random.default_rng(seed)
+  emails = np.array([f'owner{n}@example.com' for n in range(40)] + [None], dtype=object)[rng.integers(0, 41, size=rows)]
+  names = np.array(['张伟', '王芳', '李娜'], dtype=object)[rng.integers(0, 3, size=rows)]
+  df = pd.DataFrame({'row': np.arange(rows), 'email': emails, 'name': names, 'city': '杭州市'})
+  df.to_csv(path, index=False, encoding='utf-8')
+  return df
+
+
+def test_streaming_dedup_keeps_first_occurrence_like_drop_duplicates(tmp_path):
+  """Hashed-key dedup over 7-row chunks writes the same valid and duplicate rows as the in-memory path."""
+  source = tmp_path / 'owners.csv'
+  df = _write_owner_keys_csv(source)
+  columns = ['email', 'name']
+
+  process_duplicates_csv(str(source), str(tmp_path / 'valid.csv'), str(tmp_path / 'dups.csv'), columns)
+  process_duplicates_csv(str(source), str(tmp_path / 'valid_streamed.csv'), str(tmp_path / 'dups_streamed.csv'), columns, chunksize=7)
+
+  expected_valid = df.drop_duplicates(subset=columns, keep='first')['row'].tolist()
+  assert 7 < len(expected_valid) < len(df) - 7
+  for valid_csv, dups_csv in (('valid.csv', 'dups.csv'), ('valid_streamed.csv', 'dups_streamed.csv')):
+    assert pd.read_csv(tmp_path / valid_csv, encoding='utf-8-sig')['row'].tolist() == expected_valid
+    assert pd.read_csv(tmp_path / dups_csv, encoding='utf-8-sig')['row'].tolist() == sorted(set(df['row']) - set(expected_valid))
+  pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'valid_streamed.csv', encoding='utf-8-sig'), pd.read_csv(tmp_path / 'valid.csv', encoding='utf-8-sig'))
+  pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'dups_streamed.csv', encoding='utf-8-sig'), pd.read_csv(tmp_path / 'dups.csv', encoding='utf-8-sig'))
+
+
+def test_hashed_key_set_finds_keys_across_merged_runs():
+  """Keys added in many batches stay findable after the sorted runs are merged."""
+  rng = np.random.default_rng(3)
+  keys = np.unique(rng.integers(0, 2**63, size=5000, dtype=np.uint64) * np.uint64(2))
+  seen = HashedKeySet()
+  for batch in np.array_split(rng.permutation(keys), 37):
+    assert not seen.contains(batch).any()
+    seen.add(batch)
+  assert len(seen) == len(keys) and len(seen.runs) <= 13
+  assert seen.contains(keys).all()
+  assert not seen.contains(keys + np.uint64(1)).any()
+
+
+def test_persistent_key_index_commit_and_rollback(tmp_path):
+  """Only committed keys are seen after reopening, and the stored key count follows them."""
+  path = str(tmp_path / 'keys.sqlite')
+  committed = np.array([1, 2, 2**63 + 5], dtype=np.uint64)
+  with PersistentKeyIndex(path, ['email', 'name']) as index:
+    index.add(committed)
+    index.commit()
+    index.add(np.array([7, 8], dtype=np.uint64))
+    assert len(index) == 5
+    index.rollback()
+    assert len(index) == 3
+    index.add(np.array([9], dtype=np.uint64))
+  with PersistentKeyIndex(path, ['email', 'name']) as index:
+    assert len(index) == 3
+    assert index.contains(np.array([1, 2**63 + 5, 7, 9], dtype=np.uint64)).tolist() == [True, True, False, False]
+
+
+def test_persistent_key_index_refuses_other_key_columns(tmp_path):
+  """An index built on one set of key columns cannot be reused with another."""
+  path = str(tmp_path / 'keys.sqlite')
+  PersistentKeyIndex(path, ['email', 'name']).close()
+  with pytest.raises(ValueError, match='was built on columns'):
+    PersistentKeyIndex(path, ['email'])
+
+
+def test_process_duplicates_csv_key_index_across_runs(tmp_path):
+  """A second run of the same extract against the key index sends every row to duplicates."""
+  source = tmp_path / 'owners.csv'
+  df = _write_owner_keys_csv(source)
+  columns = ['email', 'name']
+  index_path = str(tmp_path / 'keys.sqlite')
+  unique_rows = len(df.drop_duplicates(subset=columns))
+
+  for run in ('first', 'second'):
+    process_duplicates_csv(str(source), str(tmp_path / f'valid_{run}.csv'), str(tmp_path / f'dups_{run}.csv'), columns, chunksize=50, key_index_path=index_path)
+  assert len(pd.read_csv(tmp_path / 'valid_first.csv', encoding='utf-8-sig')) == unique_rows
+  assert len(pd.read_csv(tmp_path / 'valid_second.csv', encoding='utf-8-sig')) == 0
+  assert len(pd.read_csv(tmp_path / 'dups_second.csv', encoding='utf-8-sig')) == len(df)
+  with PersistentKeyIndex(index_path, columns) as index:
+    assert len(index) == unique_rows
+
+
+def test_pipeline_failed_batch_leaves_key_index_unchanged(tmp_path, monkeypatch):
+  """A run with a failed batch records no keys, so re-running the extract writes all of it."""
+  source = tmp_path / 'owners.csv'
+  df = _write_owner_keys_csv(source)
+  columns = ['email', 'name']
+  index_path = str(tmp_path / 'keys.sqlite')
+  unique_rows = len(df.drop_duplicates(subset=columns))
+  batches = []
+
+  # The cleaning steps themselves are covered elsewhere; here every row is valid and the third batch fails
+  def clean_chunk(batch, *args, **kwargs):
+    batches.append(len(batch))
+    if len(batches) == 3:
+      raise RuntimeError('batch failed')
+    return batch, batch.iloc[:0]
+  monkeypatch.setattr(functions, 'clean_chunk_dataframe', clean_chunk)
+
+  def run(name):
+    process_car_owners_pipeline(str(source), str(tmp_path / f'valid_{name}.csv'), str(tmp_path / f'errors_{name}.csv'),
+                                str(tmp_path / f'dups_{name}.csv'), [], columns, chunksize=50, key_index_path=index_path)
+    with PersistentKeyIndex(index_path, columns) as index:
+      return len(pd.read_csv(tmp_path / f'valid_{name}.csv', encoding='utf-8-sig')), len(index)
+
+  valid_rows, keys = run('failed')
+  assert valid_rows < unique_rows and keys == 0
+  assert run('retry') == (unique_rows, unique_rows)
+  assert run('again') == (0, unique_rows)
+
+
+def _random_hashes(count, seed):
+  return np.random.default_rng(seed).integers(0, 2**64, size=count, dtype=np.uint64, endpoint=False)
+
+
+@pytest.mark.parametrize('distinct', [0, 1, 50, 5000, 200000, 1000000])
+def test_hyperloglog_count_within_stated_error(distinct):
+  """The estimate is within four standard errors (1.04 / sqrt(m)) of the true count, small and large."""
+  sketch = HyperLogLog(14)
+  hashes = _random_hashes(distinct, seed=distinct)
+  sketch.add(hashes)
+  sketch.add(hashes[:distinct // 2])
+  assert abs(sketch.count() - distinct) <= max(1, 4 * sketch.relative_error * distinct)
+
+
+def test_hyperloglog_merge_matches_sketch_of_union():
+  """Merging two sketches gives the registers of one sketch fed both inputs, and counts the union."""
+  first, second = _random_hashes(30000, seed=1), _random_hashes(30000, seed=2)
+  shared = np.concatenate([first[:10000], second])
+  left, right, union = HyperLogLog(12), HyperLogLog(12), HyperLogLog(12)
+  left.add(first)
+  right.add(shared)
+  union.add(np.concatenate([first, shared]))
+  left.merge(right)
+  assert np.array_equal(left.registers, union.registers)
+  assert abs(left.count() - 60000) <= 4 * left.relative_error * 60000
+  with pytest.raises(ValueError):
+    left.merge(HyperLogLog(13))
+
+
+def test_row_reservoir_sample_is_uniform_and_in_stream_order():
+  """Every part of the stream is represented about equally, rows keep stream order and a seed repeats the sample."""
+  chunks = [pd.DataFrame({'row': np.arange(start, start + 1000)}) for start in range(0, 20000, 1000)]
+
+  def sample(seed, size=2000):
+    reservoir = RowReservoir(size, seed)
+    for chunk in chunks:
+      reservoir.add(chunk)
+    assert reservoir.rows_seen == 20000
+    return reservoir.sample()['row'].to_numpy()
+
+  rows = sample(seed=5)
+  assert len(rows) == 2000 and np.all(np.diff(rows) > 0)
+  # 200 rows are expected per 2000-row stretch, with a standard deviation of about 13
+  assert np.all(np.abs(np.bincount(rows // 2000, minlength=10) - 200) < 60)
+  assert np.array_equal(sample(seed=5), rows) and not np.array_equal(sample(seed=6), rows)
+  assert np.array_equal(sample(seed=5, size=50000), np.arange(20000))
+
+
+def _write_estimate_csv(path, rows=3000, seed=11):
+  """Writes owner rows with repeated keys, invalid emails and bad dates, plus ragged and blank lines.
+
+  Returns the number of well-formed rows, of ragged rows and of distinct keys.
+  """
+  rng = np.random.default_rng(seed)
+  emails = np.where(rng.random(rows) < 0.1, 'broken@@example', np.char.add(np.char.add('owner', rng.integers(0, 1500, size=rows).astype(str)), '@example.com'))
+  dates = np.where(rng.random(rows) < 0.05, '1985-02-30', '1985-03-04')
+  df = pd.DataFrame({'email': emails, 'name': '张伟', 'date_of_birth': dates, 'address': '街道1', 'province': '浙江', 'city': '杭州市', 'postal_code': '310000'})
+  lines = df.to_csv(index=False).splitlines()
+  ragged = 0
+  with open(path, 'w', encoding='utf-8', newline='') as f:
+    for number, line in enumerate(lines):
+      f.write(line + '\n')
+      if number and number % 97 == 0:
+        f.write('short,row\n' if number % 2 else 'x@example.com,张伟,1985-03-04,街道1,浙江,杭州市,310000,extra\n')
+        ragged += 1
+      if number % 250 == 0:
+        f.write('\n')
+  return rows, ragged, len(df.drop_duplicates(subset=['email', 'name']))
+
+
+def test_estimate_data_quality_without_pyarrow_matches_pyarrow(tmp_path, monkeypatch):
+  """The pandas fallback skips and counts the same ragged rows as the pyarrow reader, and estimates the same checks."""
+  source = str(tmp_path / 'owners.csv')
+  rows, ragged, distinct_keys = _write_estimate_csv(source)
+  reports = {}
+  for dtype in ('string[pyarrow]', 'string'):
+    if dtype == 'string[pyarrow]' and COMPACT_STRING_DTYPE != 'string[pyarrow]':
+      continue
+    monkeypatch.setattr(functions, 'COMPACT_STRING_DTYPE', dtype)
+    report = estimate_data_quality(source, [], ['email', 'name'], sample_rows=rows, chunksize=700)
+    assert (report['rows'], report['malformed_rows'], report['sample_rows']) == (rows, ragged, rows)
+    assert abs(report['duplicates']['distinct_keys'] - distinct_keys) <= 0.01 * distinct_keys
+    assert report['checks']['email:invalid']['sample_failures'] > 0
+    assert report['checks']['date_of_birth:unparseable_date']['sample_failures'] > 0
+    reports[dtype] = report
+  if len(reports) == 2:
+    assert reports['string']['checks'] == reports['string[pyarrow]']['checks']
+    assert reports['string']['duplicates'] == reports['string[pyarrow]']['duplicates']